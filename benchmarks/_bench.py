@@ -0,0 +1,177 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Helpers shared by the benchmarks.
+
+measure() runs one step, and records its wall and cpu time, the resident
+memory before and after it, and the peak resident memory while it ran. The
+step is a progress.Phase, so on Linux the peak is exact (the high water mark
+is reset before the step), elsewhere it is only sampled before and after. write_results() saves the
+records as json, with enough about the environment to compare runs of
+different versions.
+"""
+
+import gc
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+try:
+    import meliae
+except ImportError:
+    # Run from a source tree (after 'setup.py build_ext -i')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    import meliae
+from meliae import progress
+
+
+def _read_proc(path):
+    try:
+        f = open(path, 'rb')
+    except EnvironmentError:
+        return None
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def get_syscalls():
+    """The (read, write) system calls made by this process, or None."""
+    content = _read_proc('/proc/self/io')
+    if content is None:
+        return None
+    m_read = re.search(br'syscr:\s*(\d+)', content)
+    m_write = re.search(br'syscw:\s*(\d+)', content)
+    if m_read is None or m_write is None:
+        return None
+    return int(m_read.group(1)), int(m_write.group(1))
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def measure(name, func, *args, **kwargs):
+    """Run func(*args, **kwargs), and measure it.
+
+    :return: (result, record) the return value of func, and a dict of what
+        was measured.
+    """
+    gc.collect()
+    rss_before = progress.get_rss()
+    syscalls_before = get_syscalls()
+    cpu_start = _cpu_time()
+    # Phases started by func (such as those of loader.load) keep the peak of
+    # this one up to date
+    phase = progress.ProgressReporter().start_phase(name)
+    wall_start = time.time()
+    result = func(*args, **kwargs)
+    wall_time = time.time() - wall_start
+    phase.finish()
+    cpu_time = _cpu_time() - cpu_start
+    syscalls_after = get_syscalls()
+    rss_after = progress.get_rss()
+    peak_rss = phase.peak_rss
+    if rss_after is not None and (peak_rss is None or rss_after > peak_rss):
+        peak_rss = rss_after
+    record = {
+        'name': name,
+        'wall_time': wall_time,
+        'cpu_time': cpu_time,
+        'rss_before': rss_before,
+        'rss_after': rss_after,
+        'peak_rss': peak_rss,
+        'exact_peak': phase.exact_peak,
+        }
+    if rss_before is not None:
+        record['peak_extra'] = peak_rss - rss_before
+    if syscalls_before is not None and syscalls_after is not None:
+        record['read_syscalls'] = syscalls_after[0] - syscalls_before[0]
+        record['write_syscalls'] = syscalls_after[1] - syscalls_before[1]
+    return result, record
+
+
+def parse_count(text):
+    """Parse a count like '1M', '500k' or '1000'."""
+    text = text.strip().lower()
+    scale = 1
+    if text.endswith('k'):
+        scale = 1000
+        text = text[:-1]
+    elif text.endswith('m'):
+        scale = 1000 * 1000
+        text = text[:-1]
+    return int(float(text) * scale)
+
+
+def _mib(value):
+    if value is None:
+        return '     -'
+    return '%6.1f' % (value / 1024. / 1024,)
+
+
+def format_records(records):
+    """A table of the time and memory of each record."""
+    out = ['%-34s %9s %9s %10s %10s' % ('step', 'wall s', 'cpu s',
+                                        'peak MiB', 'extra MiB')]
+    for record in records:
+        if record.get('skipped'):
+            out.append('%-34s skipped: %s' % (record['name'],
+                                              record['skipped']))
+            continue
+        out.append('%-34s %9.3f %9.3f %10s %10s'
+                   % (record['name'], record['wall_time'],
+                      record['cpu_time'], _mib(record['peak_rss']),
+                      _mib(record.get('peak_extra'))))
+    return '\n'.join(out)
+
+
+def write_results(filename, benchmark, params, records, extra=None):
+    """Write the results of a benchmark run as json.
+
+    :param filename: Where to write, '-' for stdout.
+    :param benchmark: The name of the benchmark.
+    :param params: A dict of the parameters of the run (such as how many
+        objects).
+    :param records: The records from measure().
+    :param extra: A dict of other results, such as a model fitted to the
+        records.
+    """
+    doc = {
+        'benchmark': benchmark,
+        'meliae_version': meliae.__version__,
+        'python_version': platform.python_version(),
+        'python_implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'params': params,
+        'results': records,
+        }
+    if extra:
+        doc.update(extra)
+    content = json.dumps(doc, indent=1, sort_keys=True) + '\n'
+    if filename == '-':
+        sys.stdout.write(content)
+        return
+    f = open(filename, 'w')
+    try:
+        f.write(content)
+    finally:
+        f.close()
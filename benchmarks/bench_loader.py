@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time loading a dump, and the main steps of looking at it.
+
+A synthetic dump (see gendump.py) is written to a temporary file, unless an
+existing dump is given. Each step is measured by _bench.measure():
+
+  parse regex / parse json
+      Parse every line with loader._from_line / _from_json, without
+      keeping the objects. This includes reading the file.
+  load
+      loader.load() into a MemObjectCollection, without collapsing.
+  collapse_instance_dicts, compute_parents, summarize
+      The ObjManager methods, run in the same order as load() does.
+  compute_total_size
+      For the first few modules, which reach most of the dump.
+
+For example, to compare two versions at 10M objects:
+  python benchmarks/bench_loader.py --objects 10M --output before.json
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import _bench
+import gendump
+
+from meliae import (
+    _loader,
+    files,
+    loader,
+    )
+
+
+def _parse_all(filename, decoder):
+    source, cleanup = files.open_file(filename)
+    if cleanup is None:
+        cleanup = source.close
+    factory = _loader._MemObjectProxy_from_args
+    temp_cache = {}
+    count = 0
+    try:
+        for line in source:
+            if line in (b'[\n', b']\n'):
+                continue
+            if line.endswith(b',\n'):
+                line = line[:-2]
+            decoder(factory, line, temp_cache=temp_cache)
+            count += 1
+    finally:
+        cleanup()
+    return count
+
+
+def _total_sizes(manager, num_roots):
+    roots = manager.get_all('module')[:num_roots]
+    for obj in roots:
+        manager.compute_total_size(obj)
+    return len(roots)
+
+
+def _add_rate(record, num_objects):
+    record['objects'] = num_objects
+    if record['wall_time'] > 0:
+        record['objects_per_second'] = num_objects / record['wall_time']
+
+
+def run(filename, num_roots=3, using_json=None):
+    """Measure each step over the dump in filename.
+
+    :param num_roots: How many modules to compute_total_size() for.
+    :param using_json: Also measure parsing with simplejson (None if it is
+        available), and load with it.
+    :return: A list of records, see _bench.measure.
+    """
+    if using_json is None:
+        using_json = (loader.simplejson is not None)
+    records = []
+    def add(name, func, *args, **kwargs):
+        result, record = _bench.measure(name, func, *args, **kwargs)
+        records.append(record)
+        sys.stderr.write('%s: %.3fs\n' % (name, record['wall_time']))
+        return result, record
+    num_lines, record = add('parse regex', _parse_all, filename,
+                            loader._from_line)
+    _add_rate(record, num_lines)
+    if using_json:
+        _, record = add('parse json', _parse_all, filename,
+                        loader._from_json)
+        _add_rate(record, num_lines)
+    elif loader.simplejson is None:
+        records.append({'name': 'parse json',
+                        'skipped': 'simplejson is not available'})
+    manager, record = add('load', loader.load, filename,
+                          using_json=using_json, show_prog=False,
+                          collapse=False)
+    _add_rate(record, len(manager.objs))
+    _, record = add('collapse_instance_dicts',
+                    manager.collapse_instance_dicts)
+    _add_rate(record, len(manager.objs))
+    _, record = add('compute_parents', manager.compute_parents)
+    _add_rate(record, len(manager.objs))
+    _, record = add('summarize', manager.summarize)
+    _add_rate(record, len(manager.objs))
+    num_roots, record = add('compute_total_size', _total_sizes, manager,
+                            num_roots)
+    record['roots'] = num_roots
+    return records
+
+
+def main(args):
+    import optparse
+    p = optparse.OptionParser('%prog [options]')
+    p.add_option('--objects', default='1M',
+                 help='How many objects to generate, such as 1M, 10M or 50M'
+                      ' [default %default]')
+    p.add_option('--seed', type='int', default=0,
+                 help='Generate a different dump [default %default]')
+    p.add_option('--dump', default=None,
+                 help='Use this dump, rather than generating one.')
+    p.add_option('--keep', default=None, metavar='FILE',
+                 help='Write the generated dump to FILE, and keep it.')
+    p.add_option('--no-json', dest='using_json', action='store_false',
+                 default=None,
+                 help='Only parse with the regex, even with simplejson.')
+    p.add_option('--roots', type='int', default=3,
+                 help='How many modules to compute_total_size() for'
+                      ' [default %default]')
+    p.add_option('--output', '-o', default='-',
+                 help='Write the json results here [default stdout]')
+    opts, args = p.parse_args(args)
+    if args:
+        p.error('Unexpected arguments: %s' % (' '.join(args),))
+    params = {'roots': opts.roots}
+    tempdir = None
+    try:
+        if opts.dump is not None:
+            filename = opts.dump
+            params['dump'] = os.path.basename(filename)
+        else:
+            filename = opts.keep
+            if filename is None:
+                tempdir = tempfile.mkdtemp(prefix='meliae-bench-')
+                filename = os.path.join(tempdir, 'dump.json')
+            params['objects'] = _bench.parse_count(opts.objects)
+            params['seed'] = opts.seed
+            sys.stderr.write('generating %d objects\n' % (params['objects'],))
+            gendump.generate_file(filename, params['objects'],
+                                  seed=opts.seed)
+        params['dump_bytes'] = os.path.getsize(filename)
+        records = run(filename, num_roots=opts.roots,
+                      using_json=opts.using_json)
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir)
+    sys.stderr.write(_bench.format_records(records) + '\n')
+    _bench.write_results(opts.output, 'loader', params, records)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
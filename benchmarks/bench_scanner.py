@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time dumping and sizing heaps of a known shape.
+
+Each heap is built in this process, measured, and freed before the next one:
+
+  baseline      nothing extra, the cost of dumping the interpreter itself
+  small_dicts   many dicts of a few items
+  deep_lists    chains of lists nested 1000 deep
+  huge_strings  a few very large strings
+  instances     instances of a class, each with its __dict__
+  numpy_arrays  large numpy arrays (only if numpy is installed)
+
+For every heap, scanner.dump_gc_objects and scanner.dump_all_objects write
+the whole process to a temporary file (so they include the baseline), and
+scanner.get_recursive_size and scanner.size_of measure just the heap. Each
+record has the objects and bytes handled per second, the write system calls
+(from /proc/self/io, or counted by a callable writer with --callable) and the
+peak extra memory (see _bench.measure). For the dumps, bytes are the bytes
+written, for the others they are the sizes of the objects. Note that python 3
+does not track dicts that only hold atomic values in gc, so dump_gc_objects
+does not see the small dicts, while dump_all_objects finds them from the
+list holding them.
+
+Finally, a line is fitted to the time against the number of objects of each
+function, to estimate how long a process of a given size will be frozen:
+about 'seconds_per_million' for every million objects, plus 'fixed_seconds'.
+
+For example:
+  python benchmarks/bench_scanner.py --objects 1M --output scanner.json
+"""
+
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+import _bench
+
+from meliae import scanner
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_FUNCTIONS = ['dump_gc_objects', 'dump_all_objects', 'get_recursive_size',
+              'size_of']
+
+
+class _Instance(object):
+
+    def __init__(self, index):
+        self.index = index
+        self.name = 'instance-%d' % (index,)
+        self.parent = None
+        self.children = []
+
+
+def _small_dicts(num_objects):
+    # Each dict holds its own str value, the int is (mostly) not shared
+    return [{'id': i + 1000, 'name': 'item-%d' % (i,), 'parent': None}
+            for i in range(num_objects // 3)]
+
+
+def _deep_lists(num_objects, depth=1000):
+    chains = []
+    for _ in range(max(1, num_objects // depth)):
+        chain = []
+        for _ in range(depth - 1):
+            chain = [chain]
+        chains.append(chain)
+    return chains
+
+
+def _huge_strings(total_bytes):
+    # The number of objects hardly matters, their size does
+    count = 16
+    size = total_bytes // count
+    return [(b'%02d' % (i,)) * (size // 2) for i in range(count)]
+
+
+def _instances(num_objects):
+    # The instance, its __dict__, its name, its children list and index
+    return [_Instance(i + 1000) for i in range(num_objects // 5)]
+
+
+def _numpy_arrays(total_bytes):
+    count = 64
+    return [numpy.zeros(total_bytes // count // 8) for _ in range(count)]
+
+
+def _heaps(num_objects, huge_bytes):
+    """The names of the heaps, and how to build each one."""
+    heaps = [
+        ('baseline', lambda: []),
+        ('small_dicts', lambda: _small_dicts(num_objects)),
+        ('deep_lists', lambda: _deep_lists(num_objects)),
+        ('huge_strings', lambda: _huge_strings(huge_bytes)),
+        ('instances', lambda: _instances(num_objects)),
+        ]
+    if numpy is not None:
+        heaps.append(('numpy_arrays',
+                      lambda: _numpy_arrays(huge_bytes)))
+    return heaps
+
+
+class _CountingWriter(object):
+    """A callable for scanner.dump_object_info that counts its calls.
+
+    The scanner writes to the file descriptor of a real file directly, but
+    calls anything else with each piece of the dump.
+    """
+
+    def __init__(self, out):
+        self._out = out
+        self.calls = 0
+        self.bytes_written = 0
+
+    def __call__(self, data):
+        self.calls += 1
+        self.bytes_written += len(data)
+        self._out.write(data)
+
+    def flush(self):
+        self._out.flush()
+
+
+def _dump(dump_func, filename, use_callable):
+    f = open(filename, 'wb')
+    try:
+        if use_callable:
+            writer = _CountingWriter(f)
+            dump_func(writer)
+            return writer.calls
+        dump_func(f)
+    finally:
+        f.close()
+    return None
+
+
+def _count_lines(filename):
+    count = 0
+    f = open(filename, 'rb')
+    try:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            count += data.count(b'\n')
+    finally:
+        f.close()
+    return count
+
+
+def _sizes_of(items):
+    size_of = scanner.size_of
+    total = 0
+    for item in items:
+        total += size_of(item)
+    return total
+
+
+def _add_rates(record, num_objects, num_bytes):
+    record['objects'] = num_objects
+    record['bytes'] = num_bytes
+    if record['wall_time'] > 0:
+        record['objects_per_second'] = num_objects / record['wall_time']
+        record['bytes_per_second'] = num_bytes / record['wall_time']
+    if num_objects and 'write_syscalls' in record:
+        record['write_syscalls_per_object'] = (
+            record['write_syscalls'] / float(num_objects))
+
+
+def measure_heap(heap_name, root, tempdir, use_callable=False):
+    """Measure each function over the heap in root.
+
+    :return: A list of records, see _bench.measure.
+    """
+    records = []
+    filename = os.path.join(tempdir, 'dump.json')
+    for func_name in ('dump_gc_objects', 'dump_all_objects'):
+        func = getattr(scanner, func_name)
+        calls, record = _bench.measure(
+            heap_name + ' ' + func_name, _dump, func, filename, use_callable)
+        if calls is not None:
+            record['write_calls'] = calls
+        _add_rates(record, _count_lines(filename),
+                   os.path.getsize(filename))
+        os.remove(filename)
+        records.append(record)
+    (num_objects, total_size), record = _bench.measure(
+        heap_name + ' get_recursive_size', scanner.get_recursive_size, root)
+    _add_rates(record, num_objects, total_size)
+    records.append(record)
+    items = scanner.get_recursive_items(root)
+    total_size, record = _bench.measure(
+        heap_name + ' size_of', _sizes_of, items)
+    _add_rates(record, len(items), total_size)
+    del items
+    records.append(record)
+    for record, func_name in zip(records, _FUNCTIONS):
+        record['heap'] = heap_name
+        record['function'] = func_name
+        sys.stderr.write('%s: %d objects in %.3fs\n'
+                         % (record['name'], record['objects'],
+                            record['wall_time']))
+    return records
+
+
+def fit_model(records):
+    """Fit time = fixed + per_object * objects for each function.
+
+    :return: {function: {'seconds_per_million': ..., 'fixed_seconds': ...}}
+    """
+    model = {}
+    for func_name in _FUNCTIONS:
+        points = [(r['objects'], r['wall_time']) for r in records
+                  if r.get('function') == func_name]
+        if len(points) < 2:
+            continue
+        n = float(len(points))
+        mean_x = sum([x for x, _ in points]) / n
+        mean_y = sum([y for _, y in points]) / n
+        var_x = sum([(x - mean_x) ** 2 for x, _ in points])
+        if var_x == 0:
+            continue
+        slope = sum([(x - mean_x) * (y - mean_y) for x, y in points]) / var_x
+        model[func_name] = {
+            'seconds_per_million': slope * 1e6,
+            'fixed_seconds': mean_y - slope * mean_x,
+            }
+    return model
+
+
+def format_model(model):
+    out = ['%-20s %12s %10s' % ('function', 's / M objs', 'fixed s')]
+    for func_name in _FUNCTIONS:
+        if func_name not in model:
+            continue
+        out.append('%-20s %12.3f %10.3f'
+                   % (func_name, model[func_name]['seconds_per_million'],
+                      model[func_name]['fixed_seconds']))
+    return '\n'.join(out)
+
+
+def run(num_objects, huge_bytes, heap_names=None, use_callable=False):
+    """Build and measure each heap.
+
+    :param heap_names: Only measure these heaps, by default all of them.
+    :return: A list of records
+    """
+    records = []
+    tempdir = tempfile.mkdtemp(prefix='meliae-bench-')
+    try:
+        for heap_name, build in _heaps(num_objects, huge_bytes):
+            if heap_names and heap_name not in heap_names:
+                continue
+            root, record = _bench.measure(heap_name + ' build', build)
+            record['heap'] = heap_name
+            records.append(record)
+            records.extend(measure_heap(heap_name, root, tempdir,
+                                        use_callable=use_callable))
+            del root
+            gc.collect()
+        if numpy is None and (not heap_names
+                              or 'numpy_arrays' in heap_names):
+            records.append({'name': 'numpy_arrays',
+                            'heap': 'numpy_arrays',
+                            'skipped': 'numpy is not available'})
+    finally:
+        shutil.rmtree(tempdir)
+    return records
+
+
+def main(args):
+    import optparse
+    p = optparse.OptionParser('%prog [options]')
+    p.add_option('--objects', default='1M',
+                 help='About how many objects to put in each heap, such as'
+                      ' 100k or 1M [default %default]')
+    p.add_option('--huge-mib', type='int', default=128,
+                 help='The total size of the huge strings and numpy arrays'
+                      ' [default %default]')
+    p.add_option('--heap', action='append', dest='heaps', default=[],
+                 help='Only measure this heap (can be repeated).')
+    p.add_option('--callable', action='store_true', default=False,
+                 help='Dump through a callable that counts the writes,'
+                      ' rather than to the file descriptor.')
+    p.add_option('--output', '-o', default='-',
+                 help='Write the json results here [default stdout]')
+    opts, args = p.parse_args(args)
+    if args:
+        p.error('Unexpected arguments: %s' % (' '.join(args),))
+    params = {
+        'objects': _bench.parse_count(opts.objects),
+        'huge_bytes': opts.huge_mib * 1024 * 1024,
+        'heaps': opts.heaps,
+        'callable': opts.callable,
+        'numpy': numpy is not None,
+        }
+    records = run(params['objects'], params['huge_bytes'],
+                  heap_names=opts.heaps, use_callable=opts.callable)
+    model = fit_model(records)
+    sys.stderr.write(_bench.format_records(records) + '\n\n')
+    sys.stderr.write(format_model(model) + '\n')
+    _bench.write_results(opts.output, 'scanner', params, records,
+                         extra={'model': model})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Write a synthetic dump, shaped like the dump of a real application.
+
+The same number of objects and seed always give the same dump. The objects
+are written as they are generated, so 50M objects need no more memory than
+1k.
+
+The dump starts with the shared objects: None, True and False, the classes,
+the modules (each with its __dict__) and a pool of strings used as attribute
+names and dict keys. The rest is a mix of types, in the proportions below,
+where containers have a long tailed (pareto) number of children and every
+instance is followed by its __dict__, so collapse_instance_dicts() has work
+to do.
+"""
+
+import bisect
+import gzip
+import random
+import sys
+
+# Objects are 16 byte aligned, like pymalloc
+_BASE_ADDRESS = 0x7f3a00000000
+_ADDRESS_STEP = 48
+
+# How many of every 1000 objects have each kind. An instance is followed by
+# its __dict__, so instances are twice as common as they look here.
+_KINDS = [
+    ('str', 290),
+    ('int', 90),
+    ('float', 20),
+    ('bytes', 30),
+    ('tuple', 140),
+    ('list', 50),
+    ('dict', 80),
+    ('set', 10),
+    ('function', 60),
+    ('cell', 30),
+    ('instance', 200),
+    ]
+_LEAF_KINDS = frozenset(['str', 'int', 'float', 'bytes'])
+
+_kind_names = [kind for kind, _ in _KINDS]
+_kind_limits = []
+_total = 0
+for _, _weight in _KINDS:
+    _total += _weight
+    _kind_limits.append(_total)
+_KIND_TOTAL = _total
+del _, _weight, _total
+
+_WORDS = ['alpha', 'beta', 'gamma', 'delta', 'name', 'value', 'data', 'id',
+          'parent', 'children', 'cache', 'config', 'request', 'response',
+          'user', 'path', 'key', 'item', 'node', 'state']
+
+
+def _dict_size(num_items):
+    """The size of a python 3 dict holding num_items."""
+    if num_items <= 5:
+        return 232
+    table = 8
+    while table * 2 < num_items * 3:
+        table *= 2
+    return 104 + table * 24
+
+
+class DumpGenerator(object):
+    """Generate the lines of a synthetic dump."""
+
+    def __init__(self, num_objects, seed=0):
+        self.num_objects = num_objects
+        self.seed = seed
+        self._hash_offset = (seed * 0x9e3779b1 + 0x7f4a7c15) & 0xffffffff
+        self.num_classes = max(20, num_objects // 20000)
+        self.num_modules = max(5, num_objects // 100000)
+        self.num_pool = max(100, num_objects // 1000)
+        # None, True, False, then the classes, the modules and their
+        # dicts, and the string pool
+        self._classes_start = 3
+        self._modules_start = self._classes_start + self.num_classes
+        self._pool_start = self._modules_start + 2 * self.num_modules
+        self._body_start = self._pool_start + self.num_pool
+        if self._body_start & 1:
+            # Keep instances at even indices
+            self._body_start += 1
+        if num_objects < self._body_start + 2:
+            raise ValueError('Need at least %d objects, not %d'
+                             % (self._body_start + 2, num_objects))
+
+    def address(self, index):
+        return _BASE_ADDRESS + index * _ADDRESS_STEP
+
+    def _hash(self, index):
+        return (((index ^ self._hash_offset) * 2654435761) >> 7) & 0xffffff
+
+    def _base_kind(self, index):
+        bucket = self._hash(index) % _KIND_TOTAL
+        return _kind_names[bisect.bisect_right(_kind_limits, bucket)]
+
+    def kind(self, index):
+        """What kind of object is at index."""
+        if index < self._body_start:
+            if index < self._classes_start:
+                return 'singleton'
+            if index < self._modules_start:
+                return 'type'
+            if index < self._pool_start:
+                if (index - self._modules_start) & 1:
+                    return 'module dict'
+                return 'module'
+            if index < self._pool_start + self.num_pool:
+                return 'pool str'
+            return 'singleton'
+        offset = index - self._body_start
+        if offset & 1:
+            if self._base_kind(index - 1) == 'instance':
+                return 'instance dict'
+            kind = self._base_kind(index)
+            if kind == 'instance':
+                return 'dict'
+            return kind
+        kind = self._base_kind(index)
+        if kind == 'instance' and index + 1 >= self.num_objects:
+            return 'dict'
+        return kind
+
+    def _degree(self, rng, alpha, limit):
+        return min(int(rng.paretovariate(alpha)), limit)
+
+    def _any_ref(self, rng):
+        index = rng.randrange(self.num_objects)
+        if self.kind(index) == 'instance dict':
+            # Only the instance refers to its __dict__
+            index -= 1
+        return index
+
+    def _leaf_ref(self, rng):
+        for _ in range(8):
+            index = rng.randrange(self._body_start, self.num_objects)
+            if self._base_kind(index) in _LEAF_KINDS:
+                return index
+        return self._pool_ref(rng)
+
+    def _pool_ref(self, rng):
+        # A few names are used much more often than the rest
+        return self._pool_start + int(self.num_pool * rng.random() ** 3)
+
+    def _module_dict_ref(self, rng):
+        return self._modules_start + 2 * rng.randrange(self.num_modules) + 1
+
+    def _value_ref(self, rng):
+        if rng.random() < 0.4:
+            return self._leaf_ref(rng)
+        return self._any_ref(rng)
+
+    def _word(self, index):
+        return '%s_%d' % (_WORDS[index % len(_WORDS)], index)
+
+    def _line(self, index, type_str, size, refs, name=None, length=None,
+              value=None):
+        parts = ['{"address": %d, "type": "%s", "size": %d'
+                 % (self.address(index), type_str, size)]
+        if name is not None:
+            parts.append(', "name": "%s"' % (name,))
+        if length is not None:
+            parts.append(', "len": %d' % (length,))
+        if value is not None:
+            parts.append(', "value": %s' % (value,))
+        parts.append(', "refs": [%s]}\n'
+                     % (', '.join([str(self.address(r)) for r in refs]),))
+        return ''.join(parts)
+
+    def _reserved_line(self, index, kind, rng):
+        if kind == 'singleton':
+            if index == 0:
+                return self._line(index, 'NoneType', 16, [])
+            if index in (1, 2):
+                return self._line(index, 'bool', 28, [],
+                                  value=['"True"', '"False"'][index - 1])
+            return self._line(index, 'ellipsis', 16, [])
+        if kind == 'type':
+            return self._line(index, 'type', 1056, [],
+                              name='Class%d' % (index - self._classes_start,))
+        if kind == 'module':
+            module_num = (index - self._modules_start) // 2
+            return self._line(index, 'module', 72, [index + 1],
+                              name='module%d' % (module_num,))
+        if kind == 'module dict':
+            refs = []
+            for _ in range(self._degree(rng, 1.2, 5000) + 10):
+                refs.append(self._pool_ref(rng))
+                if rng.random() < 0.5:
+                    refs.append(rng.randrange(self._classes_start,
+                                              self._modules_start))
+                else:
+                    refs.append(self._any_ref(rng))
+            return self._line(index, 'dict', _dict_size(len(refs) // 2), refs)
+        # pool str
+        word = self._word(index - self._pool_start)
+        return self._line(index, 'str', 49 + len(word), [], length=len(word),
+                          value='"%s"' % (word,))
+
+    def _body_line(self, index, kind, rng):
+        if kind == 'str':
+            length = self._degree(rng, 1.5, 1 << 20) * 8
+            value = None
+            if length < 100:
+                word = self._word(index)
+                value = '"%s"' % ((word * (length // len(word) + 1))[:length],)
+            return self._line(index, 'str', 49 + length, [], length=length,
+                              value=value)
+        if kind == 'int':
+            return self._line(index, 'int', 28, [],
+                              value=rng.randrange(-1000, 1 << 30))
+        if kind == 'float':
+            return self._line(index, 'float', 24, [])
+        if kind == 'bytes':
+            length = self._degree(rng, 1.2, 1 << 22) * 16
+            return self._line(index, 'bytes', 33 + length, [], length=length)
+        if kind == 'tuple':
+            refs = [self._value_ref(rng)
+                    for _ in range(self._degree(rng, 2.0, 64))]
+            return self._line(index, 'tuple', 40 + 8 * len(refs), refs,
+                              length=len(refs))
+        if kind == 'list':
+            refs = [self._any_ref(rng)
+                    for _ in range(self._degree(rng, 1.1, 100000) - 1)]
+            return self._line(index, 'list', 56 + 8 * len(refs), refs,
+                              length=len(refs))
+        if kind == 'set':
+            refs = [self._leaf_ref(rng)
+                    for _ in range(self._degree(rng, 1.3, 10000))]
+            size = 216
+            if len(refs) > 4:
+                size = 200 + 16 * len(refs) * 2
+            return self._line(index, 'set', size, refs, length=len(refs))
+        if kind in ('dict', 'instance dict'):
+            if kind == 'dict':
+                num_items = self._degree(rng, 1.3, 50000) - 1
+            else:
+                num_items = rng.randint(1, 12)
+            refs = []
+            for _ in range(num_items):
+                if kind == 'instance dict' or rng.random() < 0.6:
+                    refs.append(self._pool_ref(rng))
+                else:
+                    refs.append(self._leaf_ref(rng))
+                refs.append(self._value_ref(rng))
+            return self._line(index, 'dict', _dict_size(num_items), refs,
+                              length=num_items)
+        if kind == 'function':
+            refs = [self._pool_ref(rng), self._module_dict_ref(rng),
+                    self._leaf_ref(rng)]
+            return self._line(index, 'function', 136, refs,
+                              name=self._word(index))
+        if kind == 'cell':
+            return self._line(index, 'cell', 40, [self._any_ref(rng)])
+        # instance
+        class_num = self._hash(index) % self.num_classes
+        return self._line(index, 'Class%d' % (class_num,), 48,
+                          [index + 1, self._classes_start + class_num])
+
+    def iter_lines(self):
+        """Generate the lines of the dump, as text."""
+        rng = random.Random(self.seed)
+        for index in range(self.num_objects):
+            kind = self.kind(index)
+            if index < self._body_start:
+                yield self._reserved_line(index, kind, rng)
+            else:
+                yield self._body_line(index, kind, rng)
+
+
+def generate(out, num_objects, seed=0):
+    """Write a synthetic dump of num_objects to out.
+
+    :param out: A file opened for writing bytes.
+    :return: The number of bytes written
+    """
+    written = 0
+    batch = []
+    for line in DumpGenerator(num_objects, seed).iter_lines():
+        batch.append(line)
+        if len(batch) >= 10000:
+            content = ''.join(batch).encode('ascii')
+            out.write(content)
+            written += len(content)
+            del batch[:]
+    content = ''.join(batch).encode('ascii')
+    out.write(content)
+    return written + len(content)
+
+
+def generate_file(filename, num_objects, seed=0):
+    """Write a synthetic dump to filename, gzipped if it ends in .gz."""
+    if filename.endswith('.gz'):
+        out = gzip.GzipFile(filename, 'wb', compresslevel=1)
+    else:
+        out = open(filename, 'wb')
+    try:
+        return generate(out, num_objects, seed=seed)
+    finally:
+        out.close()
+
+
+def main(args):
+    import optparse
+    from _bench import parse_count
+    p = optparse.OptionParser('%prog [options] OUTFILE')
+    p.add_option('--objects', default='1M',
+                 help='How many objects to write, such as 1M, 10M or 50M'
+                      ' [default %default]')
+    p.add_option('--seed', type='int', default=0,
+                 help='Generate a different dump [default %default]')
+    opts, args = p.parse_args(args)
+    if len(args) != 1:
+        p.error('Must supply exactly one OUTFILE')
+    written = generate_file(args[0], parse_count(opts.objects),
+                            seed=opts.seed)
+    sys.stderr.write('wrote %.1f MiB\n' % (written / 1024. / 1024,))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
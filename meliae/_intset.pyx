@@ -17,12 +17,21 @@
 (Such as a set of python object ids.)
 """
 
+from cpython cimport array
 from libc.stdlib cimport (
     free,
     malloc,
+    qsort,
     realloc,
     )
-from libc.string cimport memset
+from libc.string cimport (
+    memchr,
+    memcmp,
+    memcpy,
+    memset,
+    )
+
+import array
 
 
 ctypedef Py_ssize_t int_type
@@ -33,6 +42,10 @@ cdef int_type _singleton1, _singleton2
 _singleton1 = <int_type> 0;
 _singleton2 = <int_type> -1;
 
+# How every line of a dump starts, see IDSet.filter_lines
+cdef char *_ADDRESS_PREFIX = '{"address": '
+cdef Py_ssize_t _ADDRESS_PREFIX_LEN = 12
+
 
 cdef class IntSet:
     """Keep a set of integer objects.
@@ -285,3 +298,200 @@ cdef class IDSet(IntSet):
                 freeslot = entry
             perturb = perturb >> 5 # PERTURB_SHIFT
 
+
+    def filter_lines(self, buf):
+        """Keep the dump lines in buf for objects that haven't been seen.
+
+        This is the core of strip_duplicates. The address of each line is
+        parsed in C, and added to this set. Lines that don't start with an
+        address (such as the '[' of a json list) are dropped, as are lines
+        for addresses that were already present.
+
+        :param buf: A bytes object of complete lines (every line must end in
+            a newline, except possibly the last one).
+        :return: (kept, num_lines) kept is a bytes object of the lines that
+            were kept, num_lines the number of lines that were seen.
+        """
+        cdef char *c_buf
+        cdef char *c_end
+        cdef char *line
+        cdef char *eol
+        cdef char *p
+        cdef char *out
+        cdef Py_ssize_t buf_len, out_len, num_lines
+        cdef unsigned long address
+        cdef int has_digit
+
+        if not isinstance(buf, bytes):
+            raise TypeError('filter_lines requires bytes, not %s'
+                            % (type(buf),))
+        c_buf = buf
+        buf_len = len(buf)
+        c_end = c_buf + buf_len
+        out = <char *>malloc(buf_len + 1)
+        if out == NULL:
+            raise MemoryError('Failed to allocate %d bytes' % (buf_len,))
+        try:
+            out_len = 0
+            num_lines = 0
+            line = c_buf
+            while line < c_end:
+                eol = <char *>memchr(line, c'\n', c_end - line)
+                if eol == NULL:
+                    eol = c_end
+                else:
+                    eol += 1
+                num_lines += 1
+                if (eol - line > _ADDRESS_PREFIX_LEN
+                    and memcmp(line, _ADDRESS_PREFIX,
+                               _ADDRESS_PREFIX_LEN) == 0):
+                    p = line + _ADDRESS_PREFIX_LEN
+                    address = 0
+                    has_digit = 0
+                    while p < eol and c'0' <= p[0] <= c'9':
+                        address = address * 10 + (p[0] - c'0')
+                        has_digit = 1
+                        p += 1
+                    if has_digit and self._add(<int_type>address):
+                        memcpy(out + out_len, line, eol - line)
+                        out_len += eol - line
+                line = eol
+            return out[:out_len], num_lines
+        finally:
+            free(out)
+
+
+cdef int _check_offset_arrays(array.array addresses,
+                              array.array offsets) except -1:
+    if addresses.ob_descr.typecode != c'Q' or offsets.ob_descr.typecode != c'Q':
+        raise TypeError("the addresses and offsets must be array('Q')")
+    if len(addresses) != len(offsets):
+        raise ValueError('%d addresses but %d offsets'
+                         % (len(addresses), len(offsets)))
+    return 0
+
+
+def index_lines(buf, unsigned long long base_offset, array.array addresses,
+                array.array offsets):
+    """Record where every object in buf starts.
+
+    The address of each line is parsed like IDSet.filter_lines does. Lines
+    that don't start with an address are skipped.
+
+    :param buf: A bytes object of complete lines, see IDSet.filter_lines.
+    :param base_offset: The offset of buf in the dump.
+    :param addresses: An array('Q') the addresses are appended to.
+    :param offsets: An array('Q') the offset of each line is appended to.
+    :return: The number of objects found
+    """
+    cdef char *c_buf
+    cdef char *c_end
+    cdef char *line
+    cdef char *eol
+    cdef char *p
+    cdef Py_ssize_t buf_len, count, num_lines
+    cdef unsigned long long *found
+    cdef unsigned long long address
+    cdef int has_digit
+
+    if not isinstance(buf, bytes):
+        raise TypeError('index_lines requires bytes, not %s' % (type(buf),))
+    _check_offset_arrays(addresses, offsets)
+    c_buf = buf
+    buf_len = len(buf)
+    c_end = c_buf + buf_len
+    # Every object line takes more than 16 bytes, so this is plenty
+    num_lines = buf_len // 16 + 1
+    found = <unsigned long long *>malloc(
+        2 * num_lines * sizeof(unsigned long long))
+    if found == NULL:
+        raise MemoryError('Failed to allocate room for %d lines'
+                          % (num_lines,))
+    try:
+        count = 0
+        line = c_buf
+        while line < c_end:
+            eol = <char *>memchr(line, c'\n', c_end - line)
+            if eol == NULL:
+                eol = c_end
+            else:
+                eol += 1
+            if (eol - line > _ADDRESS_PREFIX_LEN
+                and memcmp(line, _ADDRESS_PREFIX, _ADDRESS_PREFIX_LEN) == 0):
+                p = line + _ADDRESS_PREFIX_LEN
+                address = 0
+                has_digit = 0
+                while p < eol and c'0' <= p[0] <= c'9':
+                    address = address * 10 + (p[0] - c'0')
+                    has_digit = 1
+                    p += 1
+                if has_digit and count < num_lines:
+                    found[count] = address
+                    found[num_lines + count] = base_offset + (line - c_buf)
+                    count += 1
+            line = eol
+        array.extend_buffer(addresses, <char *>found, count)
+        array.extend_buffer(offsets, <char *>(found + num_lines), count)
+        return count
+    finally:
+        free(found)
+
+
+ctypedef struct _AddressOffset:
+    unsigned long long address
+    unsigned long long offset
+
+
+cdef int _cmp_address_offset(const void *a, const void *b) noexcept nogil:
+    cdef _AddressOffset *left = <_AddressOffset *>a
+    cdef _AddressOffset *right = <_AddressOffset *>b
+    if left.address != right.address:
+        if left.address < right.address:
+            return -1
+        return 1
+    if left.offset < right.offset:
+        return -1
+    if left.offset > right.offset:
+        return 1
+    return 0
+
+
+def sort_index(array.array addresses, array.array offsets):
+    """Sort the (address, offset) pairs of index_lines by address.
+
+    When an address was found more than once (dump_gc_objects can repeat an
+    object), only its first offset is kept. Both arrays are updated in place.
+
+    :return: The number of unique addresses
+    """
+    cdef _AddressOffset *pairs
+    cdef unsigned long long *c_addresses
+    cdef unsigned long long *c_offsets
+    cdef Py_ssize_t i, count, num_pairs
+
+    _check_offset_arrays(addresses, offsets)
+    num_pairs = len(addresses)
+    if num_pairs == 0:
+        return 0
+    pairs = <_AddressOffset *>malloc(num_pairs * sizeof(_AddressOffset))
+    if pairs == NULL:
+        raise MemoryError('Failed to allocate %d pairs' % (num_pairs,))
+    try:
+        c_addresses = addresses.data.as_ulonglongs
+        c_offsets = offsets.data.as_ulonglongs
+        for i from 0 <= i < num_pairs:
+            pairs[i].address = c_addresses[i]
+            pairs[i].offset = c_offsets[i]
+        qsort(pairs, num_pairs, sizeof(_AddressOffset), _cmp_address_offset)
+        count = 0
+        for i from 0 <= i < num_pairs:
+            if count > 0 and pairs[i].address == c_addresses[count - 1]:
+                continue
+            c_addresses[count] = pairs[i].address
+            c_offsets[count] = pairs[i].offset
+            count += 1
+    finally:
+        free(pairs)
+    array.resize(addresses, count)
+    array.resize(offsets, count)
+    return count
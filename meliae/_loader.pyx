@@ -21,6 +21,7 @@ from cpython.list cimport (
 from cpython.mem cimport (
     PyMem_Free,
     PyMem_Malloc,
+    PyMem_Realloc,
     )
 from cpython.object cimport (
     Py_EQ,
@@ -42,7 +43,9 @@ from cpython.tuple cimport (
 #     fprintf,
 #     stderr,
 #     )
-from libc.string cimport memset
+from cpython cimport array
+from libc.stdint cimport int32_t
+from libc.string cimport memcpy, memset
 
 cdef extern from "Python.h":
     long PyObject_Hash(PyObject *o) except? -1
@@ -53,6 +56,7 @@ cdef extern from "Python.h":
     int PyDict_SetItem_ptr "PyDict_SetItem" (object d, PyObject *key,
                                              PyObject *val) except -1
 
+import array
 import gc
 import sys
 
@@ -148,6 +152,69 @@ cdef RefList *_list_to_ref_list(object refs) except? NULL:
     return ref_list
 
 
+cdef inline int _address_eq(PyObject *a, PyObject *b) except -1:
+    """Are two addresses the same (they aren't always the same object)."""
+    if a == b:
+        return 1
+    return PyObject_RichCompareBool(a, b, Py_EQ)
+
+
+cdef int _ref_list_contains(RefList *ref_list, PyObject *address) except -1:
+    cdef long i
+
+    if ref_list == NULL:
+        return 0
+    for i from 0 <= i < ref_list.size:
+        if _address_eq(ref_list.refs[i], address):
+            return 1
+    return 0
+
+
+cdef int _ref_list_remove(RefList **ref_list_ptr,
+                          PyObject *address) except -1:
+    """Remove every occurrence of address, freeing the list if it empties."""
+    cdef RefList *ref_list
+    cdef long i, out
+
+    ref_list = ref_list_ptr[0]
+    if ref_list == NULL:
+        return 0
+    out = 0
+    for i from 0 <= i < ref_list.size:
+        if _address_eq(ref_list.refs[i], address):
+            Py_XDECREF(ref_list.refs[i])
+        else:
+            ref_list.refs[out] = ref_list.refs[i]
+            out += 1
+    ref_list.size = out
+    if out == 0:
+        PyMem_Free(ref_list)
+        ref_list_ptr[0] = NULL
+    return 0
+
+
+cdef int _ref_list_append(RefList **ref_list_ptr,
+                          PyObject *address) except -1:
+    cdef RefList *ref_list
+    cdef long size
+
+    ref_list = ref_list_ptr[0]
+    if ref_list == NULL:
+        size = 0
+    else:
+        size = ref_list.size
+    ref_list = <RefList *>PyMem_Realloc(ref_list,
+        sizeof(RefList) + sizeof(PyObject*) * (size + 1))
+    if ref_list == NULL:
+        raise MemoryError('Failed to grow a reference list to %d entries'
+                          % (size + 1,))
+    ref_list.size = size + 1
+    ref_list.refs[size] = address
+    Py_XINCREF(address)
+    ref_list_ptr[0] = ref_list
+    return 0
+
+
 cdef struct _MemObject:
     # """The raw C structure, used to minimize memory allocation size."""
     PyObject *address
@@ -168,6 +235,10 @@ cdef struct _MemObject:
     # reference to this object, so when it disappears it can set the reference
     # to NULL.
     PyObject *proxy
+    # The position of this object in the collection's _ObjIndex. Only
+    # meaningful while that index exists, -1 for objects that were never
+    # indexed.
+    int32_t index
 
 
 cdef _MemObject *_new_mem_object(address, type_str, size, children,
@@ -202,6 +273,7 @@ cdef _MemObject *_new_mem_object(address, type_str, size, children,
     Py_XINCREF(new_entry.value)
     new_entry.parent_list = _list_to_ref_list(parent_list)
     new_entry.total_size = total_size
+    new_entry.index = -1
     return new_entry
 
 
@@ -233,6 +305,743 @@ cdef _MemObject *_dummy
 _dummy = <_MemObject*>(-1)
 
 
+ctypedef struct _ObjIndex:
+    # """A dense 0..N-1 numbering of the objects in a MemObjectCollection.
+    #
+    # Walking the graph through the hash table means hashing a python integer
+    # for every reference we follow. The index instead translates every
+    # reference into a 32-bit offset once, so graph algorithms can work on
+    # plain arrays and bitsets.
+    # """
+    long num_objs
+    # objs[i] is the _MemObject that has index == i. These are borrowed
+    # pointers, the collection owns the objects.
+    _MemObject **objs
+    # The children of objs[i] are
+    #   child_indices[child_offsets[i]:child_offsets[i+1]]
+    # References to addresses that are not in the collection are dropped.
+    Py_ssize_t *child_offsets
+    int32_t *child_indices
+    # The reverse of the above, every referrer of every object (not limited
+    # by max_parents). Built on demand by _ensure_parent_index.
+    Py_ssize_t *parent_offsets
+    int32_t *parent_indices
+    # Filled in by _compute_dominators. dominators[i] is the index of the
+    # immediate dominator of objs[i], or one of the DOM_* values below.
+    int32_t *dominators
+    unsigned long *retained_sizes
+    # Filled in by _compute_components. components[i] is the strongly
+    # connected component that objs[i] belongs to.
+    int32_t *components
+    # Filled in by strongly_connected_components. The members of component
+    # c are component_members[component_offsets[c]:component_offsets[c+1]].
+    long num_components
+    Py_ssize_t *component_offsets
+    int32_t *component_members
+
+
+cdef enum:
+    # objs[i] is a root, or is reachable from more than one root
+    DOM_ROOT = -1
+    # objs[i] can't be reached from the roots at all
+    DOM_UNREACHABLE = -2
+
+
+cdef int _free_obj_index(_ObjIndex *index) except -1:
+    if index == NULL:
+        return 0
+    PyMem_Free(index.objs)
+    PyMem_Free(index.child_offsets)
+    PyMem_Free(index.child_indices)
+    PyMem_Free(index.parent_offsets)
+    PyMem_Free(index.parent_indices)
+    PyMem_Free(index.dominators)
+    PyMem_Free(index.retained_sizes)
+    PyMem_Free(index.components)
+    PyMem_Free(index.component_offsets)
+    PyMem_Free(index.component_members)
+    PyMem_Free(index)
+    return 1
+
+
+cdef Py_ssize_t sizeof_ObjIndex(_ObjIndex *index):
+    """Determine how many bytes this index is using. index can be NULL"""
+    cdef Py_ssize_t my_size, num_refs
+
+    if index == NULL:
+        return 0
+    num_refs = index.child_offsets[index.num_objs]
+    my_size = (sizeof(_ObjIndex)
+               + sizeof(_MemObject*) * index.num_objs
+               + sizeof(Py_ssize_t) * (index.num_objs + 1)
+               + sizeof(int32_t) * num_refs)
+    if index.parent_offsets != NULL:
+        my_size += (sizeof(Py_ssize_t) * (index.num_objs + 1)
+                    + sizeof(int32_t) * num_refs)
+    if index.dominators != NULL:
+        my_size += ((sizeof(int32_t) + sizeof(unsigned long))
+                    * index.num_objs)
+    if index.components != NULL:
+        my_size += sizeof(int32_t) * index.num_objs
+    if index.component_offsets != NULL:
+        my_size += (sizeof(Py_ssize_t) * (index.num_components + 1)
+                    + sizeof(int32_t) * index.num_objs)
+    return my_size
+
+
+cdef array.array _new_array(typecode, Py_ssize_t length):
+    """Create an uninitialized array.array with length items."""
+    return array.clone(array.array(typecode), length, False)
+
+
+cdef array.array _copy_offsets(Py_ssize_t *offsets, long num_objs):
+    """Copy CSR offsets into a new array of 64-bit integers."""
+    cdef array.array result
+    cdef long i
+
+    result = _new_array('q', num_objs + 1)
+    for i from 0 <= i <= num_objs:
+        result.data.as_longlongs[i] = offsets[i]
+    return result
+
+
+cdef array.array _copy_indices(int32_t *indices, Py_ssize_t num_refs):
+    """Copy CSR indices into a new array of 32-bit integers."""
+    cdef array.array result
+
+    result = _new_array('i', num_refs)
+    if num_refs > 0:
+        memcpy(result.data.as_voidptr, indices, sizeof(int32_t) * num_refs)
+    return result
+
+
+cdef unsigned char *_new_bitset(long num_bits) except NULL:
+    cdef unsigned char *bits
+    cdef size_t n_bytes
+
+    n_bytes = (num_bits >> 3) + 1
+    bits = <unsigned char *>PyMem_Malloc(n_bytes)
+    if bits == NULL:
+        raise MemoryError('Failed to allocate %d bytes' % (n_bytes,))
+    memset(bits, 0, n_bytes)
+    return bits
+
+
+cdef inline int _bit_is_set(unsigned char *bits, long i):
+    return bits[i >> 3] & (1 << (i & 7))
+
+
+cdef inline void _set_bit(unsigned char *bits, long i):
+    bits[i >> 3] = bits[i >> 3] | (1 << (i & 7))
+
+
+cdef int _ensure_parent_index(_ObjIndex *index) except -1:
+    """Fill in parent_offsets and parent_indices from the children."""
+    cdef long i, num_objs
+    cdef Py_ssize_t pos, end, num_refs, running, count
+    cdef Py_ssize_t *offsets
+    cdef int32_t *indices
+    cdef int32_t child
+
+    if index.parent_offsets != NULL:
+        return 0
+    num_objs = index.num_objs
+    num_refs = index.child_offsets[num_objs]
+    offsets = <Py_ssize_t *>PyMem_Malloc(sizeof(Py_ssize_t) * (num_objs + 1))
+    indices = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_refs + 1))
+    if offsets == NULL or indices == NULL:
+        PyMem_Free(offsets)
+        PyMem_Free(indices)
+        raise MemoryError('Failed to allocate a parent index for %d'
+                          ' references' % (num_refs,))
+    memset(offsets, 0, sizeof(Py_ssize_t) * (num_objs + 1))
+    for pos from 0 <= pos < num_refs:
+        offsets[index.child_indices[pos]] += 1
+    running = 0
+    for i from 0 <= i < num_objs:
+        count = offsets[i]
+        offsets[i] = running
+        running += count
+    offsets[num_objs] = running
+    # Use offsets[child] as the fill position, which leaves it pointing at the
+    # start of child+1, and then shift everything back into place.
+    for i from 0 <= i < num_objs:
+        end = index.child_offsets[i + 1]
+        for pos from index.child_offsets[i] <= pos < end:
+            child = index.child_indices[pos]
+            indices[offsets[child]] = <int32_t>i
+            offsets[child] += 1
+    for i from num_objs > i > 0:
+        offsets[i] = offsets[i - 1]
+    offsets[0] = 0
+    index.parent_offsets = offsets
+    index.parent_indices = indices
+    return 1
+
+
+ctypedef struct _DomState:
+    # """Working arrays for _compute_dominators.
+    #
+    # The virtual root is node num_objs, and has preorder number 0. Apart from
+    # dfnum and the stacks, the arrays are indexed by DFS preorder number.
+    # """
+    _ObjIndex *index
+    long count              # how many nodes have been numbered so far
+    int32_t *dfnum          # node => preorder number, -1 if not visited
+    int32_t *vertex         # preorder number => node
+    int32_t *parent         # DFS tree parent
+    int32_t *semi           # semidominator
+    int32_t *ancestor       # the forest built by Link, -1 for none
+    int32_t *best           # node with the lowest semi on the ancestor path
+    int32_t *idom
+    int32_t *samedom
+    int32_t *bucket_head    # nodes whose semidominator is this one
+    int32_t *bucket_next
+    int32_t *stack          # DFS stack of nodes, and later the _dom_eval path
+    Py_ssize_t *stack_pos   # how far we got through the children of stack[i]
+    unsigned char *is_root  # bitset of nodes that hang off the virtual root
+
+
+cdef int _dom_dfs(_DomState *st, int32_t start) except -1:
+    """Number everything reachable from start (a child of the virtual root)."""
+    cdef _ObjIndex *index
+    cdef long sp
+    cdef int32_t node, child
+    cdef Py_ssize_t pos, end
+
+    index = st.index
+    _set_bit(st.is_root, start)
+    st.dfnum[start] = st.count
+    st.vertex[st.count] = start
+    st.parent[st.count] = 0
+    st.count += 1
+    sp = 0
+    st.stack[0] = start
+    st.stack_pos[0] = index.child_offsets[start]
+    while sp >= 0:
+        node = st.stack[sp]
+        pos = st.stack_pos[sp]
+        end = index.child_offsets[node + 1]
+        while pos < end and st.dfnum[index.child_indices[pos]] != -1:
+            pos += 1
+        if pos >= end:
+            sp -= 1
+            continue
+        st.stack_pos[sp] = pos + 1
+        child = index.child_indices[pos]
+        st.dfnum[child] = st.count
+        st.vertex[st.count] = child
+        st.parent[st.count] = st.dfnum[node]
+        st.count += 1
+        sp += 1
+        st.stack[sp] = child
+        st.stack_pos[sp] = index.child_offsets[child]
+    return 0
+
+
+cdef int32_t _dom_eval(_DomState *st, int32_t v):
+    """Find the ancestor of v with the lowest semidominator.
+
+    This is the path compressing AncestorWithLowestSemi, unrolled so that deep
+    graphs can't overflow the C stack.
+    """
+    cdef long top
+    cdef int32_t u, a, b
+
+    top = 0
+    u = v
+    while st.ancestor[st.ancestor[u]] != -1:
+        st.stack[top] = u
+        top += 1
+        u = st.ancestor[u]
+    while top > 0:
+        top -= 1
+        u = st.stack[top]
+        a = st.ancestor[u]
+        b = st.best[a]
+        st.ancestor[u] = st.ancestor[a]
+        if st.semi[b] < st.semi[st.best[u]]:
+            st.best[u] = b
+    return st.best[v]
+
+
+cdef long _compute_dominators(_ObjIndex *index, object roots) except -1:
+    """Fill in index.dominators and index.retained_sizes.
+
+    This is the Lengauer-Tarjan algorithm (with simple path compression) over
+    the dense index. All the roots hang off a virtual root, so an object that
+    can be reached from 2 roots has no real immediate dominator.
+
+    :param roots: A list of object indices to start from, or None to start
+        from every object that has no parents, and then from whatever is
+        still unreachable (reference cycles nothing else refers to).
+    :return: The number of reachable objects.
+    """
+    cdef _DomState st
+    cdef long i, num_objs, n_bytes
+    cdef int32_t n, p, s, s2, v, y, pre
+    cdef Py_ssize_t pos, end
+    cdef unsigned long *retained
+
+    _ensure_parent_index(index)
+    num_objs = index.num_objs
+    PyMem_Free(index.dominators)
+    index.dominators = NULL
+    PyMem_Free(index.retained_sizes)
+    index.retained_sizes = NULL
+    memset(&st, 0, sizeof(_DomState))
+    st.index = index
+    retained = NULL
+    try:
+        n_bytes = sizeof(int32_t) * (num_objs + 1)
+        st.dfnum = <int32_t *>PyMem_Malloc(n_bytes)
+        st.vertex = <int32_t *>PyMem_Malloc(n_bytes)
+        st.parent = <int32_t *>PyMem_Malloc(n_bytes)
+        st.semi = <int32_t *>PyMem_Malloc(n_bytes)
+        st.ancestor = <int32_t *>PyMem_Malloc(n_bytes)
+        st.best = <int32_t *>PyMem_Malloc(n_bytes)
+        st.idom = <int32_t *>PyMem_Malloc(n_bytes)
+        st.samedom = <int32_t *>PyMem_Malloc(n_bytes)
+        st.bucket_head = <int32_t *>PyMem_Malloc(n_bytes)
+        st.bucket_next = <int32_t *>PyMem_Malloc(n_bytes)
+        st.stack = <int32_t *>PyMem_Malloc(n_bytes)
+        st.stack_pos = <Py_ssize_t *>PyMem_Malloc(
+            sizeof(Py_ssize_t) * (num_objs + 1))
+        st.is_root = _new_bitset(num_objs)
+        if (st.dfnum == NULL or st.vertex == NULL or st.parent == NULL
+            or st.semi == NULL or st.ancestor == NULL or st.best == NULL
+            or st.idom == NULL or st.samedom == NULL
+            or st.bucket_head == NULL or st.bucket_next == NULL
+            or st.stack == NULL or st.stack_pos == NULL):
+            raise MemoryError('Failed to allocate dominator state for %d'
+                              ' objects' % (num_objs,))
+        for i from 0 <= i <= num_objs:
+            st.dfnum[i] = -1
+            st.ancestor[i] = -1
+            st.samedom[i] = -1
+            st.bucket_head[i] = -1
+        st.dfnum[num_objs] = 0
+        st.vertex[0] = <int32_t>num_objs
+        st.parent[0] = 0
+        st.count = 1
+        if roots is not None:
+            # A root may be reachable from an earlier root, but it still hangs
+            # off the virtual root.
+            for root in roots:
+                _set_bit(st.is_root, <int32_t>root)
+            for root in roots:
+                n = root
+                if st.dfnum[n] == -1:
+                    _dom_dfs(&st, n)
+        else:
+            for i from 0 <= i < num_objs:
+                if (index.parent_offsets[i] == index.parent_offsets[i + 1]
+                    and st.dfnum[i] == -1):
+                    _dom_dfs(&st, <int32_t>i)
+            for i from 0 <= i < num_objs:
+                if st.dfnum[i] == -1:
+                    _dom_dfs(&st, <int32_t>i)
+        PyMem_Free(st.stack_pos)
+        st.stack_pos = NULL
+        # Compute semidominators, and implicitly defined idoms, bottom up
+        for pre from st.count > pre > 0:
+            n = st.vertex[pre]
+            p = st.parent[pre]
+            s = p
+            if _bit_is_set(st.is_root, n):
+                # The virtual root is a predecessor
+                s = 0
+            end = index.parent_offsets[n + 1]
+            for pos from index.parent_offsets[n] <= pos < end:
+                v = st.dfnum[index.parent_indices[pos]]
+                if v == -1:
+                    # Not reachable from the roots, so it doesn't matter
+                    continue
+                if v <= pre:
+                    s2 = v
+                else:
+                    s2 = st.semi[_dom_eval(&st, v)]
+                if s2 < s:
+                    s = s2
+            st.semi[pre] = s
+            st.bucket_next[pre] = st.bucket_head[s]
+            st.bucket_head[s] = pre
+            # Link(p, pre)
+            st.ancestor[pre] = p
+            st.best[pre] = pre
+            v = st.bucket_head[p]
+            while v != -1:
+                y = _dom_eval(&st, v)
+                if st.semi[y] == st.semi[v]:
+                    st.idom[v] = p
+                else:
+                    st.samedom[v] = y
+                v = st.bucket_next[v]
+            st.bucket_head[p] = -1
+        for pre from 1 <= pre < st.count:
+            if st.samedom[pre] != -1:
+                st.idom[pre] = st.idom[st.samedom[pre]]
+        # Everything is dominated by something earlier in the preorder, so
+        # walking it backwards accumulates whole dominator subtrees.
+        retained = <unsigned long *>PyMem_Malloc(
+            sizeof(unsigned long) * (num_objs + 1))
+        index.dominators = <int32_t *>PyMem_Malloc(
+            sizeof(int32_t) * (num_objs + 1))
+        if retained == NULL or index.dominators == NULL:
+            raise MemoryError('Failed to allocate retained sizes for %d'
+                              ' objects' % (num_objs,))
+        for i from 0 <= i < num_objs:
+            retained[i] = 0
+            index.dominators[i] = DOM_UNREACHABLE
+        for pre from st.count > pre > 0:
+            n = st.vertex[pre]
+            retained[n] += index.objs[n].size
+            p = st.idom[pre]
+            if p == 0:
+                index.dominators[n] = DOM_ROOT
+            else:
+                index.dominators[n] = st.vertex[p]
+                retained[st.vertex[p]] += retained[n]
+        index.retained_sizes = retained
+        retained = NULL
+    finally:
+        PyMem_Free(retained)
+        PyMem_Free(st.dfnum)
+        PyMem_Free(st.vertex)
+        PyMem_Free(st.parent)
+        PyMem_Free(st.semi)
+        PyMem_Free(st.ancestor)
+        PyMem_Free(st.best)
+        PyMem_Free(st.idom)
+        PyMem_Free(st.samedom)
+        PyMem_Free(st.bucket_head)
+        PyMem_Free(st.bucket_next)
+        PyMem_Free(st.stack)
+        PyMem_Free(st.stack_pos)
+        PyMem_Free(st.is_root)
+        if index.retained_sizes == NULL:
+            PyMem_Free(index.dominators)
+            index.dominators = NULL
+    return st.count - 1
+
+
+cdef long _compute_components(_ObjIndex *index) except -1:
+    """Fill in index.components using Tarjan's algorithm.
+
+    The recursion is replaced with an explicit stack, so long chains of
+    references are fine. Components are numbered in the order they are
+    completed, which means nothing in a component refers to a component with
+    a higher number.
+
+    :return: The number of components.
+    """
+    cdef long i, num_objs, sp, scc_sp, num_components
+    cdef int32_t v, w, counter
+    cdef Py_ssize_t pos
+    cdef int32_t *dfnum
+    cdef int32_t *lowlink
+    cdef int32_t *stack
+    cdef Py_ssize_t *stack_pos
+    cdef int32_t *scc_stack
+    cdef int32_t *components
+
+    num_objs = index.num_objs
+    PyMem_Free(index.components)
+    index.components = NULL
+    PyMem_Free(index.component_offsets)
+    index.component_offsets = NULL
+    PyMem_Free(index.component_members)
+    index.component_members = NULL
+    index.num_components = 0
+    dfnum = NULL
+    lowlink = NULL
+    stack = NULL
+    stack_pos = NULL
+    scc_stack = NULL
+    components = NULL
+    try:
+        dfnum = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_objs + 1))
+        lowlink = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_objs + 1))
+        stack = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_objs + 1))
+        stack_pos = <Py_ssize_t *>PyMem_Malloc(
+            sizeof(Py_ssize_t) * (num_objs + 1))
+        scc_stack = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_objs + 1))
+        components = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_objs + 1))
+        if (dfnum == NULL or lowlink == NULL or stack == NULL
+            or stack_pos == NULL or scc_stack == NULL or components == NULL):
+            raise MemoryError('Failed to allocate component state for %d'
+                              ' objects' % (num_objs,))
+        for i from 0 <= i < num_objs:
+            dfnum[i] = -1
+            # Visited objects without a component are still on scc_stack
+            components[i] = -1
+        counter = 0
+        num_components = 0
+        scc_sp = -1
+        for i from 0 <= i < num_objs:
+            if dfnum[i] != -1:
+                continue
+            sp = 0
+            stack[0] = <int32_t>i
+            stack_pos[0] = index.child_offsets[i]
+            dfnum[i] = lowlink[i] = counter
+            counter += 1
+            scc_sp += 1
+            scc_stack[scc_sp] = <int32_t>i
+            while sp >= 0:
+                v = stack[sp]
+                pos = stack_pos[sp]
+                if pos < index.child_offsets[v + 1]:
+                    stack_pos[sp] = pos + 1
+                    w = index.child_indices[pos]
+                    if dfnum[w] == -1:
+                        dfnum[w] = lowlink[w] = counter
+                        counter += 1
+                        scc_sp += 1
+                        scc_stack[scc_sp] = w
+                        sp += 1
+                        stack[sp] = w
+                        stack_pos[sp] = index.child_offsets[w]
+                    elif components[w] == -1 and dfnum[w] < lowlink[v]:
+                        lowlink[v] = dfnum[w]
+                    continue
+                # Done with all the children of v
+                sp -= 1
+                if lowlink[v] == dfnum[v]:
+                    while True:
+                        w = scc_stack[scc_sp]
+                        scc_sp -= 1
+                        components[w] = <int32_t>num_components
+                        if w == v:
+                            break
+                    num_components += 1
+                if sp >= 0 and lowlink[v] < lowlink[stack[sp]]:
+                    lowlink[stack[sp]] = lowlink[v]
+        index.components = components
+        components = NULL
+    finally:
+        PyMem_Free(dfnum)
+        PyMem_Free(lowlink)
+        PyMem_Free(stack)
+        PyMem_Free(stack_pos)
+        PyMem_Free(scc_stack)
+        PyMem_Free(components)
+    return num_components
+
+
+cdef object _index_chain(int32_t *pred, int32_t start):
+    """Follow pred from start until a node that is its own pred."""
+    cdef int32_t node
+
+    chain = [start]
+    node = start
+    while pred[node] != node:
+        node = pred[node]
+        chain.append(node)
+    return chain
+
+
+cdef object _backward_paths(_ObjIndex *index, int32_t target,
+                            unsigned char *root_bits, object root_types,
+                            unsigned char *excluded, long k):
+    """Breadth first search over the parents of target, for the k closest roots.
+
+    :param root_bits: If not NULL, the roots. Otherwise, an object is a root if
+        nothing refers to it, or its type is in root_types.
+    :return: A list of paths (lists of indices), from the root to target.
+    """
+    cdef unsigned char *seen
+    cdef int32_t *pred
+    cdef int32_t *queue
+    cdef long head, tail
+    cdef int32_t node, parent
+    cdef Py_ssize_t pos, end
+    cdef int is_root
+
+    seen = NULL
+    pred = NULL
+    queue = NULL
+    paths = []
+    try:
+        seen = _new_bitset(index.num_objs)
+        pred = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (index.num_objs + 1))
+        queue = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (index.num_objs + 1))
+        if pred == NULL or queue == NULL:
+            raise MemoryError('Failed to allocate search state for %d objects'
+                              % (index.num_objs,))
+        _set_bit(seen, target)
+        pred[target] = target
+        queue[0] = target
+        head = 0
+        tail = 1
+        while head < tail and len(paths) < k:
+            node = queue[head]
+            head += 1
+            if root_bits != NULL:
+                is_root = _bit_is_set(root_bits, node)
+            else:
+                is_root = (index.parent_offsets[node]
+                           == index.parent_offsets[node + 1]
+                           or <object>index.objs[node].type_str in root_types)
+            if is_root:
+                # We don't look for roots beyond this one, the paths would
+                # just be longer versions of this one.
+                paths.append(_index_chain(pred, node))
+                continue
+            end = index.parent_offsets[node + 1]
+            for pos from index.parent_offsets[node] <= pos < end:
+                parent = index.parent_indices[pos]
+                if _bit_is_set(seen, parent):
+                    continue
+                if excluded != NULL and _bit_is_set(excluded, parent):
+                    continue
+                _set_bit(seen, parent)
+                pred[parent] = node
+                queue[tail] = parent
+                tail += 1
+    finally:
+        PyMem_Free(seen)
+        PyMem_Free(pred)
+        PyMem_Free(queue)
+    return paths
+
+
+cdef object _bidirectional_path(_ObjIndex *index, int32_t target,
+                                object roots, unsigned char *excluded):
+    """Find one shortest path from any of roots to target.
+
+    Searches forward from the roots (over children) and backward from target
+    (over parents) at the same time, always growing the side with the smaller
+    frontier, so only a small part of the graph is visited when the roots are
+    far away and the graph fans out.
+
+    :return: A list of indices from a root to target, or None.
+    """
+    cdef unsigned char *fwd_seen
+    cdef unsigned char *bwd_seen
+    cdef int32_t *fwd_pred
+    cdef int32_t *bwd_pred
+    cdef int32_t *fwd_dist
+    cdef int32_t *bwd_dist
+    cdef int32_t *fwd_queue
+    cdef int32_t *bwd_queue
+    cdef long fwd_head, fwd_tail, bwd_head, bwd_tail, level_end, best_len
+    cdef int32_t node, other, root, meet_fwd, meet_bwd
+    cdef Py_ssize_t pos, end
+    cdef Py_ssize_t *offsets
+    cdef int32_t *indices
+    cdef int forward
+
+    fwd_seen = bwd_seen = NULL
+    fwd_pred = bwd_pred = fwd_dist = bwd_dist = fwd_queue = bwd_queue = NULL
+    path = None
+    try:
+        fwd_seen = _new_bitset(index.num_objs)
+        bwd_seen = _new_bitset(index.num_objs)
+        fwd_pred = <int32_t *>PyMem_Malloc(sizeof(int32_t) * index.num_objs)
+        bwd_pred = <int32_t *>PyMem_Malloc(sizeof(int32_t) * index.num_objs)
+        fwd_dist = <int32_t *>PyMem_Malloc(sizeof(int32_t) * index.num_objs)
+        bwd_dist = <int32_t *>PyMem_Malloc(sizeof(int32_t) * index.num_objs)
+        fwd_queue = <int32_t *>PyMem_Malloc(sizeof(int32_t) * index.num_objs)
+        bwd_queue = <int32_t *>PyMem_Malloc(sizeof(int32_t) * index.num_objs)
+        if (fwd_pred == NULL or bwd_pred == NULL or fwd_dist == NULL
+            or bwd_dist == NULL or fwd_queue == NULL or bwd_queue == NULL):
+            raise MemoryError('Failed to allocate search state for %d objects'
+                              % (index.num_objs,))
+        fwd_head = fwd_tail = 0
+        for py_root in roots:
+            root = py_root
+            if root == target:
+                return [target]
+            if (_bit_is_set(fwd_seen, root) or
+                (excluded != NULL and _bit_is_set(excluded, root))):
+                continue
+            _set_bit(fwd_seen, root)
+            fwd_pred[root] = root
+            fwd_dist[root] = 0
+            fwd_queue[fwd_tail] = root
+            fwd_tail += 1
+        _set_bit(bwd_seen, target)
+        bwd_pred[target] = target
+        bwd_dist[target] = 0
+        bwd_queue[0] = target
+        bwd_head = 0
+        bwd_tail = 1
+        best_len = -1
+        meet_fwd = meet_bwd = -1
+        while fwd_head < fwd_tail and bwd_head < bwd_tail:
+            # Expand one whole level, and keep the shortest of the paths
+            # that meet during it.
+            forward = (fwd_tail - fwd_head) <= (bwd_tail - bwd_head)
+            if forward:
+                level_end = fwd_tail
+                offsets = index.child_offsets
+                indices = index.child_indices
+            else:
+                level_end = bwd_tail
+                offsets = index.parent_offsets
+                indices = index.parent_indices
+            while True:
+                if forward:
+                    if fwd_head >= level_end:
+                        break
+                    node = fwd_queue[fwd_head]
+                    fwd_head += 1
+                else:
+                    if bwd_head >= level_end:
+                        break
+                    node = bwd_queue[bwd_head]
+                    bwd_head += 1
+                end = offsets[node + 1]
+                for pos from offsets[node] <= pos < end:
+                    other = indices[pos]
+                    if excluded != NULL and _bit_is_set(excluded, other):
+                        continue
+                    if forward:
+                        if _bit_is_set(bwd_seen, other):
+                            if (best_len == -1 or fwd_dist[node] + 1
+                                + bwd_dist[other] < best_len):
+                                best_len = (fwd_dist[node] + 1
+                                            + bwd_dist[other])
+                                meet_fwd = node
+                                meet_bwd = other
+                        elif not _bit_is_set(fwd_seen, other):
+                            _set_bit(fwd_seen, other)
+                            fwd_pred[other] = node
+                            fwd_dist[other] = fwd_dist[node] + 1
+                            fwd_queue[fwd_tail] = other
+                            fwd_tail += 1
+                    else:
+                        if _bit_is_set(fwd_seen, other):
+                            if (best_len == -1 or bwd_dist[node] + 1
+                                + fwd_dist[other] < best_len):
+                                best_len = (bwd_dist[node] + 1
+                                            + fwd_dist[other])
+                                meet_fwd = other
+                                meet_bwd = node
+                        elif not _bit_is_set(bwd_seen, other):
+                            _set_bit(bwd_seen, other)
+                            bwd_pred[other] = node
+                            bwd_dist[other] = bwd_dist[node] + 1
+                            bwd_queue[bwd_tail] = other
+                            bwd_tail += 1
+            if best_len != -1:
+                path = _index_chain(fwd_pred, meet_fwd)
+                path.reverse()
+                path.extend(_index_chain(bwd_pred, meet_bwd))
+                break
+    finally:
+        PyMem_Free(fwd_seen)
+        PyMem_Free(bwd_seen)
+        PyMem_Free(fwd_pred)
+        PyMem_Free(bwd_pred)
+        PyMem_Free(fwd_dist)
+        PyMem_Free(bwd_dist)
+        PyMem_Free(fwd_queue)
+        PyMem_Free(bwd_queue)
+    return path
+
+
 cdef class MemObjectCollection
 cdef class _MemObjectProxy
 
@@ -330,10 +1139,17 @@ cdef class _MemObjectProxy:
 
         def __set__(self, value):
             cdef PyObject *ptr
+            if type(value) is str:
+                # Type strings are interned, so they can be compared by
+                # identity
+                value = intern(value)
             ptr = <PyObject *>value
             Py_XINCREF(ptr)
             Py_XDECREF(self._obj.type_str)
             self._obj.type_str = ptr
+            if (self.collection is not None
+                and self.collection._type_index != NULL):
+                self.collection._type_index_add(self._obj)
 
     property size:
         """The number of bytes allocated for this object."""
@@ -369,6 +1185,55 @@ cdef class _MemObjectProxy:
         def __set__(self, value):
             self._obj.total_size = value
 
+    property retained_size:
+        """Bytes that would be freed if this object went away.
+
+        None unless MemObjectCollection.compute_dominators has been run (and
+        this object was reachable from the roots).
+        """
+        def __get__(self):
+            if self.collection is None:
+                return None
+            if self.collection._dominator_of(self._obj) == DOM_UNREACHABLE:
+                return None
+            return self.collection._index.retained_sizes[self._obj.index]
+
+    property component_id:
+        """The strongly connected component this object belongs to.
+
+        None unless MemObjectCollection.strongly_connected_components has been
+        run (since the collection last changed).
+        """
+        def __get__(self):
+            cdef _ObjIndex *index
+
+            if self.collection is None:
+                return None
+            index = self.collection._index
+            if index == NULL or index.components == NULL:
+                return None
+            if not self.collection._is_indexed(self._obj):
+                return None
+            return index.components[self._obj.index]
+
+    property immediate_dominator:
+        """The closest object that all paths from the roots go through.
+
+        None for the roots, for objects reachable from more than one root, and
+        when MemObjectCollection.compute_dominators hasn't been run.
+        """
+        def __get__(self):
+            cdef long idx
+            cdef _MemObject *cur
+
+            if self.collection is None:
+                return None
+            idx = self.collection._dominator_of(self._obj)
+            if idx < 0:
+                return None
+            cur = self.collection._index.objs[idx]
+            return self.collection._proxy_for(<object>cur.address, cur)
+
     def __len__(self):
         if self._obj.child_list == NULL:
             return 0
@@ -400,6 +1265,9 @@ cdef class _MemObjectProxy:
         def __set__(self, value):
             _free_ref_list(self._obj.child_list)
             self._obj.child_list = _list_to_ref_list(value)
+            if self.collection is not None:
+                # The dense index has the old references baked in
+                self.collection._drop_index()
 
     property ref_list:
         """The list of objects referenced by this object.
@@ -625,10 +1493,18 @@ cdef class _MemObjectProxy:
         cdef _MOPReferencedIterator iterator
         cdef _MemObjectProxy item
         cdef unsigned long total_size
+        cdef long idx
         total_size = 0
         iterator = self.iter_recursive_refs(excluding=excluding)
-        for item in iterator:
-            total_size += item._obj.size
+        if iterator._index != NULL:
+            # Walk the dense index directly, without creating proxies
+            idx = iterator._next_index()
+            while idx >= 0:
+                total_size += iterator._index.objs[idx].size
+                idx = iterator._next_index()
+        else:
+            for item in iterator:
+                total_size += item._obj.size
         self._obj.total_size = total_size
         return self.total_size
 
@@ -640,10 +1516,48 @@ cdef class _MemObjectProxy:
         :return: A list of all entries, sorted with the largest entries first.
         """
         cdef list all
+        cdef _MOPReferencedIterator iterator
+        cdef _ObjIndex *index
+        cdef _MemObject *cur
+        cdef _MemObject **slot
+        cdef unsigned char *reached
+        cdef long idx
         all = []
-        for item in self.iter_recursive_refs(excluding=excluding):
-            if item.type_str == type_str:
-                all.append(item)
+        iterator = self.iter_recursive_refs(excluding=excluding)
+        if iterator._index == NULL:
+            for item in iterator:
+                if item.type_str == type_str:
+                    all.append(item)
+            all.sort(key=_all_sort_key, reverse=True)
+            return all
+        # Walk the dense index directly, and only create proxies for the
+        # matches
+        index = iterator._index
+        reached = NULL
+        if self.collection._type_index != NULL:
+            reached = _new_bitset(index.num_objs)
+        try:
+            idx = iterator._next_index()
+            while idx >= 0:
+                if reached != NULL:
+                    _set_bit(reached, idx)
+                else:
+                    cur = index.objs[idx]
+                    if (cur.type_str == <PyObject *>type_str
+                        or <object>cur.type_str == type_str):
+                        all.append(self.collection._proxy_for(
+                            <object>cur.address, cur))
+                idx = iterator._next_index()
+            if reached != NULL:
+                # Only the objects of this type need to be checked
+                for address in self.collection.addresses_of_type(type_str):
+                    slot = self.collection._lookup(address)
+                    if _bit_is_set(reached, slot[0].index):
+                        all.append(self.collection._proxy_for(address,
+                                                              slot[0]))
+        finally:
+            if reached != NULL:
+                PyMem_Free(reached)
         all.sort(key=_all_sort_key, reverse=True)
         return all
 
@@ -652,6 +1566,69 @@ def _all_sort_key(proxy_obj):
     return (proxy_obj.size, len(proxy_obj), proxy_obj.num_parents)
 
 
+cdef struct _TypeTotals:
+    # """The running totals of one type, for summarize_types()."""
+    PyObject *type_str      # borrowed, the objects hold a reference
+    long count
+    unsigned long long total_size
+    # The sum of the squares can easily overflow 64 bits, and it is only
+    # used for the standard deviation.
+    double sq_sum
+    long max_size
+    _MemObject *max_obj     # NULL until an object bigger than 0 is seen
+
+
+cdef struct _Query:
+    # """The predicates of MemObjectCollection.select()."""
+    PyObject *type_str      # NULL to match any type
+    int check_size_gt
+    long size_gt
+    int check_size_lt
+    long size_lt
+    long num_parents        # -1 to match any
+    long num_children       # -1 to match any
+    PyObject *value_search  # The search method of a compiled regex, or NULL
+    PyObject *value_type    # The type of value the regex can search
+
+
+cdef int _query_matches(_MemObject *cur, _Query *query) except -1:
+    """Does cur match all of the predicates in query.
+
+    The cheap checks against the raw fields are done first, so the regex is
+    only run for objects that pass all of them.
+    """
+    cdef long count
+
+    if (query.type_str != NULL and cur.type_str != query.type_str
+        and <object>cur.type_str != <object>query.type_str):
+        return 0
+    if query.check_size_gt and cur.size <= query.size_gt:
+        return 0
+    if query.check_size_lt and cur.size >= query.size_lt:
+        return 0
+    if query.num_parents >= 0:
+        if cur.parent_list == NULL:
+            count = 0
+        else:
+            count = cur.parent_list.size
+        if count != query.num_parents:
+            return 0
+    if query.num_children >= 0:
+        if cur.child_list == NULL:
+            count = 0
+        else:
+            count = cur.child_list.size
+        if count != query.num_children:
+            return 0
+    if query.value_search != NULL:
+        if (cur.value == NULL
+            or not isinstance(<object>cur.value, <object>query.value_type)):
+            return 0
+        if (<object>query.value_search)(<object>cur.value) is None:
+            return 0
+    return 1
+
+
 cdef class MemObjectCollection:
     """Track a bunch of _MemObject instances."""
 
@@ -659,11 +1636,18 @@ cdef class MemObjectCollection:
     cdef readonly int _active      # How many slots have real data
     cdef readonly int _filled      # How many slots have real or dummy
     cdef _MemObject** _table       # _MemObjects are stored inline
+    cdef _ObjIndex *_index         # NULL unless build_index() was called
+    # A dict of type_str => [addresses], NULL unless build_type_index() was
+    # called. It is a hidden member so that the collection itself doesn't
+    # need to be tracked by the garbage collector.
+    cdef PyObject *_type_index
 
     def __init__(self):
         self._table_mask = 1024 - 1
         self._table = <_MemObject**>PyMem_Malloc(sizeof(_MemObject*)*1024)
         memset(self._table, 0, sizeof(_MemObject*)*1024)
+        self._index = NULL
+        self._type_index = NULL
 
     def __len__(self):
         return self._active
@@ -674,7 +1658,8 @@ cdef class MemObjectCollection:
         cdef long my_size
         my_size = (sizeof(MemObjectCollection)
             + (sizeof(_MemObject**) * (self._table_mask + 1))
-            + (sizeof(_MemObject) * self._active))
+            + (sizeof(_MemObject) * self._active)
+            + sizeof_ObjIndex(self._index))
         for i from 0 <= i <= self._table_mask:
             cur = self._table[i]
             if cur != NULL and cur != _dummy:
@@ -682,6 +1667,1316 @@ cdef class MemObjectCollection:
                             + sizeof_RefList(cur.parent_list))
         return my_size
 
+    cdef _ObjIndex *_get_index(self) except NULL:
+        """Return the dense index, building it if it isn't present."""
+        cdef long i, num_objs
+        cdef Py_ssize_t j, num_refs, pos
+        cdef _MemObject *cur
+        cdef _MemObject **slot
+        cdef _ObjIndex *index
+        cdef RefList *ref_list
+
+        if self._index != NULL:
+            return self._index
+        num_objs = self._active
+        index = <_ObjIndex *>PyMem_Malloc(sizeof(_ObjIndex))
+        if index == NULL:
+            raise MemoryError('Failed to allocate %d bytes'
+                              % (sizeof(_ObjIndex),))
+        memset(index, 0, sizeof(_ObjIndex))
+        try:
+            index.num_objs = num_objs
+            index.objs = <_MemObject **>PyMem_Malloc(
+                sizeof(_MemObject*) * (num_objs + 1))
+            index.child_offsets = <Py_ssize_t *>PyMem_Malloc(
+                sizeof(Py_ssize_t) * (num_objs + 1))
+            if index.objs == NULL or index.child_offsets == NULL:
+                raise MemoryError('Failed to allocate an index for %d objects'
+                                  % (num_objs,))
+            num_refs = 0
+            pos = 0
+            for i from 0 <= i <= self._table_mask:
+                cur = self._table[i]
+                if cur == NULL or cur == _dummy:
+                    continue
+                cur.index = <int32_t>pos
+                index.objs[pos] = cur
+                pos += 1
+                if cur.child_list != NULL:
+                    num_refs += cur.child_list.size
+            index.child_indices = <int32_t *>PyMem_Malloc(
+                sizeof(int32_t) * (num_refs + 1))
+            if index.child_indices == NULL:
+                raise MemoryError('Failed to allocate an index for %d'
+                                  ' references' % (num_refs,))
+            pos = 0
+            for i from 0 <= i < num_objs:
+                index.child_offsets[i] = pos
+                ref_list = index.objs[i].child_list
+                if ref_list == NULL:
+                    continue
+                for j from 0 <= j < ref_list.size:
+                    slot = self._lookup(<object>ref_list.refs[j])
+                    if slot[0] == NULL or slot[0] == _dummy:
+                        # A reference to something we don't have, there is
+                        # nothing to walk to.
+                        continue
+                    index.child_indices[pos] = slot[0].index
+                    pos += 1
+            index.child_offsets[num_objs] = pos
+        except:
+            _free_obj_index(index)
+            raise
+        self._index = index
+        return index
+
+    cdef int _drop_index(self) except -1:
+        """Throw away the dense index, because the collection changed."""
+        if self._index == NULL:
+            return 0
+        _free_obj_index(self._index)
+        self._index = NULL
+        return 1
+
+    def build_index(self):
+        """Assign every object a dense index from 0 to len(self)-1.
+
+        References are translated to 32-bit indices at the same time, which
+        lets whole-graph walks (like iter_recursive_refs) use arrays and
+        bitsets rather than hashing every address they visit. The index is
+        discarded as soon as objects are added, removed or have their children
+        changed.
+
+        :return: The number of objects that were indexed.
+        """
+        self._drop_index()
+        return self._get_index().num_objs
+
+    def drop_index(self):
+        """Release the memory held by the dense index (see build_index)."""
+        self._drop_index()
+
+    property has_index:
+        """Is there a dense index for this collection."""
+        def __get__(self):
+            return self._index != NULL
+
+    property has_dominators:
+        """Are the results of compute_dominators available."""
+        def __get__(self):
+            return self._index != NULL and self._index.dominators != NULL
+
+    cdef int _type_index_add(self, _MemObject *cur) except -1:
+        """Record cur under its current type in the type index."""
+        type_index = <dict>self._type_index
+        key = <object>cur.type_str
+        members = type_index.get(key)
+        if members is None:
+            type_index[key] = [<object>cur.address]
+        else:
+            members.append(<object>cur.address)
+        return 0
+
+    def build_type_index(self):
+        """Group the addresses of all objects by their type.
+
+        Once built, the index is kept up to date as objects are added, and as
+        their type_str is changed (as collapse_instance_dicts does). Removed
+        and retyped objects are only dropped from it the next time their type
+        is looked up, see addresses_of_type.
+
+        :return: The number of distinct types.
+        """
+        cdef long i
+        cdef _MemObject *cur
+
+        self.drop_type_index()
+        type_index = {}
+        Py_INCREF(type_index)
+        self._type_index = <PyObject *>type_index
+        for i from 0 <= i <= self._table_mask:
+            cur = self._table[i]
+            if cur != NULL and cur != _dummy:
+                self._type_index_add(cur)
+        return len(type_index)
+
+    def drop_type_index(self):
+        """Release the memory held by the type index."""
+        Py_XDECREF(self._type_index)
+        self._type_index = NULL
+
+    property has_type_index:
+        """Is there a type index for this collection."""
+        def __get__(self):
+            return self._type_index != NULL
+
+    def addresses_of_type(self, type_str):
+        """Get the addresses of all the objects of a given type.
+
+        With a type index (see build_type_index) this takes time proportional
+        to the number of matches, otherwise the table is scanned, though
+        without creating a proxy for every object.
+
+        :param type_str: The type to look for.
+        :return: A list of addresses, in no particular order.
+        """
+        cdef long i
+        cdef _MemObject *cur
+        cdef _MemObject **slot
+        cdef list found
+
+        found = []
+        if self._type_index == NULL:
+            for i from 0 <= i <= self._table_mask:
+                cur = self._table[i]
+                if (cur != NULL and cur != _dummy
+                    and (cur.type_str == <PyObject *>type_str
+                         or <object>cur.type_str == type_str)):
+                    found.append(<object>cur.address)
+            return found
+        type_index = <dict>self._type_index
+        members = type_index.get(type_str)
+        if members is None:
+            return found
+        from meliae import _intset
+        seen = _intset.IDSet()
+        for address in members:
+            if address in seen:
+                # Retyped back and forth, or removed and added again
+                continue
+            slot = self._lookup(address)
+            if slot[0] == NULL or slot[0] == _dummy:
+                continue
+            if (slot[0].type_str != <PyObject *>type_str
+                and <object>slot[0].type_str != type_str):
+                continue
+            seen.add(address)
+            found.append(address)
+        if len(found) != len(members):
+            # Compact the stale entries away
+            if found:
+                type_index[type_str] = list(found)
+            else:
+                del type_index[type_str]
+        return found
+
+    def summarize_types(self, root=None, excluding=None):
+        """Count the objects of each type, and how much memory they use.
+
+        The totals are kept in per-type C structs, so no python objects are
+        created per object. With a root, the objects reachable from it are
+        walked over the dense index (which is built if needed) with a bitset
+        of the objects already seen.
+
+        :param root: If not None, only summarize the objects reachable from
+            this address (or _MemObjectProxy), including itself.
+        :param excluding: Addresses not to walk into, see iter_recursive_refs.
+        :return: A list of (type_str, count, total_size, sq_sum, max_size,
+            max_address) tuples, in the order the types were first seen.
+            max_address is None if all objects of the type are empty.
+        """
+        cdef _TypeTotals *totals
+        cdef _TypeTotals *t
+        cdef long num_types, max_types, i, idx
+        cdef int type_id
+        cdef PyObject *last_type
+        cdef PyObject *found
+        cdef _MemObject *cur
+        cdef _MOPReferencedIterator iterator
+
+        iterator = None
+        if root is not None:
+            if not isinstance(root, _MemObjectProxy):
+                root = self[root]
+            self._get_index()
+            iterator = _MOPReferencedIterator(root, excluding)
+        type_ids = {}
+        num_types = 0
+        max_types = 64
+        totals = <_TypeTotals *>PyMem_Malloc(sizeof(_TypeTotals) * max_types)
+        if totals == NULL:
+            raise MemoryError('Failed to allocate the type totals')
+        last_type = NULL
+        type_id = -1
+        try:
+            i = 0
+            while True:
+                # The next object, either from the table or from the walk
+                if iterator is None:
+                    while i <= self._table_mask:
+                        cur = self._table[i]
+                        i += 1
+                        if cur != NULL and cur != _dummy:
+                            break
+                    else:
+                        break
+                else:
+                    idx = iterator._next_index()
+                    if idx < 0:
+                        break
+                    cur = iterator._index.objs[idx]
+                if cur.type_str != last_type:
+                    last_type = cur.type_str
+                    found = PyDict_GetItem_ptr(type_ids, last_type)
+                    if found != NULL:
+                        type_id = <object>found
+                    else:
+                        if num_types == max_types:
+                            max_types *= 2
+                            t = <_TypeTotals *>PyMem_Realloc(totals,
+                                sizeof(_TypeTotals) * max_types)
+                            if t == NULL:
+                                raise MemoryError('Failed to allocate the'
+                                                  ' type totals')
+                            totals = t
+                        type_id = num_types
+                        num_types += 1
+                        type_ids[<object>last_type] = type_id
+                        memset(totals + type_id, 0, sizeof(_TypeTotals))
+                        totals[type_id].type_str = last_type
+                t = totals + type_id
+                t.count += 1
+                t.total_size += cur.size
+                t.sq_sum += (<double>cur.size) * cur.size
+                if cur.size > t.max_size:
+                    t.max_size = cur.size
+                    t.max_obj = cur
+            result = []
+            for type_id from 0 <= type_id < num_types:
+                t = totals + type_id
+                if t.max_obj == NULL:
+                    max_address = None
+                else:
+                    max_address = <object>t.max_obj.address
+                result.append((<object>t.type_str, t.count, t.total_size,
+                               int(t.sq_sum), t.max_size, max_address))
+        finally:
+            PyMem_Free(totals)
+        return result
+
+    def select(self, type_str=None, size_gt=None, size_lt=None,
+               num_parents=None, num_children=None, value_re=None):
+        """Find the objects matching all of the given predicates.
+
+        The predicates are checked against the raw table, so only the matching
+        objects get a proxy. With a type index (see build_type_index), giving
+        type_str only looks at the objects of that type.
+
+        :param type_str: The type of the objects.
+        :param size_gt: Only objects with a size greater than this.
+        :param size_lt: Only objects with a size less than this.
+        :param num_parents: Only objects with exactly this many parents.
+        :param num_children: Only objects with exactly this many references.
+        :param value_re: A regex (or pattern string) searched for in the
+            value (or name) of the object. Objects whose value is not a
+            string (of the same kind as the pattern) don't match.
+        :return: A list of _MemObjectProxy, in no particular order.
+        """
+        cdef _Query query
+        cdef long i
+        cdef _MemObject *cur
+        cdef _MemObject **slot
+        cdef list found
+
+        memset(&query, 0, sizeof(_Query))
+        if type_str is not None:
+            type_str = intern(type_str)
+            query.type_str = <PyObject *>type_str
+        if size_gt is not None:
+            query.check_size_gt = 1
+            query.size_gt = size_gt
+        if size_lt is not None:
+            query.check_size_lt = 1
+            query.size_lt = size_lt
+        if num_parents is None:
+            query.num_parents = -1
+        else:
+            query.num_parents = num_parents
+        if num_children is None:
+            query.num_children = -1
+        else:
+            query.num_children = num_children
+        if value_re is not None:
+            import re
+            if not hasattr(value_re, 'search'):
+                value_re = re.compile(value_re)
+            value_search = value_re.search
+            value_type = type(value_re.pattern)
+            query.value_search = <PyObject *>value_search
+            query.value_type = <PyObject *>value_type
+        found = []
+        if type_str is not None and self._type_index != NULL:
+            for address in self.addresses_of_type(type_str):
+                slot = self._lookup(address)
+                if _query_matches(slot[0], &query):
+                    found.append(self._proxy_for(address, slot[0]))
+            return found
+        for i from 0 <= i <= self._table_mask:
+            cur = self._table[i]
+            if cur == NULL or cur == _dummy:
+                continue
+            if _query_matches(cur, &query):
+                found.append(self._proxy_for(<object>cur.address, cur))
+        return found
+
+    def index_of(self, at):
+        """Get the dense index for an object (building the index if needed).
+
+        :param at: An address or a _MemObjectProxy
+        """
+        cdef _MemObject **slot
+
+        if isinstance(at, _MemObjectProxy):
+            address = at.address
+        else:
+            address = at
+        self._get_index()
+        slot = self._lookup(address)
+        if slot[0] == NULL or slot[0] == _dummy:
+            raise KeyError('address %s not present' % (at,))
+        return slot[0].index
+
+    def compute_parents(self, long max_parents=-1):
+        """Fill in the parents of every object from the children lists.
+
+        This is a two pass counting build over the dense index. The first pass
+        counts the (distinct) parents of every object, so we can allocate each
+        parent list at its exact size, and the second pass fills them in. No
+        python objects are created along the way.
+
+        If there was no dense index, a temporary one is built and released
+        again afterwards.
+
+        :param max_parents: Only record the first max_parents distinct parents
+            of each object. If < 0, record all of them.
+        """
+        cdef _ObjIndex *index
+        cdef int had_index
+        cdef long i, num_objs
+        cdef Py_ssize_t pos, end
+        cdef int32_t child
+        cdef int32_t *last_parent
+        cdef long *counts
+        cdef _MemObject *cur
+        cdef RefList *ref_list
+
+        had_index = (self._index != NULL)
+        index = self._get_index()
+        num_objs = index.num_objs
+        last_parent = NULL
+        counts = NULL
+        try:
+            last_parent = <int32_t *>PyMem_Malloc(
+                sizeof(int32_t) * (num_objs + 1))
+            counts = <long *>PyMem_Malloc(sizeof(long) * (num_objs + 1))
+            if last_parent == NULL or counts == NULL:
+                raise MemoryError('Failed to allocate parent counts for %d'
+                                  ' objects' % (num_objs,))
+            # A parent that refers to the same child multiple times only counts
+            # once. All references from one parent are processed together, so
+            # remembering the last parent we saw for each child is enough to
+            # filter them.
+            for i from 0 <= i < num_objs:
+                last_parent[i] = -1
+                counts[i] = 0
+            for i from 0 <= i < num_objs:
+                end = index.child_offsets[i + 1]
+                for pos from index.child_offsets[i] <= pos < end:
+                    child = index.child_indices[pos]
+                    if last_parent[child] == i:
+                        continue
+                    last_parent[child] = <int32_t>i
+                    if max_parents < 0 or counts[child] < max_parents:
+                        counts[child] += 1
+            for i from 0 <= i < num_objs:
+                cur = index.objs[i]
+                _free_ref_list(cur.parent_list)
+                cur.parent_list = NULL
+                last_parent[i] = -1
+                if counts[i] == 0:
+                    continue
+                ref_list = <RefList *>PyMem_Malloc(
+                    sizeof(RefList) + sizeof(PyObject*) * counts[i])
+                if ref_list == NULL:
+                    raise MemoryError('Failed to allocate a parent list of'
+                                      ' %d entries' % (counts[i],))
+                # size is the fill position until the second pass completes
+                ref_list.size = 0
+                cur.parent_list = ref_list
+            for i from 0 <= i < num_objs:
+                cur = index.objs[i]
+                end = index.child_offsets[i + 1]
+                for pos from index.child_offsets[i] <= pos < end:
+                    child = index.child_indices[pos]
+                    if last_parent[child] == i:
+                        continue
+                    last_parent[child] = <int32_t>i
+                    ref_list = index.objs[child].parent_list
+                    if ref_list != NULL and ref_list.size < counts[child]:
+                        ref_list.refs[ref_list.size] = cur.address
+                        Py_INCREF(<object>cur.address)
+                        ref_list.size += 1
+        finally:
+            PyMem_Free(last_parent)
+            PyMem_Free(counts)
+            if not had_index:
+                self._drop_index()
+
+    cdef _MemObject *_get_child(self, _MemObject *cur, long offset) except? NULL:
+        """The offset'th child of cur, or NULL if it isn't in the collection."""
+        cdef _MemObject **slot
+
+        slot = self._lookup(<object>cur.child_list.refs[offset])
+        if slot[0] == NULL or slot[0] == _dummy:
+            return NULL
+        return slot[0]
+
+    cdef int _unlink_parent(self, RefList *children,
+                            PyObject *address) except -1:
+        """Drop address from the parents of all of children."""
+        cdef long i
+        cdef _MemObject **slot
+
+        if children == NULL:
+            return 0
+        for i from 0 <= i < children.size:
+            slot = self._lookup(<object>children.refs[i])
+            if slot[0] != NULL and slot[0] != _dummy:
+                _ref_list_remove(&slot[0].parent_list, address)
+        return 0
+
+    cdef int _link_parent(self, RefList *children, RefList *old_children,
+                          PyObject *address, long max_parents) except -1:
+        """Add address to the parents of the new entries in children."""
+        cdef long i
+        cdef _MemObject **slot
+        cdef _MemObject *child
+
+        if children == NULL:
+            return 0
+        for i from 0 <= i < children.size:
+            if _ref_list_contains(old_children, children.refs[i]):
+                # It was already a child, so its parents are up to date
+                continue
+            slot = self._lookup(<object>children.refs[i])
+            if slot[0] == NULL or slot[0] == _dummy:
+                continue
+            child = slot[0]
+            if _ref_list_contains(child.parent_list, address):
+                continue
+            if (max_parents > 0 and child.parent_list != NULL
+                and child.parent_list.size >= max_parents):
+                continue
+            _ref_list_append(&child.parent_list, address)
+        return 0
+
+    def collapse_instance_dicts(self, update_parents=False,
+                                long max_parents=-1):
+        """Fold the __dict__ of every instance (and module) into it.
+
+        An instance of a new-style class references its __dict__ and its
+        type, an old-style 'instance' references its 'classobj' and its
+        __dict__, and a module references just its dict. The instance takes
+        over the references and the size of the dict, and the dict is removed
+        from the collection. Old-style instances also get the name of their
+        class as their type_str.
+
+        This works directly on the table and reference lists, without
+        creating proxies.
+
+        :param update_parents: If True, the parent lists are kept up to date:
+            the children of each dict get the instance as a parent instead.
+        :param max_parents: When updating parents, don't add a parent to a
+            list that already has max_parents entries. If <= 0, no limit.
+        :return: The number of objects that were collapsed.
+        """
+        cdef long i, j, num_dict_refs, num_refs, collapsed
+        cdef int k
+        cdef _MemObject *cur
+        cdef _MemObject *child_1
+        cdef _MemObject *child_2
+        cdef _MemObject *dict_obj
+        cdef _MemObject *type_obj
+        cdef RefList *old_refs
+        cdef RefList *new_refs
+        cdef PyObject *skip[11]
+
+        skip_types = [intern(t) for t in ('str', 'dict', 'tuple', 'list',
+            'type', 'function', 'wrapper_descriptor', 'code', 'classobj',
+            'int', 'weakref')]
+        for k from 0 <= k < 11:
+            skip[k] = <PyObject *>skip_types[k]
+        dict_str = intern('dict')
+        type_str = intern('type')
+        classobj_str = intern('classobj')
+        module_str = intern('module')
+        instance_str = intern('instance')
+        collapsed = 0
+        to_be_removed = []
+        for i from 0 <= i <= self._table_mask:
+            cur = self._table[i]
+            if cur == NULL or cur == _dummy or cur.child_list == NULL:
+                continue
+            for k from 0 <= k < 11:
+                if cur.type_str == skip[k]:
+                    break
+            else:
+                k = -1
+            if k >= 0:
+                continue
+            type_obj = NULL
+            if (cur.type_str == <PyObject *>module_str
+                and cur.child_list.size == 1):
+                dict_obj = self._get_child(cur, 0)
+                if (dict_obj == NULL
+                    or dict_obj.type_str != <PyObject *>dict_str):
+                    continue
+            elif cur.child_list.size == 2:
+                child_1 = self._get_child(cur, 0)
+                child_2 = self._get_child(cur, 1)
+                if child_1 == NULL or child_2 == NULL:
+                    continue
+                if (child_1.type_str == <PyObject *>dict_str
+                    and child_2.type_str == <PyObject *>type_str):
+                    # This is a new-style class
+                    dict_obj = child_1
+                    type_obj = child_2
+                elif (cur.type_str == <PyObject *>instance_str
+                      and child_1.type_str == <PyObject *>classobj_str
+                      and child_2.type_str == <PyObject *>dict_str):
+                    # This is an old-style class, named by the value of its
+                    # classobj. Without a name, it is left alone rather than
+                    # failing half way through the table.
+                    if (child_1.value == NULL
+                        or not isinstance(<object>child_1.value,
+                                          (bytes, unicode))):
+                        continue
+                    type_obj = child_1
+                    dict_obj = child_2
+                else:
+                    continue
+            else:
+                continue
+            if dict_obj == cur:
+                continue
+            collapsed += 1
+            # The instance now references everything in the dict, and the type
+            if dict_obj.child_list == NULL:
+                num_dict_refs = 0
+            else:
+                num_dict_refs = dict_obj.child_list.size
+            num_refs = num_dict_refs
+            if type_obj != NULL:
+                num_refs += 1
+            new_refs = NULL
+            if num_refs > 0:
+                new_refs = <RefList *>PyMem_Malloc(
+                    sizeof(RefList) + sizeof(PyObject*) * num_refs)
+                if new_refs == NULL:
+                    raise MemoryError('Failed to allocate a reference list'
+                                      ' of %d entries' % (num_refs,))
+                new_refs.size = num_refs
+                for j from 0 <= j < num_dict_refs:
+                    new_refs.refs[j] = dict_obj.child_list.refs[j]
+                    Py_XINCREF(new_refs.refs[j])
+                if type_obj != NULL:
+                    new_refs.refs[num_dict_refs] = type_obj.address
+                    Py_XINCREF(type_obj.address)
+            old_refs = cur.child_list
+            cur.child_list = new_refs
+            if update_parents:
+                # The dict is going away, and its children are now referenced
+                # by the instance itself. The type stays a child, so its
+                # parents don't change.
+                self._unlink_parent(dict_obj.child_list, dict_obj.address)
+                _ref_list_remove(&dict_obj.parent_list, cur.address)
+                self._link_parent(new_refs, old_refs, cur.address,
+                                  max_parents)
+            _free_ref_list(old_refs)
+            cur.size += dict_obj.size
+            cur.total_size = 0
+            if (cur.type_str == <PyObject *>instance_str and type_obj != NULL
+                and type_obj.value != NULL):
+                instance_type_str = <object>type_obj.value
+                if not isinstance(instance_type_str, str):
+                    instance_type_str = instance_type_str.decode('UTF-8')
+                instance_type_str = intern(instance_type_str)
+                Py_INCREF(instance_type_str)
+                Py_XDECREF(cur.type_str)
+                cur.type_str = <PyObject *>instance_type_str
+                if self._type_index != NULL:
+                    self._type_index_add(cur)
+            to_be_removed.append(<object>dict_obj.address)
+        # Removing entries doesn't move the others, but it is simpler to do it
+        # once we are done walking the table.
+        self._drop_index()
+        for address in to_be_removed:
+            if address in self:
+                del self[address]
+        return collapsed
+
+    cdef int _type_in(self, PyObject *address, PyObject **types,
+                      int num_types) except -1:
+        """Is address in the collection, with one of the given types."""
+        cdef _MemObject **slot
+        cdef int k
+
+        if num_types == 0:
+            return 0
+        slot = self._lookup(<object>address)
+        if slot[0] == NULL or slot[0] == _dummy:
+            return 0
+        for k from 0 <= k < num_types:
+            if slot[0].type_str == types[k]:
+                return 1
+        return 0
+
+    def remove_expensive_references(self, noref_types=('module', 'frame',
+                                                       'type'),
+                                    lru_types=('_LRUNode',),
+                                    update_parents=False,
+                                    long max_parents=-1):
+        """Filter out references that are mere housekeeping links.
+
+        References to objects of noref_types are replaced by a single
+        reference to the null object at address 0 (which is added as
+        '<ex-reference>' if needed), functions lose their references to
+        their globals and module, and objects of lru_types lose their
+        references to each other.
+
+        This is a single pass over the table. Each reference is checked by
+        looking up the type of the object it points to, and the reference
+        lists are filtered in place.
+
+        :param noref_types: The types of the objects nothing should refer to.
+        :param lru_types: The types of linked list nodes, whose 'sideways'
+            references to each other should be removed.
+        :param update_parents: If True, the parent lists of the objects whose
+            references were removed (and of the null object) are updated.
+        :param max_parents: When updating parents, don't add a parent to a
+            list that already has max_parents entries. If <= 0, no limit.
+        :return: The number of objects whose references changed.
+        """
+        cdef long i, j, out, num_refs, removed_size, changed
+        cdef int num_noref, num_lru, k, is_function, is_lru, needs_null, drop
+        cdef int had_null
+        cdef _MemObject *cur
+        cdef _MemObject *null_obj
+        cdef _MemObject **slot
+        cdef RefList *ref_list
+        cdef RefList *removed
+        cdef PyObject **noref
+        cdef PyObject **lru
+        cdef PyObject *null_address
+
+        noref_types = [intern(t) for t in noref_types]
+        lru_types = [intern(t) for t in lru_types]
+        num_noref = len(noref_types)
+        num_lru = len(lru_types)
+        function_str = intern('function')
+        zero = 0
+        if zero not in self:
+            self.add(zero, '<ex-reference>', 0)
+        slot = self._lookup(zero)
+        null_obj = slot[0]
+        null_address = null_obj.address
+        self._drop_index()
+        noref = <PyObject **>PyMem_Malloc(
+            sizeof(PyObject*) * (num_noref + num_lru + 1))
+        if noref == NULL:
+            raise MemoryError('Failed to allocate the type list')
+        lru = noref + num_noref
+        removed = NULL
+        removed_size = 0
+        changed = 0
+        try:
+            for k from 0 <= k < num_noref:
+                noref[k] = <PyObject *>noref_types[k]
+            for k from 0 <= k < num_lru:
+                lru[k] = <PyObject *>lru_types[k]
+            for i from 0 <= i <= self._table_mask:
+                cur = self._table[i]
+                if cur == NULL or cur == _dummy or cur == null_obj:
+                    continue
+                ref_list = cur.child_list
+                if ref_list == NULL:
+                    num_refs = 0
+                else:
+                    num_refs = ref_list.size
+                is_function = (cur.type_str == <PyObject *>function_str)
+                is_lru = 0
+                if not is_function:
+                    for k from 0 <= k < num_lru:
+                        if cur.type_str == lru[k]:
+                            is_lru = 1
+                            break
+                    if num_refs == 0:
+                        continue
+                # Move the references we drop to removed, and compact the
+                # rest in place
+                if num_refs >= removed_size:
+                    ref_list = <RefList *>PyMem_Realloc(removed,
+                        sizeof(RefList)
+                        + sizeof(PyObject*) * (num_refs * 2 + 16))
+                    if ref_list == NULL:
+                        raise MemoryError('Failed to allocate a reference'
+                                          ' list of %d entries' % (num_refs,))
+                    removed = ref_list
+                    removed.size = 0
+                    removed_size = num_refs * 2 + 16
+                    ref_list = cur.child_list
+                out = 0
+                for j from 0 <= j < num_refs:
+                    if is_function:
+                        # Currently func_traverse returns func_code,
+                        # func_globals, func_module, ... We drop globals and
+                        # module, which aren't very helpful for understanding
+                        # what is going on, especially since the function
+                        # itself is in its own globals.
+                        drop = (j == 1 or j == 2)
+                    elif is_lru:
+                        drop = self._type_in(ref_list.refs[j], lru, num_lru)
+                    else:
+                        drop = self._type_in(ref_list.refs[j], noref,
+                                             num_noref)
+                    if drop:
+                        removed.refs[removed.size] = ref_list.refs[j]
+                        removed.size += 1
+                    else:
+                        ref_list.refs[out] = ref_list.refs[j]
+                        out += 1
+                needs_null = (is_function or (not is_lru and removed.size > 0))
+                if removed.size == 0 and not needs_null:
+                    continue
+                changed += 1
+                if ref_list != NULL:
+                    ref_list.size = out
+                # Only an object that already referenced the null object can
+                # already be one of its parents, so we don't have to search
+                # its (potentially huge) parent list for every object.
+                had_null = (update_parents and needs_null
+                            and (_ref_list_contains(ref_list, null_address)
+                                 or _ref_list_contains(removed,
+                                                       null_address)))
+                if needs_null:
+                    _ref_list_append(&cur.child_list, null_address)
+                elif out == 0:
+                    PyMem_Free(ref_list)
+                    cur.child_list = NULL
+                ref_list = cur.child_list
+                if update_parents:
+                    for j from 0 <= j < removed.size:
+                        if _ref_list_contains(ref_list, removed.refs[j]):
+                            continue
+                        slot = self._lookup(<object>removed.refs[j])
+                        if slot[0] != NULL and slot[0] != _dummy:
+                            _ref_list_remove(&slot[0].parent_list,
+                                             cur.address)
+                    if (needs_null
+                        and not (had_null
+                                 and _ref_list_contains(null_obj.parent_list,
+                                                        cur.address))
+                        and (max_parents <= 0
+                             or null_obj.parent_list == NULL
+                             or null_obj.parent_list.size < max_parents)):
+                        _ref_list_append(&null_obj.parent_list, cur.address)
+                for j from 0 <= j < removed.size:
+                    Py_XDECREF(removed.refs[j])
+                removed.size = 0
+        finally:
+            if removed != NULL:
+                for j from 0 <= j < removed.size:
+                    Py_XDECREF(removed.refs[j])
+                PyMem_Free(removed)
+            PyMem_Free(noref)
+        return changed
+
+    def at_index(self, idx):
+        """Return the object with the given dense index."""
+        cdef _ObjIndex *index
+        cdef _MemObject *cur
+        cdef long c_idx
+
+        index = self._get_index()
+        c_idx = idx
+        if c_idx < 0 or c_idx >= index.num_objs:
+            raise IndexError('index %d out of range for %d objects'
+                             % (idx, index.num_objs))
+        cur = index.objs[c_idx]
+        return self._proxy_for(<object>cur.address, cur)
+
+    def to_arrays(self):
+        """Export the object graph as flat arrays.
+
+        Position i of every array describes the object with dense index i (the
+        index is built if needed). The arrays are array.array instances, so
+        they support the buffer protocol, and can be used directly with
+        numpy.frombuffer. For example, the children as a sparse matrix:
+
+            a = objs.to_arrays()
+            n = len(a['sizes'])
+            children = scipy.sparse.csr_matrix(
+                (numpy.ones(len(a['child_indices']), dtype=numpy.int8),
+                 numpy.frombuffer(a['child_indices'], dtype=numpy.int32),
+                 numpy.frombuffer(a['child_offsets'], dtype=numpy.int64)),
+                shape=(n, n))
+
+        References to addresses that are not in the collection are dropped.
+        The arrays are copies, so they stay valid when the collection changes.
+
+        :return: A dict with
+            'addresses': array('Q') of the addresses
+            'type_ids': array('i') of offsets into 'type_table'
+            'type_table': A list of type_str
+            'sizes': array('q')
+            'total_sizes': array('Q')
+            'child_offsets', 'parent_offsets': array('q') of num_objs + 1 CSR
+                offsets, so the children of object i are
+                child_indices[child_offsets[i]:child_offsets[i+1]]
+            'child_indices', 'parent_indices': array('i')
+        """
+        cdef _ObjIndex *index
+        cdef _MemObject *cur
+        cdef long i, num_objs
+        cdef int type_id
+        cdef PyObject *last_type
+        cdef array.array addresses, type_ids, sizes, total_sizes
+
+        index = self._get_index()
+        _ensure_parent_index(index)
+        num_objs = index.num_objs
+        addresses = _new_array('Q', num_objs)
+        type_ids = _new_array('i', num_objs)
+        sizes = _new_array('q', num_objs)
+        total_sizes = _new_array('Q', num_objs)
+        type_table = []
+        type_id_of = {}
+        last_type = NULL
+        type_id = -1
+        for i from 0 <= i < num_objs:
+            cur = index.objs[i]
+            addresses.data.as_ulonglongs[i] = <object>cur.address
+            if cur.type_str != last_type:
+                # Objects of one type tend to be loaded together
+                last_type = cur.type_str
+                type_str = <object>last_type
+                maybe_id = type_id_of.get(type_str)
+                if maybe_id is None:
+                    maybe_id = len(type_table)
+                    type_id_of[type_str] = maybe_id
+                    type_table.append(type_str)
+                type_id = maybe_id
+            type_ids.data.as_ints[i] = type_id
+            sizes.data.as_longlongs[i] = cur.size
+            total_sizes.data.as_ulonglongs[i] = cur.total_size
+        return {
+            'addresses': addresses,
+            'type_ids': type_ids,
+            'type_table': type_table,
+            'sizes': sizes,
+            'total_sizes': total_sizes,
+            'child_offsets': _copy_offsets(index.child_offsets, num_objs),
+            'child_indices': _copy_indices(index.child_indices,
+                                           index.child_offsets[num_objs]),
+            'parent_offsets': _copy_offsets(index.parent_offsets, num_objs),
+            'parent_indices': _copy_indices(index.parent_indices,
+                                            index.parent_offsets[num_objs]),
+        }
+
+    def compute_dominators(self, roots=None):
+        """Compute the dominator tree and the retained size of every object.
+
+        An object X dominates Y if every path from the roots to Y goes through
+        X, so the retained size of X is how much memory would be freed if X
+        went away. It is the sum of the sizes of everything X dominates
+        (including X itself). Results are kept with the dense index (which is
+        built if needed), and are available from the retained_size and
+        immediate_dominator attributes of each object until the collection
+        changes.
+
+        :param roots: A list of addresses (or objects) to treat as the roots.
+            If None, every object that nothing refers to is a root, as is one
+            object in each unreferenced reference cycle.
+        :return: The number of objects reachable from the roots.
+        """
+        cdef _ObjIndex *index
+        cdef _MemObject **slot
+
+        index = self._get_index()
+        root_indices = None
+        if roots is not None:
+            root_indices = []
+            for root in roots:
+                if isinstance(root, _MemObjectProxy):
+                    root = root.address
+                slot = self._lookup(root)
+                if slot[0] == NULL or slot[0] == _dummy:
+                    raise KeyError('address %s not present' % (root,))
+                root_indices.append(slot[0].index)
+        return _compute_dominators(index, root_indices)
+
+    cdef int _is_indexed(self, _MemObject *obj):
+        """Is obj numbered by the current dense index?
+
+        Objects removed from the collection (and kept alive by a proxy) may
+        still carry an index from an older build_index().
+        """
+        if self._index == NULL:
+            return 0
+        return (obj.index >= 0 and obj.index < self._index.num_objs
+                and self._index.objs[obj.index] == obj)
+
+    cdef long _dominator_of(self, _MemObject *obj) except -3:
+        """The dense index of the immediate dominator, or a DOM_* value.
+
+        Also returns DOM_UNREACHABLE if compute_dominators hasn't been run, or
+        obj is no longer in the collection.
+        """
+        if self._index == NULL or self._index.dominators == NULL:
+            return DOM_UNREACHABLE
+        if not self._is_indexed(obj):
+            return DOM_UNREACHABLE
+        return self._index.dominators[obj.index]
+
+    def summarize_retained(self, long top=20):
+        """Aggregate the retained sizes by type.
+
+        This walks the dominator tree (see compute_dominators, which must have
+        been run first). An object only counts towards its type if none of its
+        dominators has the same type, so a dict held by another dict isn't
+        counted twice.
+
+        :param top: How many of the largest retainers to report.
+        :return: (types, top_retainers, total_size). types is a list of
+            (type_str, count, retained_size, max_retained, max_address) tuples
+            for the outermost objects of each type, top_retainers is a list of
+            (retained_size, address) for the largest of those objects, biggest
+            first, and total_size is the size of everything reachable.
+        """
+        cdef _ObjIndex *index
+        cdef long i, num_objs, num_types, sp, n_top, j
+        cdef int32_t node, child, dom
+        cdef Py_ssize_t pos
+        cdef int32_t *type_ids
+        cdef Py_ssize_t *tree_offsets
+        cdef int32_t *tree_children
+        cdef int32_t *stack
+        cdef Py_ssize_t *stack_pos
+        cdef long *active
+        cdef long *counts
+        cdef unsigned long *totals
+        cdef int32_t *max_idx
+        cdef int32_t *top_idx
+        cdef unsigned long retained, total_size
+
+        index = self._index
+        if index == NULL or index.dominators == NULL:
+            raise ValueError('compute_dominators() must be called first')
+        num_objs = index.num_objs
+        if top < 0:
+            top = 0
+        type_ids = NULL
+        tree_offsets = NULL
+        tree_children = NULL
+        stack = NULL
+        stack_pos = NULL
+        active = NULL
+        counts = NULL
+        totals = NULL
+        max_idx = NULL
+        top_idx = NULL
+        try:
+            type_ids = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_objs + 1))
+            tree_offsets = <Py_ssize_t *>PyMem_Malloc(
+                sizeof(Py_ssize_t) * (num_objs + 2))
+            tree_children = <int32_t *>PyMem_Malloc(
+                sizeof(int32_t) * (num_objs + 1))
+            stack = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_objs + 1))
+            stack_pos = <Py_ssize_t *>PyMem_Malloc(
+                sizeof(Py_ssize_t) * (num_objs + 1))
+            top_idx = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (top + 1))
+            if (type_ids == NULL or tree_offsets == NULL
+                or tree_children == NULL or stack == NULL
+                or stack_pos == NULL or top_idx == NULL):
+                raise MemoryError('Failed to allocate dominator tree for %d'
+                                  ' objects' % (num_objs,))
+            # Equal type strings aren't necessarily the same object, so number
+            # them with a dict.
+            type_map = {}
+            for i from 0 <= i < num_objs:
+                type_str = <object>index.objs[i].type_str
+                type_id = type_map.get(type_str)
+                if type_id is None:
+                    type_id = len(type_map)
+                    type_map[type_str] = type_id
+                type_ids[i] = type_id
+            num_types = len(type_map)
+            active = <long *>PyMem_Malloc(sizeof(long) * (num_types + 1))
+            counts = <long *>PyMem_Malloc(sizeof(long) * (num_types + 1))
+            totals = <unsigned long *>PyMem_Malloc(
+                sizeof(unsigned long) * (num_types + 1))
+            max_idx = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_types + 1))
+            if (active == NULL or counts == NULL or totals == NULL
+                or max_idx == NULL):
+                raise MemoryError('Failed to allocate summaries for %d types'
+                                  % (num_types,))
+            for i from 0 <= i < num_types:
+                active[i] = 0
+                counts[i] = 0
+                totals[i] = 0
+                max_idx[i] = -1
+            # The dominator tree as a CSR, with the virtual root at num_objs
+            memset(tree_offsets, 0, sizeof(Py_ssize_t) * (num_objs + 2))
+            total_size = 0
+            for i from 0 <= i < num_objs:
+                dom = index.dominators[i]
+                if dom == DOM_UNREACHABLE:
+                    continue
+                if dom == DOM_ROOT:
+                    dom = <int32_t>num_objs
+                    total_size += index.retained_sizes[i]
+                tree_offsets[dom + 1] += 1
+            for i from 0 <= i <= num_objs:
+                tree_offsets[i + 1] += tree_offsets[i]
+            for i from 0 <= i < num_objs:
+                dom = index.dominators[i]
+                if dom == DOM_UNREACHABLE:
+                    continue
+                if dom == DOM_ROOT:
+                    dom = <int32_t>num_objs
+                tree_children[tree_offsets[dom]] = <int32_t>i
+                tree_offsets[dom] += 1
+            for i from num_objs >= i > 0:
+                tree_offsets[i] = tree_offsets[i - 1]
+            tree_offsets[0] = 0
+            # Walk it, tracking how many objects of each type are on the
+            # current path.
+            n_top = 0
+            sp = 0
+            stack[0] = <int32_t>num_objs
+            stack_pos[0] = tree_offsets[num_objs]
+            while sp >= 0:
+                node = stack[sp]
+                pos = stack_pos[sp]
+                if pos >= tree_offsets[node + 1]:
+                    if node != num_objs:
+                        active[type_ids[node]] -= 1
+                    sp -= 1
+                    continue
+                stack_pos[sp] = pos + 1
+                child = tree_children[pos]
+                i = type_ids[child]
+                if active[i] == 0:
+                    retained = index.retained_sizes[child]
+                    counts[i] += 1
+                    totals[i] += retained
+                    if (max_idx[i] == -1
+                        or retained > index.retained_sizes[max_idx[i]]):
+                        max_idx[i] = child
+                    # Insertion into top_idx, which is kept sorted (largest
+                    # first), and is expected to be small.
+                    j = n_top
+                    if j < top:
+                        n_top += 1
+                    else:
+                        j = top - 1
+                        if (j < 0 or
+                            index.retained_sizes[top_idx[j]] >= retained):
+                            j = -1
+                    if j >= 0:
+                        while (j > 0 and
+                               index.retained_sizes[top_idx[j - 1]] < retained):
+                            top_idx[j] = top_idx[j - 1]
+                            j -= 1
+                        top_idx[j] = child
+                active[i] += 1
+                sp += 1
+                stack[sp] = child
+                stack_pos[sp] = tree_offsets[child]
+            types = [None] * num_types
+            for type_str, type_id in type_map.items():
+                if counts[type_id] == 0:
+                    max_address = None
+                    max_retained = 0
+                else:
+                    max_address = <object>index.objs[max_idx[type_id]].address
+                    max_retained = index.retained_sizes[max_idx[type_id]]
+                types[type_id] = (type_str, counts[type_id], totals[type_id],
+                                  max_retained, max_address)
+            top_retainers = []
+            for j from 0 <= j < n_top:
+                top_retainers.append((index.retained_sizes[top_idx[j]],
+                                      <object>index.objs[top_idx[j]].address))
+        finally:
+            PyMem_Free(type_ids)
+            PyMem_Free(tree_offsets)
+            PyMem_Free(tree_children)
+            PyMem_Free(stack)
+            PyMem_Free(stack_pos)
+            PyMem_Free(active)
+            PyMem_Free(counts)
+            PyMem_Free(totals)
+            PyMem_Free(max_idx)
+            PyMem_Free(top_idx)
+        return [t for t in types if t[1] > 0], top_retainers, total_size
+
+    def strongly_connected_components(self):
+        """Find the reference cycles in the collection.
+
+        Every object is assigned to a strongly connected component (a set of
+        objects that can all reach each other), which is then available as
+        the component_id attribute of each object until the collection
+        changes.
+
+        :return: A list of (component_id, num_objects, total_size) for every
+            component that is a reference cycle, which is any component with
+            more than one object, or an object that refers to itself.
+        """
+        cdef _ObjIndex *index
+        cdef long i, num_objs, num_components, comp
+        cdef Py_ssize_t pos, end
+        cdef long *counts
+        cdef unsigned long *sizes
+        cdef unsigned char *self_refs
+        cdef Py_ssize_t *offsets
+        cdef int32_t *members
+
+        index = self._get_index()
+        num_objs = index.num_objs
+        num_components = _compute_components(index)
+        counts = NULL
+        sizes = NULL
+        self_refs = NULL
+        offsets = NULL
+        members = NULL
+        try:
+            counts = <long *>PyMem_Malloc(sizeof(long) * (num_components + 1))
+            sizes = <unsigned long *>PyMem_Malloc(
+                sizeof(unsigned long) * (num_components + 1))
+            self_refs = _new_bitset(num_components)
+            if counts == NULL or sizes == NULL:
+                raise MemoryError('Failed to allocate sizes for %d'
+                                  ' components' % (num_components,))
+            for i from 0 <= i < num_components:
+                counts[i] = 0
+                sizes[i] = 0
+            for i from 0 <= i < num_objs:
+                comp = index.components[i]
+                counts[comp] += 1
+                sizes[comp] += index.objs[i].size
+                end = index.child_offsets[i + 1]
+                for pos from index.child_offsets[i] <= pos < end:
+                    if index.child_indices[pos] == i:
+                        _set_bit(self_refs, comp)
+            cycles = []
+            for i from 0 <= i < num_components:
+                if counts[i] > 1 or _bit_is_set(self_refs, i):
+                    cycles.append((i, counts[i], sizes[i]))
+            # Group the members of each component, for component_members
+            offsets = <Py_ssize_t *>PyMem_Malloc(
+                sizeof(Py_ssize_t) * (num_components + 1))
+            members = <int32_t *>PyMem_Malloc(sizeof(int32_t) * (num_objs + 1))
+            if offsets == NULL or members == NULL:
+                raise MemoryError('Failed to allocate the members of %d'
+                                  ' components' % (num_components,))
+            offsets[0] = 0
+            for i from 0 <= i < num_components:
+                offsets[i + 1] = offsets[i] + counts[i]
+                # Reused as the next free slot of each component
+                counts[i] = offsets[i]
+            for i from 0 <= i < num_objs:
+                comp = index.components[i]
+                members[counts[comp]] = <int32_t>i
+                counts[comp] += 1
+            index.num_components = num_components
+            index.component_offsets = offsets
+            index.component_members = members
+            offsets = NULL
+            members = NULL
+        finally:
+            PyMem_Free(counts)
+            PyMem_Free(sizes)
+            PyMem_Free(self_refs)
+            PyMem_Free(offsets)
+            PyMem_Free(members)
+        return cycles
+
+    def path_to_root(self, at, roots=None, k=1, excluding=None,
+                     root_types=('module', 'frame')):
+        """Find the shortest chains of references that keep an object alive.
+
+        :param at: The address of the object (or the object itself).
+        :param roots: The addresses where a chain may start. By default any
+            object that nothing refers to, or whose type is in root_types.
+        :param k: The number of chains to find, each one from a different root.
+            The closest roots are used first.
+        :param excluding: Addresses that a chain may not go through.
+        :return: A list of chains (shortest first), each one a list of
+            addresses starting at a root and ending with at.
+        """
+        cdef _ObjIndex *index
+        cdef _MemObject **slot
+        cdef unsigned char *excluded
+        cdef unsigned char *root_bits
+        cdef int32_t target
+
+        index = self._get_index()
+        _ensure_parent_index(index)
+        target = self.index_of(at)
+        excluded = NULL
+        root_bits = NULL
+        try:
+            if excluding:
+                excluded = _new_bitset(index.num_objs)
+                for address in excluding:
+                    slot = self._lookup(address)
+                    if slot[0] != NULL and slot[0] != _dummy:
+                        _set_bit(excluded, slot[0].index)
+            root_indices = None
+            if roots is not None:
+                root_indices = []
+                for address in roots:
+                    root_indices.append(self.index_of(address))
+            if root_indices is not None and k == 1:
+                path = _bidirectional_path(index, target, root_indices,
+                                           excluded)
+                if path is None:
+                    paths = []
+                else:
+                    paths = [path]
+            else:
+                if root_indices is not None:
+                    root_bits = _new_bitset(index.num_objs)
+                    for root in root_indices:
+                        _set_bit(root_bits, root)
+                paths = _backward_paths(index, target, root_bits,
+                                        frozenset(root_types), excluded, k)
+        finally:
+            PyMem_Free(excluded)
+            PyMem_Free(root_bits)
+        return [[<object>index.objs[i].address for i in path]
+                for path in paths]
+
+    def component_members(self, component_id):
+        """The addresses of the objects in a strongly connected component."""
+        cdef _ObjIndex *index
+        cdef long comp
+        cdef Py_ssize_t pos, end
+
+        index = self._index
+        if index == NULL or index.component_offsets == NULL:
+            raise ValueError('strongly_connected_components() must be called'
+                             ' first')
+        comp = component_id
+        if comp < 0 or comp >= index.num_components:
+            raise KeyError('component %s not present' % (component_id,))
+        members = []
+        end = index.component_offsets[comp + 1]
+        for pos from index.component_offsets[comp] <= pos < end:
+            members.append(
+                <object>index.objs[index.component_members[pos]].address)
+        return members
+
     cdef _MemObject** _lookup(self, address) except NULL:
         cdef long the_hash
         cdef size_t i, n_lookup
@@ -789,6 +3084,8 @@ cdef class MemObjectCollection:
         slot = self._lookup(address)
         if slot[0] == NULL or slot[0] == _dummy:
             raise KeyError('address %s not present' % (at,))
+        self._drop_index()
+        slot[0].index = -1
         if slot[0].proxy != NULL:
             # Have the proxy take over the memory lifetime. At the same time,
             # we break the reference cycle, so that the proxy will get cleaned
@@ -894,11 +3191,14 @@ cdef class MemObjectCollection:
         #       should be using PyObj_Malloc instead...
         new_entry = _new_mem_object(address, type_str, size, children,
                                     value, name, parent_list, total_size)
+        self._drop_index()
 
         if slot[0] == NULL:
             self._filled += 1
         self._active += 1
         slot[0] = new_entry
+        if self._type_index != NULL:
+            self._type_index_add(new_entry)
         if self._filled * 3 > (self._table_mask + 1) * 2:
             # We need to grow
             self._resize(self._active * 2)
@@ -908,6 +3208,9 @@ cdef class MemObjectCollection:
     def __dealloc__(self):
         cdef long i
 
+        self._drop_index()
+        Py_XDECREF(self._type_index)
+        self._type_index = NULL
         for i from 0 <= i < self._table_mask:
             self._clear_slot(self._table + i)
         PyMem_Free(self._table)
@@ -975,6 +3278,13 @@ cdef class MemObjectCollection:
         """Return an iterable of values stored in this map."""
         return _MOCValueIterator(self)
 
+    def cursor(self):
+        """Return a cursor for walking every object without proxies.
+
+        See _MemObjectCursor.
+        """
+        return _MemObjectCursor(self)
+
     def values(self):
         # This returns a list, but that is 'close enough' for what we need
         cdef long i
@@ -1029,6 +3339,164 @@ cdef class _MOCValueIterator:
         return self.collection._proxy_for(<object>cur.address, cur)
 
 
+cdef class _MemObjectCursor:
+    """A flyweight view of the objects in a MemObjectCollection.
+
+    The cursor points at one object at a time, and reads its fields straight
+    from the table, so walking the whole collection doesn't create (or look
+    up) a _MemObjectProxy for every object. Iterating the cursor yields the
+    cursor itself, moved to the next object:
+
+        for cursor in objs.cursor():
+            if cursor.type_str == 'dict' and len(cursor) > 100:
+                big.append(cursor.proxy())
+
+    Anything that needs to outlive the current step (or to change the object)
+    should use proxy(). Objects can be changed while the cursor is walking,
+    but not added or removed.
+    """
+
+    cdef MemObjectCollection collection
+    cdef int initial_active
+    cdef _MemObject **table
+    cdef long table_pos
+    cdef _MemObject *cur
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.initial_active = self.collection._active
+        self.table = self.collection._table
+        self.table_pos = -1
+        self.cur = NULL
+
+    cdef int _check_unchanged(self) except -1:
+        if (self.collection._active != self.initial_active
+            or self.collection._table != self.table):
+            raise RuntimeError('MemObjectCollection changed size during'
+                               ' iteration')
+        return 0
+
+    cdef _MemObject *_current(self) except NULL:
+        self._check_unchanged()
+        if self.cur == NULL:
+            raise ValueError('The cursor is not on an object.')
+        return self.cur
+
+    def advance(self):
+        """Move to the next object.
+
+        :return: False when there are no more objects.
+        """
+        cdef _MemObject *cur
+
+        self._check_unchanged()
+        self.table_pos += 1
+        while self.table_pos <= self.collection._table_mask:
+            cur = self.table[self.table_pos]
+            if cur != NULL and cur != _dummy:
+                self.cur = cur
+                return True
+            self.table_pos += 1
+        self.cur = NULL
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.advance():
+            raise StopIteration()
+        return self
+
+    property address:
+        """The address of the current object."""
+        def __get__(self):
+            return <object>(self._current().address)
+
+    property type_str:
+        """The type of the current object.
+
+        Type strings are interned, so they can be compared by identity.
+        """
+        def __get__(self):
+            return <object>(self._current().type_str)
+
+    property size:
+        """The size of the current object."""
+        def __get__(self):
+            return self._current().size
+
+    property total_size:
+        """The total_size of the current object."""
+        def __get__(self):
+            return self._current().total_size
+
+    property value:
+        """The value (or name) of the current object."""
+        def __get__(self):
+            cdef _MemObject *cur
+            cur = self._current()
+            if cur.value == NULL:
+                return None
+            return <object>cur.value
+
+    def __len__(self):
+        cdef _MemObject *cur
+        cur = self._current()
+        if cur.child_list == NULL:
+            return 0
+        return cur.child_list.size
+
+    property num_parents:
+        """The number of parents of the current object."""
+        def __get__(self):
+            cdef _MemObject *cur
+            cur = self._current()
+            if cur.parent_list == NULL:
+                return 0
+            return cur.parent_list.size
+
+    def child(self, long offset):
+        """The address of a child of the current object."""
+        cdef _MemObject *cur
+        cur = self._current()
+        if (cur.child_list == NULL or offset < 0
+            or offset >= cur.child_list.size):
+            raise IndexError('%s out of range' % (offset,))
+        return <object>(cur.child_list.refs[offset])
+
+    def parent(self, long offset):
+        """The address of a parent of the current object."""
+        cdef _MemObject *cur
+        cur = self._current()
+        if (cur.parent_list == NULL or offset < 0
+            or offset >= cur.parent_list.size):
+            raise IndexError('%s out of range' % (offset,))
+        return <object>(cur.parent_list.refs[offset])
+
+    property children:
+        """The addresses referenced by the current object."""
+        def __get__(self):
+            return _ref_list_to_list(self._current().child_list)
+
+    property parents:
+        """The addresses referencing the current object."""
+        def __get__(self):
+            return _ref_list_to_list(self._current().parent_list)
+
+    def proxy(self):
+        """Get the _MemObjectProxy for the current object."""
+        cdef _MemObject *cur
+        cur = self._current()
+        return self.collection._proxy_for(<object>cur.address, cur)
+
+    def __repr__(self):
+        if self.cur == NULL:
+            return '%s(no object)' % (self.__class__.__name__,)
+        return '%s(%s %d %dB)' % (self.__class__.__name__, self.type_str,
+                                  self.address, self.size)
+
+
 cdef class _MOPReferencedIterator:
     """Iterate over all the children referenced from this object."""
 
@@ -1036,13 +3504,41 @@ cdef class _MOPReferencedIterator:
     cdef object seen_addresses
     cdef list pending_addresses
     cdef int pending_offset
+    # When the collection has a dense index, we walk it with a bitset of seen
+    # objects and a stack of pending indices instead of the above.
+    cdef _ObjIndex *_index
+    cdef unsigned char *_seen
+    cdef int32_t *_pending
+    cdef Py_ssize_t _pending_size
+    cdef Py_ssize_t _pending_offset
 
     def __init__(self, proxy, excluding=None):
         cdef _MemObjectProxy c_proxy
+        cdef _MemObject **slot
 
         from meliae import _intset
         c_proxy = proxy
         self.collection = c_proxy.collection
+        if self.collection is not None and self.collection._index != NULL:
+            self._index = self.collection._index
+            self._seen = _new_bitset(self._index.num_objs)
+            if excluding is not None:
+                for address in excluding:
+                    slot = self.collection._lookup(address)
+                    if slot[0] != NULL and slot[0] != _dummy:
+                        _set_bit(self._seen, slot[0].index)
+            self._pending_size = 1024
+            self._pending = <int32_t *>PyMem_Malloc(
+                sizeof(int32_t) * self._pending_size)
+            if self._pending == NULL:
+                raise MemoryError('Failed to allocate %d bytes'
+                                  % (sizeof(int32_t) * self._pending_size,))
+            self._pending_offset = -1
+            slot = self.collection._lookup(c_proxy.address)
+            if slot[0] != NULL and slot[0] != _dummy:
+                self._pending_offset = 0
+                self._pending[0] = slot[0].index
+            return
         if excluding is not None:
             self.seen_addresses = _intset.IDSet(excluding)
         else:
@@ -1050,10 +3546,66 @@ cdef class _MOPReferencedIterator:
         self.pending_addresses = [c_proxy.address]
         self.pending_offset = 0
 
+    def __dealloc__(self):
+        if self._seen != NULL:
+            PyMem_Free(self._seen)
+            self._seen = NULL
+        if self._pending != NULL:
+            PyMem_Free(self._pending)
+            self._pending = NULL
+
     def __iter__(self):
         return self
 
+    cdef int _push_index(self, int32_t idx) except -1:
+        cdef Py_ssize_t new_size
+        cdef int32_t *new_pending
+
+        self._pending_offset += 1
+        if self._pending_offset >= self._pending_size:
+            new_size = self._pending_size * 2
+            new_pending = <int32_t *>PyMem_Realloc(self._pending,
+                                                   sizeof(int32_t) * new_size)
+            if new_pending == NULL:
+                raise MemoryError('Failed to allocate %d bytes'
+                                  % (sizeof(int32_t) * new_size,))
+            self._pending = new_pending
+            self._pending_size = new_size
+        self._pending[self._pending_offset] = idx
+        return 0
+
+    cdef long _next_index(self) except -2:
+        """Return the index of the next object, or -1 when we are done."""
+        cdef int32_t idx, child
+        cdef Py_ssize_t pos, end
+
+        if self.collection._index != self._index:
+            raise RuntimeError('MemObjectCollection changed during iteration')
+        while self._pending_offset >= 0:
+            idx = self._pending[self._pending_offset]
+            self._pending_offset -= 1
+            if _bit_is_set(self._seen, idx):
+                continue
+            _set_bit(self._seen, idx)
+            # Queue up the children of this object
+            end = self._index.child_offsets[idx + 1]
+            for pos from self._index.child_offsets[idx] <= pos < end:
+                child = self._index.child_indices[pos]
+                if not _bit_is_set(self._seen, child):
+                    self._push_index(child)
+            return idx
+        return -1
+
     def __next__(self):
+        cdef long idx
+        cdef _MemObject *cur
+
+        if self._index != NULL:
+            idx = self._next_index()
+            if idx < 0:
+                raise StopIteration()
+            cur = self._index.objs[idx]
+            return self.collection._proxy_for(<object>cur.address, cur)
         while self.pending_offset >= 0:
             next_address = self.pending_addresses[self.pending_offset]
             self.pending_offset -= 1
@@ -1175,5 +3727,7 @@ cdef int MemObjectCollection_traverse(MemObjectCollection self,
             ret = _MemObject_traverse(cur, visit, arg)
             if ret:
                 break
+    if ret == 0 and self._type_index != NULL:
+        ret = visit(self._type_index, arg)
     return ret
 (<PyTypeObject*>MemObjectCollection).tp_traverse = <traverseproc>MemObjectCollection_traverse
@@ -0,0 +1,348 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare two dump files, to see where memory is growing.
+
+Neither dump is loaded into an ObjManager. Only the address, type and size of
+each object are parsed, and the dumps are streamed. If both dumps are sorted by
+address (see meliae.sortdump), they are merged in a single pass. Otherwise the
+addresses of each side are kept in IDSets, and the old dump is read twice.
+
+Objects are matched by address and type, so an address that was reused by
+an object of another type counts as a freed object and a new one.
+"""
+
+import re
+import sys
+
+import six
+
+from meliae import (
+    files,
+    _intset,
+    )
+
+
+if sys.version_info[0] >= 3:
+    intern = sys.intern
+
+
+_header_re = re.compile(
+    br'\{"address": (?P<address>\d+)'
+    br', "type": "(?P<type>[^"]*)"'
+    br', "size": (?P<size>\d+)'
+    br'(, "name": "[^"]*")?'
+    br'(, "len": (?P<len>\d+))?'
+    )
+
+
+def iter_headers(source, with_length=False):
+    """Iterate the (address, type_str, size) of every object in source.
+
+    Lines that don't describe an object (like the '[' and ']' of a json list)
+    are skipped.
+
+    :param source: An iterable of dump lines.
+    :param with_length: If True, iterate (address, type_str, size, length)
+        instead, where length is None for objects without a len.
+    """
+    type_cache = {}
+    for line in source:
+        m = _header_re.match(line)
+        if m is None:
+            continue
+        address, type_str, size, length = m.group('address', 'type', 'size',
+                                                  'len')
+        try:
+            type_str = type_cache[type_str]
+        except KeyError:
+            raw = type_str
+            if not isinstance(type_str, str):
+                type_str = type_str.decode('UTF-8')
+            type_str = intern(type_str)
+            type_cache[raw] = type_str
+        if with_length:
+            if length is not None:
+                length = int(length)
+            yield int(address), type_str, int(size), length
+        else:
+            yield int(address), type_str, int(size)
+
+
+class _TypeDelta(object):
+    """How the objects of a given type changed between two dumps."""
+
+    def __init__(self, type_str):
+        self.type_str = type_str
+        self.old_count = 0
+        self.old_size = 0
+        self.new_count = 0
+        self.new_size = 0
+
+    @property
+    def count_delta(self):
+        return self.new_count - self.old_count
+
+    @property
+    def size_delta(self):
+        return self.new_size - self.old_size
+
+    def __repr__(self):
+        return '%s: %+d objects, %+d bytes (%d => %d bytes)' % (
+            self.type_str, self.count_delta, self.size_delta, self.old_size,
+            self.new_size)
+
+
+class DumpDiff(object):
+    """The differences between two dumps.
+
+    :ivar type_deltas: A dict of type_str => _TypeDelta
+    :ivar new_objects: (address, type_str, size) of the objects only in the
+        new dump (at most max_listed of them).
+    :ivar freed_objects: (address, type_str, size) of the objects only in the
+        old dump (at most max_listed of them).
+    :ivar num_new: The total number of new objects.
+    :ivar num_freed: The total number of freed objects.
+    """
+
+    def __init__(self, max_listed=None):
+        self.type_deltas = {}
+        self.new_objects = []
+        self.freed_objects = []
+        self.num_new = 0
+        self.num_freed = 0
+        self._max_listed = max_listed
+
+    def _delta(self, type_str):
+        try:
+            return self.type_deltas[type_str]
+        except KeyError:
+            delta = _TypeDelta(type_str)
+            self.type_deltas[type_str] = delta
+            return delta
+
+    def _add_old(self, type_str, size):
+        delta = self._delta(type_str)
+        delta.old_count += 1
+        delta.old_size += size
+
+    def _add_new(self, type_str, size):
+        delta = self._delta(type_str)
+        delta.new_count += 1
+        delta.new_size += size
+
+    def _new_object(self, header):
+        self.num_new += 1
+        if (self._max_listed is None
+            or len(self.new_objects) < self._max_listed):
+            self.new_objects.append(header)
+
+    def _freed_object(self, header):
+        self.num_freed += 1
+        if (self._max_listed is None
+            or len(self.freed_objects) < self._max_listed):
+            self.freed_objects.append(header)
+
+    def by_size(self):
+        """The type deltas, with the largest growth in bytes first."""
+        return sorted(self.type_deltas.values(),
+                      key=lambda x: (x.size_delta, x.count_delta),
+                      reverse=True)
+
+    def by_count(self):
+        """The type deltas, with the largest growth in objects first."""
+        return sorted(self.type_deltas.values(),
+                      key=lambda x: (x.count_delta, x.size_delta),
+                      reverse=True)
+
+    def __repr__(self):
+        old_size = sum(d.old_size for d in self.type_deltas.values())
+        new_size = sum(d.new_size for d in self.type_deltas.values())
+        out = [
+            '%d new objects, %d freed objects, %+d bytes (%d => %d)'
+            % (self.num_new, self.num_freed, new_size - old_size, old_size,
+               new_size),
+            ' Index     Count        Size Kind',
+            ]
+        deltas = [d for d in self.by_size()
+                  if d.count_delta != 0 or d.size_delta != 0]
+        for i, delta in enumerate(deltas[:20]):
+            out.append('%6d%+10d%+12d %s'
+                       % (i, delta.count_delta, delta.size_delta,
+                          delta.type_str))
+        return '\n'.join(out)
+
+
+def _diff_sorted(old_source, new_source, result):
+    """Merge two dumps that are both sorted by address."""
+    def checked(headers, name):
+        last = -1
+        for header in headers:
+            if header[0] < last:
+                raise ValueError('%s dump is not sorted by address (%d after'
+                                 ' %d)' % (name, header[0], last))
+            if header[0] != last:
+                # dump_gc_objects can repeat an object, but in a sorted dump
+                # the duplicates are adjacent
+                yield header
+            last = header[0]
+    old_iter = checked(iter_headers(old_source), 'old')
+    new_iter = checked(iter_headers(new_source), 'new')
+    old = next(old_iter, None)
+    new = next(new_iter, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            result._add_old(old[1], old[2])
+            result._freed_object(old)
+            old = next(old_iter, None)
+        elif old is None or new[0] < old[0]:
+            result._add_new(new[1], new[2])
+            result._new_object(new)
+            new = next(new_iter, None)
+        else:
+            result._add_old(old[1], old[2])
+            result._add_new(new[1], new[2])
+            if old[1] != new[1]:
+                # The address was reused by an object of another type
+                result._freed_object(old)
+                result._new_object(new)
+            old = next(old_iter, None)
+            new = next(new_iter, None)
+
+
+def _diff_unsorted(old_source, new_source, result):
+    """Compare two dumps in any order, using IDSets of the addresses.
+
+    The addresses are kept in one IDSet per type, so an address that was
+    reused by an object of another type is not matched. old_source is iterated
+    twice, so it can't be a one-shot iterator.
+    """
+    old_addresses = {}
+    for address, type_str, size in iter_headers(old_source):
+        addresses = old_addresses.get(type_str)
+        if addresses is None:
+            addresses = old_addresses[type_str] = _intset.IDSet()
+        elif address in addresses:
+            continue
+        addresses.add(address)
+        result._add_old(type_str, size)
+    new_addresses = {}
+    for header in iter_headers(new_source):
+        address, type_str, size = header
+        addresses = new_addresses.get(type_str)
+        if addresses is None:
+            addresses = new_addresses[type_str] = _intset.IDSet()
+        elif address in addresses:
+            continue
+        addresses.add(address)
+        result._add_new(type_str, size)
+        addresses = old_addresses.get(type_str)
+        if addresses is None or address not in addresses:
+            result._new_object(header)
+    del old_addresses
+    seen = _intset.IDSet()
+    for header in iter_headers(old_source):
+        address, type_str, _ = header
+        if address in seen:
+            continue
+        seen.add(address)
+        addresses = new_addresses.get(type_str)
+        if addresses is None or address not in addresses:
+            result._freed_object(header)
+
+
+def diff_dumps(old_source, new_source, assume_sorted=False, max_listed=None):
+    """Compare two dumps.
+
+    :param old_source: The earlier dump, a filename or a list of lines. Unless
+        assume_sorted, it is read twice, so TypeError is raised for a one-shot
+        iterator (such as an open file).
+    :param new_source: The later dump, a filename or an iterable of lines.
+    :param assume_sorted: If True, both dumps are sorted by address, so they
+        can be compared in a single streaming pass. ValueError is raised if
+        they turn out not to be.
+    :param max_listed: Only keep this many of the new and freed objects
+        (they are all still counted).
+    :return: A DumpDiff
+    """
+    result = DumpDiff(max_listed=max_listed)
+    cleanups = []
+    try:
+        if isinstance(new_source, six.string_types):
+            new_source, cleanup = files.open_file(new_source)
+            if cleanup is not None:
+                cleanups.append(cleanup)
+        if assume_sorted:
+            if isinstance(old_source, six.string_types):
+                old_source, cleanup = files.open_file(old_source)
+                if cleanup is not None:
+                    cleanups.append(cleanup)
+            _diff_sorted(old_source, new_source, result)
+        else:
+            if isinstance(old_source, six.string_types):
+                old_source = _Reopenable(old_source, cleanups)
+            elif iter(old_source) is old_source:
+                raise TypeError('old_source is read twice, so it must be a'
+                                ' filename or a list of lines, not %s'
+                                % (type(old_source).__name__,))
+            _diff_unsorted(old_source, new_source, result)
+    finally:
+        for cleanup in cleanups:
+            cleanup()
+    return result
+
+
+class _Reopenable(object):
+    """Open filename again every time it is iterated."""
+
+    def __init__(self, filename, cleanups):
+        self.filename = filename
+        self.cleanups = cleanups
+
+    def __iter__(self):
+        source, cleanup = files.open_file(self.filename)
+        if cleanup is not None:
+            self.cleanups.append(cleanup)
+        return iter(source)
+
+
+def main(args):
+    import optparse
+    p = optparse.OptionParser('%prog [options] OLD_DUMP NEW_DUMP')
+    p.add_option('--sorted', action='store_true', default=False,
+                 help='Both dumps are sorted by address (by'
+                      ' meliae.sortdump), compare them in a single pass.')
+    p.add_option('--limit', type='int', default=20,
+                 help='How many new and freed objects to list (default 20).')
+    opts, args = p.parse_args(args)
+    if len(args) != 2:
+        sys.stderr.write('We need exactly 2 dump files, not %d\n'
+                         % (len(args),))
+        return -1
+    result = diff_dumps(args[0], args[1], assume_sorted=opts.sorted,
+                        max_listed=opts.limit)
+    out = sys.stdout
+    out.write('%r\n' % (result,))
+    for title, objs in (('New', result.new_objects),
+                        ('Freed', result.freed_objects)):
+        if not objs:
+            continue
+        out.write('%s objects:\n' % (title,))
+        for address, type_str, size in objs:
+            out.write('%20d %8d %s\n' % (address, size, type_str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -12,101 +12,213 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Work with files on disk."""
+"""Work with files on disk.
 
-import errno
-import gzip
+Compressed dumps are recognized by their magic bytes, and decompressed in
+process by a reader thread, which hands large blocks to the parser through a
+bounded queue. gzip, bz2 and xz are always supported (xz needs python 3),
+zstd and lz4 when the zstandard and lz4 modules are installed.
+"""
+
+import bz2
 try:
-    import multiprocessing
+    import lzma
 except ImportError:
-    multiprocessing = None
-import subprocess
+    lzma = None
 import sys
+import threading
+import zlib
+
+from six.moves import queue
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+# How much compressed data to read at a time
+_READ_SIZE = 1024 * 1024
+
+# How many decompressed blocks can be waiting for the parser
+_MAX_PENDING = 4
+
+
+def _gzip_decompressor():
+    # 16 + MAX_WBITS tells zlib to expect a gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _zstd_decompressor():
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+# (magic bytes, format name, decompressor factory or None if the module for
+# it isn't available)
+_FORMATS = [
+    (b'\x1f\x8b', 'gzip', _gzip_decompressor),
+    (b'BZh', 'bz2', bz2.BZ2Decompressor),
+    (b'\xfd7zXZ\x00', 'xz', lzma and lzma.LZMADecompressor),
+    (b'\x28\xb5\x2f\xfd', 'zstd', zstandard and _zstd_decompressor),
+    (b'\x04\x22\x4d\x18', 'lz4', lz4_frame and lz4_frame.LZ4FrameDecompressor),
+    ]
+
+
+def detect_format(header):
+    """Find the compression format of a file from its first bytes.
+
+    :return: (name, decompressor factory), (None, None) for a plain file.
+        The factory is None if the module for that format isn't installed.
+    """
+    for magic, name, factory in _FORMATS:
+        if header.startswith(magic):
+            return name, factory
+    return None, None
 
 
 def open_file(filename):
-    """Open a file which might be a regular file or a gzip.
-    
-    :return: An iterator of lines, and a cleanup function.
+    """Open a file which might be a regular file or compressed.
+
+    :return: An iterator of lines, and a cleanup function. A plain file is
+        returned as is (and the cleanup is None), otherwise a
+        _DecompressedStream, which also has a read() method.
     """
     source = open(filename, 'rb')
-    gzip_source = gzip.GzipFile(mode='rb', fileobj=source)
     try:
-        line = gzip_source.readline()
-    except KeyboardInterrupt:
-        raise
-    except:
-        # probably not a gzip file
+        name, factory = detect_format(source.read(6))
         source.seek(0)
+    except:
+        source.close()
+        raise
+    if name is None:
         return source, None
-    else:
-        # We don't need these anymore, so close them out in case the rest of
-        # the code raises an exception.
-        gzip_source.close()
+    if factory is None:
         source.close()
-        # a gzip file
-        # preference - a gzip subprocess
-        if sys.platform == 'win32':
-            close_fds = False # not supported
-        else:
-            close_fds = True
+        raise ValueError('%s is compressed with %s, which needs a module'
+                         ' that is not installed' % (filename, name))
+    stream = _DecompressedStream(source, factory)
+    return stream, stream.close
+
+
+def _reached_eof(decompressor):
+    """Has decompressor seen the end-of-stream marker?
+
+    :return: True or False, or None if it can't tell. Python 2.7's zlib and
+        bz2 decompressors don't have .eof, though anything after the end of
+        the stream does end up in .unused_data.
+    """
+    eof = getattr(decompressor, 'eof', None)
+    if eof is None and decompressor.unused_data:
+        return True
+    return eof
+
+
+class _DecompressedStream(object):
+    """The decompressed content of a file, produced by a reader thread."""
+
+    def __init__(self, source, factory):
+        self._source = source
+        self._factory = factory
+        self._queue = queue.Queue(_MAX_PENDING)
+        self._stop = threading.Event()
+        self._buffer = b''
+        self._done = False
+        self._thread = threading.Thread(target=self._decompress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def _decompress(self):
         try:
-            process = subprocess.Popen(['gzip', '-d', '-c', filename],
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, close_fds=close_fds)
-        except OSError as e:
-            if e.errno == errno.ENOENT:
-                # failing that, use another python process
-                return _open_mprocess(filename)
-        # make reading from stdin, or writting errors cause immediate aborts
-        process.stdin.close()
-        process.stderr.close()
-        terminate = getattr(process, 'terminate', None)
-        # terminate is a py2.6 thing
-        if terminate is not None:
-            def terminate_or_pass():
-                # It seems that on windows, sometimes terminate() can raise 
-                # WindowsError: [Error 5] Access is denied
-                # My guess is that the process has actually completed, and is
-                # no longer running.
-                try:
-                    return terminate()
-                except OSError as e:
-                    sys.stderr.write('Ignoring failure to terminate process:'
-                                     ' %s\n' % (e,))
-                # We *could* check if process.poll() returns that the
-                # process has already exited, etc.
-            return process.stdout, terminate_or_pass
-        else:
-            # We would like to use process.wait() but that can cause a deadlock
-            # if the child is still writing.
-            # The other alternative is process.communicate, but we closed
-            # stderr, and communicate wants to read from it. (We get:
-            #  ValueError: I/O operation on closed file
-            # if we try it here. Also, for large files, this may be many GB
-            # worth of data.
-            # So for now, live with the deadlock...
-            return process.stdout, process.wait
-
-
-def _stream_file(filename, child):
-    gzip_source = gzip.GzipFile(filename, 'rb')
-    for line in gzip_source:
-        child.send(line)
-    child.send(None)
-
-
-def _open_mprocess(filename):
-    if multiprocessing is None:
-        # can't multiprocess, use inprocess gzip.
-        return gzip.GzipFile(filename, mode='rb'), None
-    parent, child = multiprocessing.Pipe(False)
-    process = multiprocessing.Process(target=_stream_file, args=(filename, child))
-    process.start()
-    def iter_pipe():
+            decompressor = self._factory()
+            while not self._stop.is_set():
+                data = self._source.read(_READ_SIZE)
+                if not data:
+                    eof = _reached_eof(decompressor)
+                    if eof is None:
+                        # We can't check for truncation, but get whatever
+                        # is left
+                        flush = getattr(decompressor, 'flush', None)
+                        if flush is not None:
+                            block = flush()
+                            if block and not self._put(block):
+                                return
+                    elif not eof:
+                        raise EOFError('Compressed file ended before the'
+                                       ' end-of-stream marker was reached')
+                    break
+                while data:
+                    block = decompressor.decompress(data)
+                    if block and not self._put(block):
+                        return
+                    data = b''
+                    if _reached_eof(decompressor):
+                        # Concatenated streams (such as several gzip members)
+                        data = decompressor.unused_data
+                        if data:
+                            decompressor = self._factory()
+            self._put(None)
+        except Exception:
+            self._put(sys.exc_info()[1])
+
+    def _next_block(self):
+        """The next decompressed block, or b'' at the end."""
+        if self._done:
+            return b''
+        block = self._queue.get()
+        if block is None:
+            self._done = True
+            return b''
+        if isinstance(block, Exception):
+            self._done = True
+            raise block
+        return block
+
+    def read(self, size=-1):
+        """Read up to size bytes (everything that is left if size < 0)."""
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            block = self._next_block()
+            if not block:
+                break
+            chunks.append(block)
+            length += len(block)
+        data = b''.join(chunks)
+        if size < 0:
+            self._buffer = b''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def __iter__(self):
+        remainder = self._buffer
+        self._buffer = b''
         while True:
-            line = parent.recv()
-            if line is None:
+            block = self._next_block()
+            if not block:
                 break
-            yield line
-    return iter_pipe(), process.join
+            lines = (remainder + block).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if remainder:
+            yield remainder
+
+    def close(self):
+        """Stop the reader thread, and close the file."""
+        self._stop.set()
+        self._thread.join()
+        self._source.close()
+        self._done = True
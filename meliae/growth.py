@@ -0,0 +1,258 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Track how memory grows across a series of dumps.
+
+Each dump is streamed once, and reduced to the count and size of every type,
+so only a few numbers per type and snapshot are kept. Large containers are
+followed from one snapshot to the next by address, and the ones that keep
+growing are reported, since those are usually where a slow leak ends up.
+"""
+
+import array
+import sys
+
+import six
+
+from meliae import (
+    diff,
+    files,
+    _intset,
+    )
+
+
+def _slope(xs, ys):
+    """The least squares slope of ys against xs."""
+    n = len(xs)
+    if n < 2:
+        return 0.0
+    mean_x = sum(xs) / float(n)
+    mean_y = sum(ys) / float(n)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+
+class _TypeSeries(object):
+    """The count and size of one type in every snapshot."""
+
+    def __init__(self, type_str, num_snapshots):
+        self.type_str = type_str
+        # The type may not have existed in the earlier snapshots
+        self.counts = array.array('q', [0] * num_snapshots)
+        self.sizes = array.array('q', [0] * num_snapshots)
+
+    def is_monotonic(self):
+        """Did the size of this type never shrink?"""
+        return all(a <= b for a, b in zip(self.sizes, self.sizes[1:]))
+
+    def __repr__(self):
+        return '%s(%s, %d snapshots)' % (self.__class__.__name__,
+                                         self.type_str, len(self.sizes))
+
+
+class _Container(object):
+    """A container that has been seen in consecutive snapshots."""
+
+    __slots__ = ('address', 'type_str', 'first_snapshot', 'first_length',
+                 'length', 'num_snapshots', 'grew')
+
+    def __init__(self, address, type_str, snapshot, length):
+        self.address = address
+        self.type_str = type_str
+        self.first_snapshot = snapshot
+        self.first_length = length
+        self.length = length
+        self.num_snapshots = 1
+        self.grew = False
+
+    def __repr__(self):
+        return '%s @ %d: len %d => %d over %d snapshots' % (
+            self.type_str, self.address, self.first_length, self.length,
+            self.num_snapshots)
+
+
+class GrowthSeries(object):
+    """A per-type time series of count and bytes.
+
+    :ivar times: The time (or sequence number) of each snapshot.
+    :ivar types: A dict of type_str => _TypeSeries
+    """
+
+    def __init__(self, min_length=100):
+        """Create a new GrowthSeries.
+
+        :param min_length: Only follow containers that have at least this
+            many items. Following every container would mean remembering
+            most of a dump.
+        """
+        self.times = []
+        self.types = {}
+        self.min_length = min_length
+        # address => _Container, for the containers that have been in every
+        # snapshot since they appeared, and have never shrunk
+        self._containers = {}
+
+    def _type_series(self, type_str):
+        try:
+            return self.types[type_str]
+        except KeyError:
+            series = _TypeSeries(type_str, len(self.times))
+            self.types[type_str] = series
+            return series
+
+    def _start_snapshot(self, when):
+        if when is None:
+            when = len(self.times)
+        self.times.append(when)
+        for series in self.types.values():
+            series.counts.append(0)
+            series.sizes.append(0)
+
+    def add_histogram(self, histogram, when=None):
+        """Add a snapshot that only has the totals of each type.
+
+        Containers can't be followed through a histogram, so the ones being
+        followed are forgotten.
+
+        :param histogram: A dict of type_str => (count, total_size)
+        :param when: The time of the snapshot, by default its sequence number
+        """
+        self._start_snapshot(when)
+        for type_str, (count, size) in histogram.items():
+            series = self._type_series(type_str)
+            series.counts[-1] += count
+            series.sizes[-1] += size
+        self._containers = {}
+
+    def add_dump(self, source, when=None):
+        """Add a snapshot from a dump.
+
+        :param source: A filename, or an iterable of dump lines.
+        :param when: The time of the snapshot, by default its sequence number
+        """
+        cleanup = None
+        if isinstance(source, six.string_types):
+            source, cleanup = files.open_file(source)
+        try:
+            self._add_lines(source, when)
+        finally:
+            if cleanup is not None:
+                cleanup()
+
+    def _add_lines(self, source, when):
+        self._start_snapshot(when)
+        snapshot = len(self.times) - 1
+        seen = _intset.IDSet()
+        old_containers = self._containers
+        containers = {}
+        min_length = self.min_length
+        for address, type_str, size, length in diff.iter_headers(
+                source, with_length=True):
+            if address in seen:
+                # dump_gc_objects can repeat an object
+                continue
+            seen.add(address)
+            series = self._type_series(type_str)
+            series.counts[-1] += 1
+            series.sizes[-1] += size
+            if length is None or length < min_length:
+                continue
+            container = old_containers.get(address)
+            if (container is None or container.type_str != type_str
+                or length < container.length):
+                container = _Container(address, type_str, snapshot, length)
+            else:
+                if length > container.length:
+                    container.grew = True
+                container.length = length
+                container.num_snapshots += 1
+            containers[address] = container
+        self._containers = containers
+
+    def rank_growth(self, by='size', monotonic=False):
+        """Rank the types by how fast they grow.
+
+        :param by: 'size' to use the least squares slope of the bytes used by
+            each type (bytes per unit of time), 'count' for the number of
+            objects.
+        :param monotonic: Only include types whose size never went down.
+        :return: A list of (slope, _TypeSeries) for the types that grew,
+            fastest first.
+        """
+        ranked = []
+        for series in self.types.values():
+            if by == 'size':
+                values = series.sizes
+            else:
+                values = series.counts
+            slope = _slope(self.times, values)
+            if slope <= 0:
+                continue
+            if monotonic and not series.is_monotonic():
+                continue
+            ranked.append((slope, series))
+        ranked.sort(key=lambda x: (x[0], x[1].type_str), reverse=True)
+        return ranked
+
+    def growing_containers(self, min_snapshots=3):
+        """The containers that grew, and never shrank, while we watched.
+
+        :param min_snapshots: The container must be in at least this many of
+            the (most recent) snapshots.
+        :return: A list of _Container, the largest growth first.
+        """
+        found = [c for c in self._containers.values()
+                 if c.grew and c.num_snapshots >= min_snapshots]
+        found.sort(key=lambda c: (c.length - c.first_length, c.address),
+                   reverse=True)
+        return found
+
+    def __repr__(self):
+        out = ['%d snapshots, %d types' % (len(self.times), len(self.types)),
+               ' Index   Bytes/step    First     Last Kind']
+        for i, (slope, series) in enumerate(self.rank_growth()[:20]):
+            out.append('%6d%13.1f%9d%9d %s'
+                       % (i, slope, series.sizes[0], series.sizes[-1],
+                          series.type_str))
+        return '\n'.join(out)
+
+
+def main(args):
+    import optparse
+    p = optparse.OptionParser('%prog [options] DUMP DUMP [DUMP...]')
+    p.add_option('--min-length', type='int', default=100,
+                 help='Follow containers with at least this many items'
+                      ' (default 100).')
+    opts, args = p.parse_args(args)
+    if len(args) < 2:
+        sys.stderr.write('We need at least 2 dump files, not %d\n'
+                         % (len(args),))
+        return -1
+    series = GrowthSeries(min_length=opts.min_length)
+    for filename in args:
+        series.add_dump(filename)
+    out = sys.stdout
+    out.write('%r\n' % (series,))
+    containers = series.growing_containers(min_snapshots=min(3, len(args)))
+    if containers:
+        out.write('Growing containers:\n')
+        for container in containers[:20]:
+            out.write('%r\n' % (container,))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
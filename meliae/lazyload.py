@@ -0,0 +1,262 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Look at a few objects of a dump, without loading all of it.
+
+open_dump() makes a single pass over the dump, recording where each object
+starts, in two sorted arrays (addresses and byte offsets). The arrays can be
+saved next to the dump, so the next open doesn't need the pass at all. Objects
+are then parsed when they are asked for, and the most recently used ones are
+kept in a small cache.
+
+The dump must not be compressed, as we need to seek into it.
+"""
+
+import array
+import bisect
+import collections
+import mmap
+import os
+
+from meliae import (
+    files,
+    loader,
+    progress,
+    strip_duplicates,
+    _intset,
+    _loader,
+    )
+
+
+_INDEX_HEADER = 'meliae offsets 1 %d %d %d\n'
+
+
+def _index_filename(filename):
+    return filename + '.offsets'
+
+
+def _stat_key(st):
+    """What the saved index remembers about the dump, to know it is stale.
+
+    The mtime is in nanoseconds, so a dump rewritten within the same second
+    (at the same size) is still noticed.
+    """
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1000000000)
+    return st.st_size, mtime
+
+
+def _read_index(index_filename, st):
+    """Read a saved index, if it matches the dump.
+
+    :return: (addresses, offsets) or None
+    """
+    try:
+        f = open(index_filename, 'rb')
+    except EnvironmentError:
+        return None
+    try:
+        header = f.readline().decode('ASCII', 'replace').split()
+        if (len(header) != 6 or header[:3] != ['meliae', 'offsets', '1']
+            or (int(header[3]), int(header[4])) != _stat_key(st)):
+            return None
+        count = int(header[5])
+        addresses = array.array('Q')
+        offsets = array.array('Q')
+        try:
+            addresses.fromfile(f, count)
+            offsets.fromfile(f, count)
+        except EOFError:
+            return None
+        return addresses, offsets
+    finally:
+        f.close()
+
+
+def _write_index(index_filename, st, addresses, offsets):
+    """Save the index next to the dump.
+
+    The index is only a cache, if it can't be written we just build it again
+    next time.
+    """
+    tmp_filename = index_filename + '.tmp'
+    try:
+        f = open(tmp_filename, 'wb')
+        try:
+            size, mtime = _stat_key(st)
+            f.write((_INDEX_HEADER % (size, mtime, len(addresses))
+                    ).encode('ASCII'))
+            addresses.tofile(f)
+            offsets.tofile(f)
+        finally:
+            f.close()
+        os.rename(tmp_filename, index_filename)
+    except EnvironmentError:
+        try:
+            os.remove(tmp_filename)
+        except EnvironmentError:
+            pass
+
+
+def _build_index(infile, size, reporter):
+    """Find the address and offset of every object in infile.
+
+    :param reporter: A progress.ProgressReporter for the 'indexing' phase.
+    """
+    phase = reporter.start_phase('indexing', total_bytes=size or None)
+    addresses = array.array('Q')
+    offsets = array.array('Q')
+    pos = 0
+    for block in strip_duplicates.iter_blocks(infile):
+        _intset.index_lines(block, pos, addresses, offsets)
+        pos += len(block)
+        phase.update(items=len(addresses), bytes_read=pos)
+    _intset.sort_index(addresses, offsets)
+    phase.finish(items=len(addresses), bytes_read=pos)
+    return addresses, offsets
+
+
+def open_dump(filename, index_filename=None, save_index=True,
+              cache_size=10000, using_json=None, show_prog=False,
+              reporter=None):
+    """Open a dump for looking up objects on demand.
+
+    :param filename: The (uncompressed) dump file.
+    :param index_filename: Where the index of the dump is saved, by default
+        filename + '.offsets'. It is used if it matches the size and mtime of
+        the dump, and rebuilt otherwise.
+    :param save_index: If True, save a rebuilt index to index_filename.
+    :param cache_size: How many parsed objects to keep.
+    :param using_json: See loader.load()
+    :param show_prog: If True, display the progress of building the index.
+    :param reporter: A progress.ProgressReporter for the 'indexing' phase,
+        rather than following show_prog.
+    :return: A LazyObjManager
+    """
+    if index_filename is None:
+        index_filename = _index_filename(filename)
+    if using_json is None:
+        using_json = (loader.simplejson is not None)
+    infile = open(filename, 'rb')
+    try:
+        name = files.detect_format(infile.read(6))[0]
+        if name is not None:
+            raise ValueError('%s is compressed with %s, lazy loading needs'
+                             ' to seek' % (filename, name))
+        infile.seek(0)
+        st = os.fstat(infile.fileno())
+        index = _read_index(index_filename, st)
+        if index is None:
+            index = _build_index(infile, st.st_size,
+                                 progress.get_reporter(show_prog, reporter))
+            if save_index:
+                _write_index(index_filename, st, index[0], index[1])
+        addresses, offsets = index
+        if st.st_size == 0:
+            mapped = b''
+        else:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        # The map stays valid without the file
+        infile.close()
+    return LazyObjManager(mapped, addresses, offsets, cache_size=cache_size,
+                          using_json=using_json)
+
+
+class LazyObjManager(object):
+    """Look up the objects of a dump, parsing them on demand.
+
+    Objects are standalone _MemObjectProxy instances (see
+    _loader._MemObjectProxy_from_args). Their parents are not known, as that
+    would take a pass over all of the references.
+    """
+
+    def __init__(self, content, addresses, offsets, cache_size=10000,
+                 using_json=False):
+        """Create a new LazyObjManager.
+
+        :param content: The content of the dump, usually an mmap.
+        :param addresses: An array('Q') of the sorted addresses in the dump.
+        :param offsets: An array('Q') of where each object starts in content.
+        :param cache_size: How many parsed objects to keep, 0 to not keep
+            any.
+        :param using_json: See loader.load()
+        """
+        self._content = content
+        self.addresses = addresses
+        self._offsets = offsets
+        self.cache_size = cache_size
+        if using_json:
+            self._decoder = loader._from_json
+        else:
+            self._decoder = loader._from_line
+        self._cache = collections.OrderedDict()
+
+    def close(self):
+        self._cache.clear()
+        if isinstance(self._content, mmap.mmap):
+            self._content.close()
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def _find(self, address):
+        """The index of address in self.addresses, or -1."""
+        idx = bisect.bisect_left(self.addresses, address)
+        if idx < len(self.addresses) and self.addresses[idx] == address:
+            return idx
+        return -1
+
+    def __contains__(self, address):
+        return self._find(address) != -1
+
+    def __getitem__(self, address):
+        cache = self._cache
+        try:
+            obj = cache.pop(address)
+        except KeyError:
+            obj = self._parse(address)
+            if self.cache_size <= 0:
+                return obj
+            if len(cache) >= self.cache_size:
+                # Drop the least recently used
+                cache.popitem(last=False)
+        cache[address] = obj
+        return obj
+
+    def _parse(self, address):
+        idx = self._find(address)
+        if idx == -1:
+            raise KeyError('address %s not present' % (address,))
+        content = self._content
+        start = self._offsets[idx]
+        end = content.find(b'\n', start)
+        if end == -1:
+            end = len(content)
+        line = content[start:end]
+        if line.endswith(b','):
+            line = line[:-1]
+        return self._decoder(_loader._MemObjectProxy_from_args, line)
+
+    def refs_as_dict(self, obj):
+        """Expand the ref list considering it to be a 'dict' structure.
+
+        See _MemObjectProxy.refs_as_dict.
+        """
+        return loader._refs_as_dict(self, obj)
+
+    def refs_as_list(self, obj):
+        """Expand the ref list, considering it to be a list structure."""
+        return loader._refs_as_list(self, obj)
@@ -17,12 +17,10 @@
 Currently requires simplejson to parse.
 """
 
-import gc
 import math
 import os
 import re
 import sys
-import time
 
 try:
     import simplejson
@@ -31,7 +29,9 @@ except ImportError:
 import six
 
 from meliae import (
+    diff,
     files,
+    progress,
     _intset,
     _loader,
     warn,
@@ -41,10 +41,6 @@ from meliae import (
 if sys.version_info[0] >= 3:
     intern = sys.intern
 
-timer = time.time
-if sys.platform == 'win32':
-    timer = time.clock
-
 # This is the minimal regex that is guaranteed to match. In testing, it is
 # faster than simplejson without extensions, though slower than simplejson w/
 # extensions.
@@ -121,6 +117,55 @@ def _from_line(cls, line, temp_cache=None):
     return obj
 
 
+def _refs_as_dict(objs, obj):
+    """Expand the ref list of obj considering it to be a 'dict' structure.
+
+    This is _MemObjectProxy.refs_as_dict, for objects that aren't in a
+    MemObjectCollection.
+
+    :param objs: Anything that maps an address to its object.
+    """
+    as_dict = {}
+    children = obj.children
+    if len(children) % 2 == 1 and obj.type_str not in ('dict', 'module'):
+        # Instance dicts end with a 'type' reference
+        children = children[:-1]
+    for idx in range(0, len(children), 2):
+        key = objs[children[idx]]
+        val = objs[children[idx+1]]
+        if key.value is not None:
+            key = key.value
+        if val.type_str == 'bool':
+            val = (val.value == 'True')
+        elif val.type_str in ('int', 'long',
+                              'bytes', 'str', 'unicode',
+                              'float',
+                              ) and val.value is not None:
+            val = val.value
+        elif val.type_str == 'NoneType':
+            val = None
+        as_dict[key] = val
+    return as_dict
+
+
+def _refs_as_list(objs, obj):
+    """Expand the ref list of obj, considering it to be a list structure.
+
+    :param objs: Anything that maps an address to its object.
+    """
+    as_list = []
+    for addr in obj.children:
+        val = objs[addr]
+        if val.type_str == 'bool':
+            val = (val.value == 'True')
+        elif val.value is not None:
+            val = val.value
+        elif val.type_str == 'NoneType':
+            val = None
+        as_list.append(val)
+    return as_list
+
+
 class _TypeSummary(object):
     """Information about a given type."""
 
@@ -172,6 +217,26 @@ class _ObjSummary(object):
         self.total_count += 1
         self.total_size += memobj.size
 
+    def _add_totals(self, type_str, count, total_size, sq_sum, max_size,
+                    max_address):
+        """Add the totals of many objects of one type at once.
+
+        See MemObjectCollection.summarize_types.
+        """
+        try:
+            type_summary = self.type_summaries[type_str]
+        except KeyError:
+            type_summary = _TypeSummary(type_str)
+            self.type_summaries[type_str] = type_summary
+        type_summary.count += count
+        type_summary.total_size += total_size
+        type_summary.sq_sum += sq_sum
+        if max_size > type_summary.max_size:
+            type_summary.max_size = max_size
+            type_summary.max_address = max_address
+        self.total_count += count
+        self.total_size += total_size
+
     def __repr__(self):
         if self.summaries is None:
             self.by_size()
@@ -195,25 +260,91 @@ class _ObjSummary(object):
         return '\n'.join(out)
 
     def by_size(self):
-        summaries = sorted(self.type_summaries.itervalues(),
+        summaries = sorted(self.type_summaries.values(),
                            key=lambda x: (x.total_size, x.count),
                            reverse=True)
         self.summaries = summaries
 
     def by_count(self):
-        summaries = sorted(self.type_summaries.itervalues(),
+        summaries = sorted(self.type_summaries.values(),
                            key=lambda x: (x.count, x.total_size),
                            reverse=True)
         self.summaries = summaries
 
 
+class _RetainedSummary(object):
+    """Retained sizes aggregated by type, see ObjManager.summarize_retained.
+
+    :ivar type_summaries: (type_str, count, retained_size, max_retained,
+        max_address) tuples, largest retained_size first.
+    :ivar top_retainers: (retained_size, address, type_str) for the objects
+        that retain the most memory, largest first.
+    """
+
+    def __init__(self, type_summaries, top_retainers, total_size):
+        self.type_summaries = type_summaries
+        self.top_retainers = top_retainers
+        self.total_size = total_size
+
+    def __repr__(self):
+        total_size = self.total_size or 1
+        out = [
+            'Total %d types, Retained size = %.1fMiB (%d bytes)'
+            % (len(self.type_summaries), self.total_size / 1024. / 1024,
+               self.total_size),
+            ' Index   Count      Retained   %         Max Kind'
+            ]
+        for i in range(min(20, len(self.type_summaries))):
+            type_str, count, retained, max_retained, _ = self.type_summaries[i]
+            out.append('%6d%8d%14d%4d%12d %s'
+                       % (i, count, retained, retained * 100.0 / total_size,
+                          max_retained, type_str))
+        if self.top_retainers:
+            out.append('Top retainers:')
+            for retained, address, type_str in self.top_retainers:
+                out.append('%14d %s @ %d' % (retained, type_str, address))
+        return '\n'.join(out)
+
+
+class _CycleSummary(object):
+    """The reference cycles found by ObjManager.strongly_connected_components.
+
+    :ivar by_size: (component_id, num_objects, total_size) for every cycle,
+        largest total_size first.
+    :ivar by_count: The same cycles, with the most objects first.
+    """
+
+    def __init__(self, cycles):
+        self.by_size = sorted(cycles, key=lambda x: (x[2], x[1]),
+                              reverse=True)
+        self.by_count = sorted(cycles, key=lambda x: (x[1], x[2]),
+                               reverse=True)
+
+    def __len__(self):
+        return len(self.by_size)
+
+    def __repr__(self):
+        total_count = sum(c[1] for c in self.by_size)
+        total_size = sum(c[2] for c in self.by_size)
+        out = [
+            'Total %d cycles, %d objects, Total size = %.1fMiB (%d bytes)'
+            % (len(self.by_size), total_count, total_size / 1024. / 1024,
+               total_size),
+            ' Component   Count      Size'
+            ]
+        for comp, count, size in self.by_size[:20]:
+            out.append('%10d%8d%10d' % (comp, count, size))
+        return '\n'.join(out)
+
+
 class ObjManager(object):
     """Manage the collection of MemObjects.
 
     This is the interface for doing queries, etc.
     """
 
-    def __init__(self, objs, show_progress=True, max_parents=None):
+    def __init__(self, objs, show_progress=True, max_parents=None,
+                 reporter=None):
         """Create a new ObjManager
 
         :param show_progress: If True, as content is loading, write progress
@@ -222,12 +353,18 @@ class ObjManager(object):
             parents tracked to a fixed number, since knowing there are 50k
             references is only informative, you won't actually track into them.
             If 0 we will not compute parents, if < 0 we will show all parents.
+        :param reporter: A progress.ProgressReporter to report the progress
+            to, rather than following show_progress.
         """
         self.objs = objs
         self.show_progress = show_progress
+        self.reporter = progress.get_reporter(show_progress, reporter)
         self.max_parents = max_parents
         if self.max_parents is None:
             self.max_parents = 100
+        # Once parents have been computed, anything that rewrites children
+        # patches the affected parent lists rather than recomputing them all.
+        self._parents_computed = False
 
     def __getitem__(self, address):
         return self.objs[address]
@@ -242,100 +379,15 @@ class ObjManager(object):
         """For each object, figure out who is referencing it."""
         if self.max_parents == 0:
             return
-        parents = {}
-        get_refs = parents.get
         total = len(self.objs)
-        tlast = timer()-20
-        enabled = gc.isenabled()
-        if enabled:
-            # We create a *lot* of temporary objects here, which are all
-            # cleaned up perfectly by refcounting, so disable gc for this loop.
-            gc.disable()
-        try:
-            for idx, obj in enumerate(self.objs.itervalues()):
-                if self.show_progress and idx & 0x3f == 0:
-                    tnow = timer()
-                    if tnow - tlast > 0.1:
-                        tlast = tnow
-                        sys.stderr.write('compute parents %8d / %8d        \r'
-                                         % (idx, total))
-                address = obj.address
-                for ref in obj.children:
-                    refs = get_refs(ref, None)
-                    # This is ugly, so it should be explained.
-                    # To save memory pressure, parents will point to one of 4
-                    # types.
-                    #   1) A simple integer, representing a single referrer
-                    #      this saves the allocation of a separate structure
-                    #      entirely
-                    #   2) A tuple, slightly more efficient than a list, but
-                    #      requires creating a new tuple to 'add' an entry.
-                    #   3) A list, as before, for things with lots of
-                    #      parents, we use a regular list to let it grow.
-                    #   4) None, no references from this object
-                    t = type(refs)
-                    if refs is None:
-                        refs = address
-                    elif t in six.integer_types:
-                        refs = (refs, address)
-                    elif t is tuple:
-                        if len(refs) >= 5:
-                            refs = list(refs)
-                            refs.append(address)
-                        else:
-                            refs = refs + (address,)
-                    elif t is list:
-                        # if we are close to the maximum number of entries, put
-                        # it through a set() to make sure we get all the
-                        # duplicates
-                        if (self.max_parents > 0):
-                            if (len(refs) >= self.max_parents):
-                                # Our list has been filled, all done
-                                continue
-                            elif (len(refs) == self.max_parents - 1):
-                                # We are one step away from being full. We put
-                                # the content into a set() so that we are sure
-                                # any duplicates will get filtered out, leaving
-                                # space for the new ref.
-                                refs.append(address)
-                                refs[:] = set(refs)
-                                continue
-                        refs.append(address)
-                        # We don't need to set it, because we modify-in-place
-                        continue
-                    else:
-                        raise TypeError('unknown refs type: %s\n' % (t,))
-                    parents[ref] = refs
-            if self.show_progress:
-                sys.stderr.write('compute parents %8d / %8d        \r'
-                                 % (idx, total))
-            for idx, obj in enumerate(self.objs.itervalues()):
-                if self.show_progress and idx & 0x3f == 0:
-                    tnow = timer()
-                    if tnow - tlast > 0.1:
-                        tlast = tnow
-                        sys.stderr.write('set parents %8d / %8d        \r'
-                                         % (idx, total))
-                try:
-                    refs = parents.pop(obj.address)
-                except KeyError:
-                    obj.parents = ()
-                else:
-                    if refs is None:
-                        obj.parents = ()
-                    elif type(refs) in six.integer_types:
-                        obj.parents = (refs,)
-                    else:
-                        # We use a set() to remove duplicate parents
-                        obj.parents = set(refs)
-        finally:
-            if enabled:
-                gc.enable()
-        if self.show_progress:
-            sys.stderr.write('set parents %8d / %8d        \n'
-                             % (idx, total))
-
-    def remove_expensive_references(self):
+        phase = self.reporter.start_phase('set parents', total_items=total)
+        # This is done natively in two passes over a dense index of the
+        # objects, see MemObjectCollection.compute_parents
+        self.objs.compute_parents(self.max_parents)
+        self._parents_computed = True
+        phase.finish(items=total)
+
+    def remove_expensive_references(self, noref_types=None, lru_types=None):
         """Filter out references that are mere houskeeping links.
 
         module.__dict__ tends to reference lots of other modules, which in turn
@@ -345,46 +397,164 @@ class ObjManager(object):
         because they end up referring to *everything*.
 
         We filter out any reference to modules, frames, types, function globals
-        pointers & LRU sideways references.
+        pointers & LRU sideways references. This is done in a single native
+        pass, see MemObjectCollection.remove_expensive_references.
+
+        If parents have already been computed, only the parent lists of the
+        objects whose references were removed are updated.
+
+        :param noref_types: The types of objects that nothing should refer
+            to, by default ('module', 'frame', 'type').
+        :param lru_types: The types of linked list nodes whose references to
+            each other should be removed, by default ('_LRUNode',).
+        :return: The number of objects whose references changed.
         """
-        source = lambda:self.objs.itervalues()
+        if noref_types is None:
+            noref_types = _NOREF_TYPES
+        if lru_types is None:
+            lru_types = _LRU_TYPES
         total_objs = len(self.objs)
-        # Add the 'null' object
-        self.objs.add(0, '<ex-reference>', 0, [])
-        for changed, obj in remove_expensive_references(source, total_objs,
-                                                        self.show_progress):
-            continue
+        phase = self.reporter.start_phase('removing expensive refs',
+                                          total_items=total_objs)
+        changed = self.objs.remove_expensive_references(
+            noref_types=noref_types, lru_types=lru_types,
+            update_parents=self._parents_computed,
+            max_parents=self.max_parents)
+        phase.finish(items=total_objs, changed=changed)
+        return changed
 
     def compute_total_size(self, obj):
         """Sum the size of all referenced objects (recursively)."""
         obj.total_size = sum(c.size for c in obj.iter_recursive_refs())
         return obj
 
+    def compute_dominators(self, roots=None):
+        """Compute the retained size and immediate dominator of every object.
+
+        The retained size of an object is how much memory would be freed if it
+        went away, rather than how much it can reach (see compute_total_size).
+        Afterwards, every reachable object has .retained_size and
+        .immediate_dominator set, until objects are added or removed.
+
+        :param roots: The addresses to start from. By default every object
+            nothing refers to is a root (plus one object from each reference
+            cycle nothing refers to).
+        :return: The number of objects reachable from the roots.
+        """
+        phase = self.reporter.start_phase('computing dominators',
+                                          total_items=len(self.objs))
+        num_reachable = self.objs.compute_dominators(roots)
+        phase.finish(items=num_reachable)
+        return num_reachable
+
+    def summarize_retained(self, top=20, roots=None):
+        """Summarize how much memory each type keeps alive.
+
+        Unlike summarize(), which adds up the shallow size of every object,
+        this uses the retained size (see compute_dominators), so a type that
+        holds a lot of memory through other objects stands out. Only the
+        outermost object of each type on an ownership chain is counted, so
+        nested objects of the same type don't count twice.
+
+        :param top: How many of the largest retainers to report.
+        :param roots: Passed to compute_dominators, if it hasn't been run.
+        :return: A _RetainedSummary
+        """
+        if not self.objs.has_dominators:
+            self.compute_dominators(roots)
+        types, top_retainers, total_size = self.objs.summarize_retained(top)
+        types.sort(key=lambda x: (x[2], x[1]), reverse=True)
+        top_retainers = [(retained, address, self.objs[address].type_str)
+                         for retained, address in top_retainers]
+        return _RetainedSummary(types, top_retainers, total_size)
+
+    def strongly_connected_components(self):
+        """Find the reference cycles, and how much memory they hold.
+
+        Objects in a cycle can't be freed by reference counting, only by a
+        full run of the cyclic garbage collector. Afterwards, every object
+        has .component_id set, and
+        self.objs.component_members(component_id) lists the members.
+
+        :return: A _CycleSummary
+        """
+        phase = self.reporter.start_phase('finding cycles',
+                                          total_items=len(self.objs))
+        cycles = self.objs.strongly_connected_components()
+        phase.finish(items=len(self.objs), cycles=len(cycles))
+        return _CycleSummary(cycles)
+
+    def path_to_root(self, obj, roots=None, k=1, excluding=None):
+        """Find out why an object is still alive.
+
+        This finds the shortest chains of references from a root to obj,
+        searching the (complete) parents of every object natively, so it is
+        fast enough to use interactively on large dumps.
+
+        :param obj: The object (or address) to explain.
+        :param roots: Addresses where a chain may start. By default, every
+            module and frame, and everything that nothing refers to.
+        :param k: How many chains to find, each from a different root.
+        :param excluding: Addresses a chain may not go through, such as
+            gc.garbage or the dicts used to track objects.
+        :return: A list of chains, shortest first. Each chain is a list of
+            objects, from the root to obj.
+        """
+        paths = self.objs.path_to_root(obj, roots=roots, k=k,
+                                       excluding=excluding)
+        return [[self.objs[address] for address in path] for path in paths]
+
     def summarize(self, obj=None, excluding=None):
         """Summarize the objects referenced from this one.
 
         :param obj: Given obj as the root object, aggregate the count and size
-            of the types of each referenced object.
+            of the types of each referenced object (walking the dense index,
+            which is built if needed).
             If not supplied, we will walk all objects.
         :param excluding: A list of addresses to exclude from the aggregate
         :return: An _ObjSummary() of this subset of the graph
         """
         summary = _ObjSummary()
-        if obj is None:
-            objs = self.objs.itervalues()
-        else:
-            objs = obj.iter_recursive_refs(excluding=excluding)
-        for obj in objs:
-            summary._add(obj)
+        # The totals of each type are accumulated natively
+        for totals in self.objs.summarize_types(obj, excluding=excluding):
+            summary._add_totals(*totals)
         return summary
 
     def get_all(self, type_str):
-        """Return all objects that match a given type."""
-        all = [o for o in self.objs.itervalues() if o.type_str == type_str]
+        """Return all objects that match a given type.
+
+        This is much faster after build_type_index().
+        """
+        objs = self.objs
+        all = [objs[address] for address in objs.addresses_of_type(type_str)]
         all.sort(key=lambda x:(x.size, len(x), x.num_parents),
                  reverse=True)
         return all
 
+    def select(self, type_str=None, size_gt=None, size_lt=None,
+               num_parents=None, num_children=None, value_re=None):
+        """Find the objects matching all of the given predicates.
+
+        For example, the dicts bigger than 4k with only one referrer:
+            om.select('dict', size_gt=4096, num_parents=1)
+
+        The predicates are checked without creating a proxy for every object,
+        see MemObjectCollection.select. The result is sorted like get_all().
+        """
+        found = self.objs.select(type_str=type_str, size_gt=size_gt,
+                                 size_lt=size_lt, num_parents=num_parents,
+                                 num_children=num_children, value_re=value_re)
+        found.sort(key=lambda x:(x.size, len(x), x.num_parents),
+                   reverse=True)
+        return found
+
+    def build_type_index(self):
+        """Index the objects by type, to speed up get_all() and all().
+
+        See MemObjectCollection.build_type_index.
+        """
+        return self.objs.build_type_index()
+
     def collapse_instance_dicts(self):
         """Hide the __dict__ member of instances.
 
@@ -401,73 +571,15 @@ class ObjManager(object):
         # The instances I'm focusing on have a custom type name, and every
         # instance has 2 pointers. The first is to __dict__, and the second is
         # to the 'type' object whose name matches the type of the instance.
-        # Also __dict__ has only 1 referrer, and that is *this* object
-
-        # TODO: Handle old style classes. They seem to have type 'instanceobj',
-        #       and reference a 'classobj' with the actual type name
-        collapsed = 0
+        # Old style classes have type 'instance', and reference a 'classobj'
+        # with the actual type name. The matching and the splicing of the
+        # references is done by MemObjectCollection.collapse_instance_dicts.
         total = len(self.objs)
-        tlast = timer()-20
-        to_be_removed = set()
-        for item_idx, obj in enumerate(self.objs.itervalues()):
-            if obj.type_str in ('str', 'dict', 'tuple', 'list', 'type',
-                                'function', 'wrapper_descriptor',
-                                'code', 'classobj', 'int',
-                                'weakref'):
-                continue
-            if self.show_progress and item_idx & 0x3f:
-                tnow = timer()
-                if tnow - tlast > 0.1:
-                    tlast = tnow
-                    sys.stderr.write('checked %8d / %8d collapsed %8d    \r'
-                                     % (item_idx, total, collapsed))
-            if obj.type_str == 'module' and len(obj) == 1:
-                (dict_obj,) = obj
-                if dict_obj.type_str != 'dict':
-                    continue
-                extra_refs = []
-            else:
-                if len(obj) != 2:
-                    continue
-                obj_1, obj_2 = obj
-                if obj_1.type_str == 'dict' and obj_2.type_str == 'type':
-                    # This is a new-style class
-                    dict_obj = obj_1
-                    type_obj = obj_2
-                elif (obj.type_str == 'instance'
-                      and obj_1.type_str == 'classobj'
-                      and obj_2.type_str == 'dict'):
-                    # This is an old-style class
-                    type_obj = obj_1
-                    dict_obj = obj_2
-                else:
-                    continue
-                extra_refs = [type_obj.address]
-            collapsed += 1
-            # We found an instance \o/
-            new_refs = list(dict_obj.children)
-            new_refs.extend(extra_refs)
-            obj.children = new_refs
-            obj.size = obj.size + dict_obj.size
-            obj.total_size = 0
-            if obj.type_str == 'instance':
-                instance_type_str = type_obj.value
-                if not isinstance(instance_type_str, str):
-                    instance_type_str = instance_type_str.decode('UTF-8')
-                obj.type_str = instance_type_str
-            # Now that all the data has been moved into the instance, we
-            # will want to remove the dict from the collection.  We'll do the
-            # actual deletion later, since we are using iteritems for this
-            # loop.
-            to_be_removed.add(dict_obj.address)
-        # Now we can do the actual deletion.
-        for address in to_be_removed:
-            del self.objs[address]
-        if self.show_progress:
-            sys.stderr.write('checked %8d / %8d collapsed %8d    \n'
-                             % (item_idx, total, collapsed))
-        if collapsed:
-            self.compute_parents()
+        phase = self.reporter.start_phase('collapsing', total_items=total)
+        collapsed = self.objs.collapse_instance_dicts(
+            update_parents=self._parents_computed,
+            max_parents=self.max_parents)
+        phase.finish(items=total, collapsed=collapsed)
         return collapsed
 
     def refs_as_dict(self, obj):
@@ -483,44 +595,36 @@ class ObjManager(object):
 
     def refs_as_list(self, obj):
         """Expand the ref list, considering it to be a list structure."""
-        as_list = []
-        children = obj.children
-        for addr in children:
-            val = self.objs[addr]
-            if val.type_str == 'bool':
-                val = (val.value == 'True')
-            elif val.value is not None:
-                val = val.value
-            elif val.type_str == 'NoneType':
-                val = None
-            as_list.append(val)
-        return as_list
+        return _refs_as_list(self.objs, obj)
 
     def guess_intern_dict(self):
         """Try to find the string intern dict.
 
         This is a dict that only contains strings that point to themselves.
         """
-        for o in self.objs.itervalues():
-            o_len = len(o)
-            if o.type_str != 'dict' or o_len == 0 or o.num_parents > 0:
+        objs = self.objs
+        for cursor in objs.cursor():
+            if cursor.type_str != 'dict' or cursor.num_parents > 0:
+                continue
+            o_len = len(cursor)
+            if o_len == 0:
                 # Must be a non-empty dict
                 continue
-            # We avoid calling o.children so that we don't have to create
-            # proxies for all objects
+            # Every key must be the same str as its value. The addresses are
+            # compared first, so most dicts are rejected without creating any
+            # proxies.
             for i in range(0, o_len, 2):
-                # Technically, o[i].address == o[i+1].address, but the proxy
-                # objects are smart enough to get reused...
-                c_i = o[i]
-                c_i1 = o[i+1]
-                if c_i is not c_i1 or c_i.type_str != 'str':
+                address = cursor.child(i)
+                if (i + 1 >= o_len or cursor.child(i + 1) != address
+                    or objs[address].type_str != 'str'):
                     break
             else:
-                return o
+                return cursor.proxy()
 
 
 def load(source, using_json=None, show_prog=True, collapse=True,
-         max_parents=None):
+         max_parents=None, dense_index=False, type_index=False,
+         reporter=None):
     """Load objects from the given source.
 
     :param source: If this is a string, we will open it as a file and read all
@@ -535,7 +639,17 @@ def load(source, using_json=None, show_prog=True, collapse=True,
     :param show_prog: If True, display the progress as we read in data
     :param collapse: If True, run collapse_instance_dicts() after loading.
     :param max_parents: See ObjManager.__init__(max_parents)
+    :param dense_index: If True, number the loaded objects 0..N-1 and keep
+        their references as indices (see MemObjectCollection.build_index), so
+        walking the graph doesn't need to hash every address.
+    :param type_index: If True, keep the addresses of each type (see
+        MemObjectCollection.build_type_index), so get_all() and all() don't
+        need to check every object.
+    :param reporter: A progress.ProgressReporter to report the progress of
+        each phase to, rather than following show_prog. The returned
+        ObjManager keeps using it.
     """
+    reporter = progress.get_reporter(show_prog, reporter)
     cleanup = None
     if isinstance(source, six.string_types):
         source, cleanup = files.open_file(source)
@@ -553,23 +667,23 @@ def load(source, using_json=None, show_prog=True, collapse=True,
         using_json = (simplejson is not None)
     try:
         manager = _load(source, using_json, show_prog, input_size,
-                        max_parents=max_parents)
+                        max_parents=max_parents, type_index=type_index,
+                        reporter=reporter)
     finally:
         if cleanup is not None:
             cleanup()
     if collapse:
-        tstart = time.time()
-        if not manager.collapse_instance_dicts():
-            manager.compute_parents()
-        if show_prog:
-            tend = time.time()
-            sys.stderr.write('collapsed in %.1fs\n'
-                             % (tend - tstart,))
+        # Collapsing first means we only compute parents once, over the
+        # smaller graph.
+        manager.collapse_instance_dicts()
+        manager.compute_parents()
+    if dense_index:
+        manager.objs.build_index()
     return manager
 
 
 def iter_objs(source, using_json=False, show_prog=False, input_size=0,
-              objs=None, factory=None):
+              objs=None, factory=None, reporter=None):
     """Iterate MemObjects from json.
 
     :param source: A line iterator.
@@ -580,18 +694,19 @@ def iter_objs(source, using_json=False, show_prog=False, input_size=0,
         None, then duplicate objects will not be parsed or output.
     :param factory: Use this to create new instances, if None, use
         _loader._MemObjectProxy.from_args
+    :param reporter: A progress.ProgressReporter for the 'loading' phase,
+        rather than following show_prog.
     :return: A generator of memory objects.
     """
     # TODO: cStringIO?
-    tstart = timer()
-    input_mb = input_size / 1024. / 1024.
+    phase = progress.get_reporter(show_prog, reporter).start_phase(
+        'loading', total_bytes=input_size or None)
     temp_cache = {}
     address_re = re.compile(
         br'{"address": (?P<address>\d+)'
         )
     bytes_read = count = 0
     last = 0
-    mb_read = 0
     if using_json:
         decoder = _from_json
     else:
@@ -613,56 +728,104 @@ def iter_objs(source, using_json=False, show_prog=False, input_size=0,
             if address in objs:
                 continue
         yield decoder(factory, line, temp_cache=temp_cache)
-        if show_prog and (line_num - last > 5000):
+        count += 1
+        if line_num - last > 5000:
             last = line_num
-            mb_read = bytes_read / 1024. / 1024
-            tdelta = timer() - tstart
-            sys.stderr.write(
-                'loading... line %d, %d objs, %5.1f / %5.1f MiB read in %.1fs\r'
-                % (line_num, len(objs), mb_read, input_mb, tdelta))
+            phase.update(items=count, bytes_read=bytes_read)
     del temp_cache
-    if show_prog:
-        mb_read = bytes_read / 1024. / 1024
-        tdelta = timer() - tstart
-        sys.stderr.write(
-            'loaded line %d, %d objs, %5.1f / %5.1f MiB read in %.1fs        \n'
-            % (line_num, len(objs), mb_read, input_mb, tdelta))
+    phase.finish(items=count, bytes_read=bytes_read)
 
 
-def _load(source, using_json, show_prog, input_size, max_parents=None):
+def _load(source, using_json, show_prog, input_size, max_parents=None,
+          type_index=False, reporter=None):
     objs = _loader.MemObjectCollection()
+    if type_index:
+        # Built up as the objects are added
+        objs.build_type_index()
     for memobj in iter_objs(source, using_json, show_prog, input_size, objs,
-                            factory=objs.add):
+                            factory=objs.add, reporter=reporter):
         # objs.add automatically adds the object as it is created
         pass
-    return ObjManager(objs, show_progress=show_prog, max_parents=max_parents)
+    return ObjManager(objs, show_progress=show_prog, max_parents=max_parents,
+                      reporter=reporter)
 
 
-def remove_expensive_references(source, total_objs=0, show_progress=False):
-    """Filter out references that are mere houskeeping links.
+def summarize_file(source, show_prog=True, reporter=None):
+    """Summarize the objects in a dump, without loading it.
 
-    module.__dict__ tends to reference lots of other modules, which in turn
-    brings in the global reference cycle. Going further
-    function.__globals__ references module.__dict__, so it *too* ends up in
-    the global cycle. Generally these references aren't interesting, simply
-    because they end up referring to *everything*.
+    Only the address, type and size of each object are parsed (see
+    diff.iter_headers), so memory is proportional to the number of types,
+    plus an IDSet of the addresses to skip the objects that were dumped more
+    than once.
 
-    We filter out any reference to modules, frames, types, function globals
-    pointers & LRU sideways references.
+    :param source: A filename, or an iterable of dump lines.
+    :param show_prog: If True, display the progress as we read the dump.
+    :param reporter: A progress.ProgressReporter for the 'summarizing'
+        phase, rather than following show_prog.
+    :return: An _ObjSummary of every object in the dump, like
+        ObjManager.summarize()
+    """
+    cleanup = None
+    if isinstance(source, six.string_types):
+        source, cleanup = files.open_file(source)
+    phase = progress.get_reporter(show_prog, reporter).start_phase(
+        'summarizing')
+    seen = _intset.IDSet()
+    # type_str => [count, total_size, sq_sum, max_size, max_address]
+    totals = {}
+    count = 0
+    try:
+        for address, type_str, size in diff.iter_headers(source):
+            if address in seen:
+                continue
+            seen.add(address)
+            try:
+                type_totals = totals[type_str]
+            except KeyError:
+                type_totals = totals[type_str] = [0, 0, 0, 0, None]
+            type_totals[0] += 1
+            type_totals[1] += size
+            type_totals[2] += size * size
+            if size > type_totals[3]:
+                type_totals[3] = size
+                type_totals[4] = address
+            count += 1
+            if count & 0x3fff == 0:
+                phase.update(items=count, types=len(totals))
+    finally:
+        if cleanup is not None:
+            cleanup()
+    phase.finish(items=count, types=len(totals))
+    del seen
+    summary = _ObjSummary()
+    for type_str, type_totals in totals.items():
+        summary._add_totals(type_str, *type_totals)
+    return summary
 
-    :param source: A callable that returns an iterator of MemObjects. This
-        will be called twice.
-    :param total_objs: The total objects to be filtered, if known. If
-        show_progress is False or the count of objects is unknown, 0.
-    :return: An iterator of (changed, MemObject) objects with expensive
-        references removed.
+
+# The types of the objects that nothing should refer to, see
+# remove_expensive_references
+_NOREF_TYPES = ('module', 'frame', 'type')
+# The types of linked list nodes, whose references to each other are removed
+_LRU_TYPES = ('_LRUNode',)
+
+
+def _find_expensive_objs(objs, total_objs=0, reporter=None,
+                         noref_types=_NOREF_TYPES, lru_types=_LRU_TYPES):
+    """Find the objects that we don't want to keep references to.
+
+    :return: (noref_objs, lru_objs, num_objs, seen_zero). IDSets of the
+        addresses of objects that should no longer be referenced and of
+        _LRUNode objects, how many objects we saw, and whether one of them
+        was the null object at address 0.
     """
-    # First pass, find objects we don't want to reference any more
+    phase = progress.get_reporter(False, reporter).start_phase(
+        'finding expensive refs', total_items=total_objs or None)
     noref_objs = _intset.IDSet()
     lru_objs = _intset.IDSet()
-    total_steps = total_objs * 2
     seen_zero = False
-    for idx, obj in enumerate(source()):
+    idx = -1
+    for idx, obj in enumerate(objs):
         # 'module's have a single __dict__, which tends to refer to other
         # modules. As you start tracking into that, you end up getting into
         # reference cycles, etc, which generally ends up referencing every
@@ -673,60 +836,100 @@ def remove_expensive_references(source, total_objs=0, show_progress=False):
         # __bases__ means we recurse all the way up to object, and object
         # has __subclasses__, which means we recurse down into all types.
         # In general, not helpful for debugging memory consumption
-        if show_progress and idx & 0x1ff == 0:
-            sys.stderr.write('finding expensive refs... %8d / %8d    \r'
-                             % (idx, total_steps))
-        if obj.type_str in ('module', 'frame', 'type'):
+        if idx & 0x1ff == 0:
+            phase.update(items=idx)
+        if obj.type_str in noref_types:
             noref_objs.add(obj.address)
-        if obj.type_str == '_LRUNode':
+        if obj.type_str in lru_types:
             lru_objs.add(obj.address)
         if obj.address == 0:
             seen_zero = True
+    phase.finish(items=idx + 1)
+    return noref_objs, lru_objs, idx + 1, seen_zero
+
+
+def _filter_expensive_refs(obj, noref_objs, lru_objs, lru_types=_LRU_TYPES):
+    """Compute the children of obj without the expensive references.
+
+    :return: The new list of children, or None if obj should be left alone.
+    """
+    if obj.type_str == 'function':
+        # Functions have a reference to 'globals' which is not very
+        # helpful for having a clear understanding of what is going on
+        # especially since the function itself is in its own globals
+        # XXX: This is probably not a guaranteed order, but currently
+        #       func_traverse returns:
+        #   func_code, func_globals, func_module, func_defaults,
+        #   func_doc, func_name, func_dict, func_closure
+        # We want to remove the reference to globals and module
+        refs = list(obj.children)
+        return refs[:1] + refs[3:] + [0]
+    elif obj.type_str in lru_types:
+        # We remove the 'sideways' references
+        return [ref for ref in obj.children if ref not in lru_objs]
+    children = obj.children
+    for ref in children:
+        if ref in noref_objs:
+            break
+    else:
+        # No bad references, keep going
+        return None
+    new_ref_list = [ref for ref in children if ref not in noref_objs]
+    new_ref_list.append(0)
+    return new_ref_list
+
+
+def remove_expensive_references(source, total_objs=0, show_progress=False,
+                                noref_types=_NOREF_TYPES, lru_types=_LRU_TYPES,
+                                reporter=None):
+    """Filter out references that are mere houskeeping links.
+
+    module.__dict__ tends to reference lots of other modules, which in turn
+    brings in the global reference cycle. Going further
+    function.__globals__ references module.__dict__, so it *too* ends up in
+    the global cycle. Generally these references aren't interesting, simply
+    because they end up referring to *everything*.
+
+    We filter out any reference to modules, frames, types, function globals
+    pointers & LRU sideways references.
+
+    :param source: A callable that returns an iterator of MemObjects. This
+        will be called twice.
+    :param total_objs: The total objects to be filtered, if known. If
+        show_progress is False or the count of objects is unknown, 0.
+    :param noref_types: The types of objects that nothing should refer to.
+    :param lru_types: The types of linked list nodes whose references to each
+        other should be removed.
+    :param reporter: A progress.ProgressReporter for the two passes, rather
+        than following show_progress.
+    :return: An iterator of (changed, MemObject) objects with expensive
+        references removed.
+    """
+    reporter = progress.get_reporter(show_progress, reporter)
+    # First pass, find objects we don't want to reference any more
+    noref_objs, lru_objs, num_objs, seen_zero = _find_expensive_objs(
+        source(), total_objs, reporter, noref_types, lru_types)
     # Second pass, any object which refers to something in noref_objs will
     # have that reference removed, and replaced with the null_memobj
     num_expensive = len(noref_objs)
     null_memobj = _loader._MemObjectProxy_from_args(0, '<ex-reference>', 0, [])
     if not seen_zero:
         yield (True, null_memobj)
-    if show_progress and total_objs == 0:
-        total_objs = idx
-        total_steps = total_objs * 2
+    if total_objs == 0:
+        total_objs = num_objs
+    phase = reporter.start_phase('removing expensive refs',
+                                 total_items=total_objs)
+    changed = 0
+    idx = -1
     for idx, obj in enumerate(source()):
-        if show_progress and idx & 0x1ff == 0:
-            sys.stderr.write('removing %d expensive refs... %8d / %8d   \r'
-                             % (num_expensive, idx + total_objs,
-                                total_steps))
-        if obj.type_str == 'function':
-            # Functions have a reference to 'globals' which is not very
-            # helpful for having a clear understanding of what is going on
-            # especially since the function itself is in its own globals
-            # XXX: This is probably not a guaranteed order, but currently
-            #       func_traverse returns:
-            #   func_code, func_globals, func_module, func_defaults,
-            #   func_doc, func_name, func_dict, func_closure
-            # We want to remove the reference to globals and module
-            refs = list(obj.children)
-            obj.children = refs[:1] + refs[3:] + [0]
-            yield (True, obj)
-            continue
-        elif obj.type_str == '_LRUNode':
-            # We remove the 'sideways' references
-            obj.children = [ref for ref in obj.children
-                                 if ref not in lru_objs]
-            yield (True, obj)
-            continue
-        for ref in obj.children:
-            if ref in noref_objs:
-                break
-        else:
-            # No bad references, keep going
+        if idx & 0x1ff == 0:
+            phase.update(items=idx, changed=changed, expensive=num_expensive)
+        new_children = _filter_expensive_refs(obj, noref_objs, lru_objs,
+                                              lru_types)
+        if new_children is None:
             yield (False, obj)
             continue
-        new_ref_list = [ref for ref in obj.children
-                             if ref not in noref_objs]
-        new_ref_list.append(0)
-        obj.children = new_ref_list
+        obj.children = new_children
+        changed += 1
         yield (True, obj)
-    if show_progress:
-        sys.stderr.write('removed %d expensive refs from %d objs%s\n'
-                         % (num_expensive, total_objs, ' '*20))
+    phase.finish(items=idx + 1, changed=changed, expensive=num_expensive)
@@ -0,0 +1,401 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Report the progress of long running work, such as loading a dump.
+
+The work is split into phases (see ProgressReporter.start_phase), and each
+Phase is updated with the items processed and bytes read as it goes. The
+reporter is told when a phase starts, progresses and finishes, along with the
+elapsed time and the peak resident memory of the phase. On Linux the peak is
+exact (the high water mark is reset when a phase starts), elsewhere it is
+only sampled as the phase is updated. StderrReporter writes
+the usual progress lines, and JSONLinesReporter writes a json object per
+event, so loading performance can be tracked across versions.
+"""
+
+import json
+import os
+import platform
+import re
+import sys
+import time
+import weakref
+
+import six
+
+import meliae
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# time.clock was removed in python 3.8, perf_counter is new in 3.3
+timer = getattr(time, 'perf_counter', time.time)
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def _read_proc(path):
+    try:
+        f = open(path, 'rb')
+    except EnvironmentError:
+        return None
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _max_rss():
+    """The peak resident memory of the process so far, or None."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss
+    return max_rss * 1024
+
+
+def get_rss():
+    """The resident memory of this process in bytes, or None if unknown.
+
+    Without /proc, this is the peak resident memory of the process so far.
+    """
+    content = _read_proc('/proc/self/statm')
+    if content is not None:
+        return int(content.split()[1]) * _PAGE_SIZE
+    return _max_rss()
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of this process, if possible.
+
+    Linux (since 4.0) resets the high water mark when 5 is written to
+    /proc/self/clear_refs.
+
+    :return: True if it was reset
+    """
+    try:
+        f = open('/proc/self/clear_refs', 'w')
+        try:
+            f.write('5')
+        finally:
+            f.close()
+    except EnvironmentError:
+        return False
+    return True
+
+
+def get_peak_rss():
+    """The peak resident memory of this process in bytes, or None.
+
+    This is the high water mark since reset_peak_rss() where /proc has it,
+    otherwise the peak of the whole process so far.
+    """
+    content = _read_proc('/proc/self/status')
+    if content is not None:
+        m = re.search(br'VmHWM:\s*(\d+) kB', content)
+        if m is not None:
+            return int(m.group(1)) * 1024
+    return _max_rss()
+
+
+# The phases that have started but not finished, see Phase._start_peak
+_active_phases = weakref.WeakSet()
+
+
+class Phase(object):
+    """A step of the work, and how far it has got.
+
+    :ivar name: What is being done, such as 'loading'.
+    :ivar unit: What the items are, such as 'objs'.
+    :ivar items: How many items have been processed so far.
+    :ivar total_items: How many items there are, or None if unknown.
+    :ivar bytes_read: How many bytes of input have been read, or None.
+    :ivar total_bytes: The size of the input, or None if unknown.
+    :ivar elapsed: How many seconds the phase has taken.
+    :ivar peak_rss: The largest resident memory (in bytes) during the
+        phase, or None if unknown.
+    :ivar exact_peak: True if peak_rss is the high water mark of the phase,
+        False if it is only the largest of the samples taken as it went.
+    :ivar extra: Other counts for the phase, such as how many objects were
+        changed.
+    :ivar finished: True once finish() has been called.
+    """
+
+    def __init__(self, reporter, name, total_items=None, total_bytes=None,
+                 unit='objs', interval=0.2):
+        """Create a new Phase.
+
+        :param reporter: The ProgressReporter to tell about progress.
+        :param interval: Only report progress this often (in seconds), if
+            None progress is not reported at all, only the end of the phase.
+        """
+        self._reporter = reporter
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.total_items = total_items
+        self.bytes_read = None
+        self.total_bytes = total_bytes
+        self.extra = {}
+        self.elapsed = 0.0
+        self.peak_rss = None
+        self.exact_peak = False
+        self.finished = False
+        self._interval = interval
+        self._start = timer()
+        self._last_report = self._start
+        self._start_peak()
+
+    def _start_peak(self):
+        # Resetting the high water mark loses the peak of the phases still
+        # running (such as a benchmark around the whole load), so they take
+        # theirs first
+        for phase in list(_active_phases):
+            phase._sample_rss()
+        self.exact_peak = reset_peak_rss()
+        _active_phases.add(self)
+        self._sample_rss()
+
+    def _sample_rss(self):
+        if self.exact_peak:
+            rss = get_peak_rss()
+        else:
+            rss = get_rss()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def _set(self, items, bytes_read, extra):
+        if items is not None:
+            self.items = items
+        if bytes_read is not None:
+            self.bytes_read = bytes_read
+        if extra:
+            self.extra.update(extra)
+
+    def update(self, items=None, bytes_read=None, **extra):
+        """Record how far the phase got.
+
+        The reporter is only told every interval seconds, so this can be
+        called often (though not for every item, checking the time isn't
+        free).
+        """
+        self._set(items, bytes_read, extra)
+        if self._interval is None:
+            return
+        now = timer()
+        if now - self._last_report < self._interval:
+            return
+        self._last_report = now
+        self.elapsed = now - self._start
+        self._sample_rss()
+        self._reporter.phase_progress(self)
+
+    def finish(self, items=None, bytes_read=None, **extra):
+        """Record the final counts, and tell the reporter we are done."""
+        self._set(items, bytes_read, extra)
+        self.elapsed = timer() - self._start
+        self._sample_rss()
+        _active_phases.discard(self)
+        self.finished = True
+        self._reporter.phase_finished(self)
+
+    def as_dict(self):
+        """The state of the phase, as a dict that can be written as json."""
+        result = dict(self.extra)
+        result.update({
+            'phase': self.name,
+            'unit': self.unit,
+            'items': self.items,
+            'total_items': self.total_items,
+            'bytes_read': self.bytes_read,
+            'total_bytes': self.total_bytes,
+            'elapsed': self.elapsed,
+            'peak_rss': self.peak_rss,
+            })
+        return result
+
+
+class ProgressReporter(object):
+    """Receives the phases of the work as they go.
+
+    This one ignores them. Subclasses override phase_started, phase_progress
+    and phase_finished.
+
+    :cvar interval: How often (in seconds) phase_progress is called, None to
+        never call it.
+    """
+
+    interval = None
+
+    def start_phase(self, name, total_items=None, total_bytes=None,
+                    unit='objs'):
+        """Start a new phase of the work.
+
+        :return: A Phase, to update as the work progresses
+        """
+        phase = Phase(self, name, total_items=total_items,
+                      total_bytes=total_bytes, unit=unit,
+                      interval=self.interval)
+        self.phase_started(phase)
+        return phase
+
+    def phase_started(self, phase):
+        pass
+
+    def phase_progress(self, phase):
+        pass
+
+    def phase_finished(self, phase):
+        pass
+
+
+def _describe(phase):
+    parts = []
+    if phase.total_items is not None:
+        parts.append('%d / %d %s' % (phase.items, phase.total_items,
+                                     phase.unit))
+    else:
+        parts.append('%d %s' % (phase.items, phase.unit))
+    for key in sorted(phase.extra):
+        parts.append('%s %s' % (key, phase.extra[key]))
+    if phase.bytes_read is not None:
+        mb_read = phase.bytes_read / 1024. / 1024
+        if phase.total_bytes:
+            parts.append('%5.1f / %5.1f MiB read' % (
+                mb_read, phase.total_bytes / 1024. / 1024))
+        else:
+            parts.append('%5.1f MiB read' % (mb_read,))
+    return ', '.join(parts)
+
+
+class StderrReporter(ProgressReporter):
+    """Write progress lines, overwriting them until the phase is done."""
+
+    interval = 0.2
+
+    def __init__(self, out=None):
+        """Create a new StderrReporter.
+
+        :param out: Where to write, by default sys.stderr.
+        """
+        self._out = out
+
+    def _write(self, text):
+        out = self._out
+        if out is None:
+            out = sys.stderr
+        out.write(text)
+
+    def phase_started(self, phase):
+        self._write('%s...\r' % (phase.name,))
+
+    def phase_progress(self, phase):
+        self._write('%s... %s in %.1fs\r'
+                    % (phase.name, _describe(phase), phase.elapsed))
+
+    def phase_finished(self, phase):
+        if phase.peak_rss is None:
+            rss = ''
+        else:
+            rss = ', peak RSS %.1f MiB' % (phase.peak_rss / 1024. / 1024,)
+        self._write('%s: %s in %.1fs%s        \n'
+                    % (phase.name, _describe(phase), phase.elapsed, rss))
+
+
+class JSONLinesReporter(ProgressReporter):
+    """Write a json object per line for each phase.
+
+    Every object has the 'event' ('start', 'progress' or 'finish'), the
+    fields of Phase.as_dict(), the 'time' it was written, and the meliae and
+    python versions.
+    """
+
+    def __init__(self, out, progress_events=False):
+        """Create a new JSONLinesReporter.
+
+        :param out: A filename (which is appended to) or a file opened for
+            writing text.
+        :param progress_events: If True, also write the progress of each
+            phase (every 0.2s), not just when it starts and finishes.
+        """
+        if isinstance(out, six.string_types):
+            self._out = open(out, 'a')
+            self._owns_out = True
+        else:
+            self._out = out
+            self._owns_out = False
+        if progress_events:
+            self.interval = 0.2
+
+    def close(self):
+        if self._owns_out:
+            self._out.close()
+
+    def _write(self, event, phase):
+        record = phase.as_dict()
+        record['event'] = event
+        record['time'] = time.time()
+        record['meliae_version'] = meliae.__version__
+        record['python_version'] = platform.python_version()
+        self._out.write(json.dumps(record, sort_keys=True) + '\n')
+        self._out.flush()
+
+    def phase_started(self, phase):
+        self._write('start', phase)
+
+    def phase_progress(self, phase):
+        self._write('progress', phase)
+
+    def phase_finished(self, phase):
+        self._write('finish', phase)
+
+
+class MultiReporter(ProgressReporter):
+    """Pass the phases on to several reporters."""
+
+    def __init__(self, reporters):
+        self.reporters = list(reporters)
+        intervals = [r.interval for r in self.reporters
+                     if r.interval is not None]
+        if intervals:
+            self.interval = min(intervals)
+
+    def phase_started(self, phase):
+        for reporter in self.reporters:
+            reporter.phase_started(phase)
+
+    def phase_progress(self, phase):
+        for reporter in self.reporters:
+            if reporter.interval is not None:
+                reporter.phase_progress(phase)
+
+    def phase_finished(self, phase):
+        for reporter in self.reporters:
+            reporter.phase_finished(phase)
+
+
+def get_reporter(show_progress, reporter=None):
+    """The reporter to use for show_progress, unless one was given."""
+    if reporter is not None:
+        return reporter
+    if show_progress:
+        return StderrReporter()
+    return ProgressReporter()
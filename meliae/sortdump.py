@@ -0,0 +1,187 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Sort a dump file by address.
+
+Dumps can be much bigger than memory, so this is an external merge sort. The
+input is cut into runs that fit in the memory budget, each run is sorted and
+written to a temporary file, and then the runs are merged. Identical lines
+(the same object dumped twice) are dropped along the way.
+
+The output has one object per line, without the '[' and ']' of a json list,
+which both the loader and meliae.diff accept.
+"""
+
+import heapq
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import six
+
+from meliae import files
+
+
+_address_re = re.compile(br'\{"address": (?P<address>\d+)')
+
+# Roughly what python needs for each line we hold in memory, on top of the
+# bytes of the line itself (the bytes object, the int and the tuple).
+_LINE_OVERHEAD = 120
+
+# Don't merge more than this many runs at once, to stay clear of the limit on
+# open files.
+_MAX_FAN_IN = 64
+
+
+def _iter_keyed(source):
+    """Yield (address, line) for every object line in source."""
+    for line in source:
+        if line.endswith(b',\n'):
+            line = line[:-2] + b'\n'
+        elif not line.endswith(b'\n'):
+            line = line + b'\n'
+        m = _address_re.match(line)
+        if m is None:
+            # '[', ']' or blank
+            continue
+        yield int(m.group('address')), line
+
+
+def _write_unique(keyed, out):
+    """Write the lines of keyed (which is sorted), skipping duplicates."""
+    last = None
+    count = 0
+    for item in keyed:
+        if item == last:
+            continue
+        out.write(item[1])
+        last = item
+        count += 1
+    return count
+
+
+class _Run(object):
+    """A sorted run in a temporary file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        f = open(self.path, 'rb')
+        try:
+            for item in _iter_keyed(f):
+                yield item
+        finally:
+            f.close()
+
+
+def _merge_runs(runs, out):
+    """Merge sorted runs into out."""
+    return _write_unique(heapq.merge(*runs), out)
+
+
+def _write_run(chunk, workdir, run_num):
+    """Sort chunk, and write it out as a new run."""
+    chunk.sort()
+    path = os.path.join(workdir, 'run-%d' % (run_num,))
+    f = open(path, 'wb')
+    try:
+        _write_unique(chunk, f)
+    finally:
+        f.close()
+    return _Run(path)
+
+
+def sort_dump(source, out, memory=256 * 1024 * 1024, tmpdir=None):
+    """Sort the objects in source by address, writing them to out.
+
+    :param source: A filename, or an iterable of dump lines.
+    :param out: A file opened for writing bytes.
+    :param memory: Roughly how many bytes to use for sorting in memory.
+    :param tmpdir: Where to put the sorted runs, by default the system
+        temporary directory.
+    :return: The number of (unique) objects written.
+    """
+    cleanup = None
+    if isinstance(source, six.string_types):
+        source, cleanup = files.open_file(source)
+    workdir = tempfile.mkdtemp(prefix='meliae-sort-', dir=tmpdir)
+    try:
+        runs = []
+        chunk = []
+        chunk_size = 0
+        for item in _iter_keyed(source):
+            chunk.append(item)
+            chunk_size += len(item[1]) + _LINE_OVERHEAD
+            if chunk_size >= memory:
+                runs.append(_write_run(chunk, workdir, len(runs)))
+                chunk = []
+                chunk_size = 0
+        if not runs:
+            # It all fit in memory
+            chunk.sort()
+            return _write_unique(chunk, out)
+        if chunk:
+            runs.append(_write_run(chunk, workdir, len(runs)))
+        del chunk
+        num_runs = len(runs)
+        while len(runs) > _MAX_FAN_IN:
+            merged = []
+            for start in range(0, len(runs), _MAX_FAN_IN):
+                group = runs[start:start + _MAX_FAN_IN]
+                path = os.path.join(workdir, 'run-%d' % (num_runs,))
+                num_runs += 1
+                f = open(path, 'wb')
+                try:
+                    _merge_runs(group, f)
+                finally:
+                    f.close()
+                for run in group:
+                    os.remove(run.path)
+                merged.append(_Run(path))
+            runs = merged
+        return _merge_runs(runs, out)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if cleanup is not None:
+            cleanup()
+
+
+def main(args):
+    import optparse
+    p = optparse.OptionParser('%prog [options] INFILE OUTFILE')
+    p.add_option('--memory', type='int', default=256,
+                 help='How many MiB to use for sorting in memory'
+                      ' (default 256).')
+    p.add_option('--tmpdir', default=None,
+                 help='Where to put temporary files.')
+    opts, args = p.parse_args(args)
+    if len(args) != 2:
+        sys.stderr.write('We need an input and an output file, not %d'
+                         ' arguments\n' % (len(args),))
+        return -1
+    out = open(args[1], 'wb')
+    try:
+        count = sort_dump(args[0], out, memory=opts.memory * 1024 * 1024,
+                          tmpdir=opts.tmpdir)
+    finally:
+        out.close()
+    sys.stderr.write('wrote %d objects\n' % (count,))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,328 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keep a dump in a SQLite database, for dumps that don't fit in memory.
+
+load_db() streams a dump into a database with a table of types, a table of
+objects and a table of references, indexed by address, by type and by the
+referenced object (to find the parents). open_db() gives a DBObjManager, which
+answers the common ObjManager queries with SQL, so only SQLite's page cache
+and the objects being looked at are kept in memory.
+
+The dump is stored as it is, instance dicts are not collapsed. Integer values
+that don't fit in 64 bits are stored as their decimal text, with big_int set.
+"""
+
+import sqlite3
+import sys
+
+import six
+
+from meliae import (
+    files,
+    loader,
+    _intset,
+    _loader,
+    )
+
+
+if sys.version_info[0] >= 3:
+    intern = sys.intern
+
+
+_SCHEMA = [
+    'CREATE TABLE types (id INTEGER PRIMARY KEY, type_str TEXT NOT NULL)',
+    'CREATE TABLE objects (address INTEGER PRIMARY KEY,'
+        ' type_id INTEGER NOT NULL, size INTEGER NOT NULL, value,'
+        ' big_int INTEGER)',
+    'CREATE TABLE refs (address INTEGER NOT NULL, idx INTEGER NOT NULL,'
+        ' child INTEGER NOT NULL, PRIMARY KEY (address, idx))'
+        ' WITHOUT ROWID',
+    ]
+
+# Created once the objects are loaded, which is much faster than keeping them
+# up to date while inserting
+_INDEXES = [
+    'CREATE INDEX objects_by_type ON objects (type_id)',
+    'CREATE INDEX refs_by_child ON refs (child)',
+    ]
+
+# How many objects to insert at a time
+_BATCH_SIZE = 10000
+
+# SQLite can only store signed 64-bit integers
+_MIN_INT = -(1 << 63)
+_MAX_INT = (1 << 63) - 1
+
+
+def _db_value(value):
+    """Convert the value of an object into something SQLite can store.
+
+    :return: (value, big_int) where big_int is 1 if value is the text of an
+        integer too big for SQLite, else None.
+    """
+    if (isinstance(value, six.integer_types)
+        and not _MIN_INT <= value <= _MAX_INT):
+        return six.text_type(value), 1
+    return value, None
+
+
+def load_db(source, filename, using_json=None, show_prog=True,
+            cache_kb=64 * 1024):
+    """Load a dump into a new SQLite database.
+
+    :param source: A filename, or an iterable of dump lines.
+    :param filename: Where to create the database.
+    :param using_json: See loader.load()
+    :param show_prog: If True, display the progress as we read in data
+    :param cache_kb: How much memory SQLite may use for its page cache, for
+        the returned DBObjManager.
+    :return: A DBObjManager for the new database
+    """
+    cleanup = None
+    if isinstance(source, six.string_types):
+        source, cleanup = files.open_file(source)
+    if using_json is None:
+        using_json = (loader.simplejson is not None)
+    conn = sqlite3.connect(filename)
+    count = 0
+    try:
+        # Nothing is lost if loading fails part way, we just start again
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        type_ids = {}
+        seen = _intset.IDSet()
+        obj_rows = []
+        ref_rows = []
+        for obj in loader.iter_objs(source, using_json, show_prog, objs=seen):
+            address = obj.address
+            seen.add(address)
+            type_str = obj.type_str
+            try:
+                type_id = type_ids[type_str]
+            except KeyError:
+                type_id = type_ids[type_str] = len(type_ids)
+                conn.execute('INSERT INTO types VALUES (?, ?)',
+                             (type_id, type_str))
+            # The name of a module is kept as its value
+            value, big_int = _db_value(obj.value)
+            obj_rows.append((address, type_id, obj.size, value, big_int))
+            ref_rows.extend([(address, idx, child)
+                             for idx, child in enumerate(obj.children)])
+            if len(obj_rows) >= _BATCH_SIZE:
+                count += _insert_rows(conn, obj_rows, ref_rows)
+                obj_rows = []
+                ref_rows = []
+        count += _insert_rows(conn, obj_rows, ref_rows)
+        del seen
+        if show_prog:
+            sys.stderr.write('indexing %d objects...\r' % (count,))
+        for statement in _INDEXES:
+            conn.execute(statement)
+        conn.commit()
+        if show_prog:
+            sys.stderr.write('indexed %d objects        \n' % (count,))
+    finally:
+        conn.close()
+        if cleanup is not None:
+            cleanup()
+    return open_db(filename, cache_kb=cache_kb)
+
+
+def _insert_rows(conn, obj_rows, ref_rows):
+    conn.executemany('INSERT INTO objects VALUES (?, ?, ?, ?, ?)', obj_rows)
+    conn.executemany('INSERT INTO refs VALUES (?, ?, ?)', ref_rows)
+    return len(obj_rows)
+
+
+def open_db(filename, cache_kb=64 * 1024, max_parents=None):
+    """Open a database created by load_db().
+
+    :param cache_kb: How much memory SQLite may use for its page cache.
+    :param max_parents: See DBObjManager.__init__
+    :return: A DBObjManager
+    """
+    conn = sqlite3.connect(filename)
+    conn.execute('PRAGMA cache_size = %d' % (-int(cache_kb),))
+    return DBObjManager(conn, max_parents=max_parents)
+
+
+class DBObjManager(object):
+    """Query a dump stored in SQLite, like an ObjManager.
+
+    Objects are returned as standalone _MemObjectProxy instances (see
+    _loader._MemObjectProxy_from_args) with their children and parents filled
+    in. Walking from one to the next goes through this manager, for example:
+        om[obj.parents[0]]
+    """
+
+    def __init__(self, conn, max_parents=None):
+        """Create a new DBObjManager.
+
+        :param conn: A sqlite3 connection to a database made by load_db()
+        :param max_parents: Only fill in this many parents of each object
+            (by default 100), if < 0 all of them.
+        """
+        self._conn = conn
+        self.max_parents = max_parents
+        if self.max_parents is None:
+            self.max_parents = 100
+        self._type_strs = {}
+        self._type_ids = {}
+        for type_id, type_str in conn.execute('SELECT id, type_str FROM types'):
+            type_str = intern(str(type_str))
+            self._type_strs[type_id] = type_str
+            self._type_ids[type_str] = type_id
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM objects').fetchone()[0]
+
+    def __contains__(self, address):
+        return self._conn.execute('SELECT 1 FROM objects WHERE address = ?',
+                                  (address,)).fetchone() is not None
+
+    def __getitem__(self, address):
+        row = self._conn.execute(
+            'SELECT type_id, size, value, big_int FROM objects'
+            ' WHERE address = ?', (address,)).fetchone()
+        if row is None:
+            raise KeyError('address %s not present' % (address,))
+        type_id, size, value, big_int = row
+        if big_int:
+            value = int(value)
+        return _loader._MemObjectProxy_from_args(address,
+            self._type_strs[type_id], size, self.children_of(address),
+            value=value, parent_list=self.parents_of(address))
+
+    def children_of(self, address):
+        """The addresses referenced by address, in order."""
+        return [child for child, in self._conn.execute(
+            'SELECT child FROM refs WHERE address = ? ORDER BY idx',
+            (address,))]
+
+    def parents_of(self, address):
+        """The (distinct) addresses that reference address.
+
+        Only max_parents of them are returned.
+        """
+        return [parent for parent, in self._conn.execute(
+            'SELECT DISTINCT address FROM refs WHERE child = ?'
+            ' ORDER BY address LIMIT ?', (address, self.max_parents))]
+
+    def _header(self, address):
+        """The (type_str, size) of address, or None if it isn't present."""
+        row = self._conn.execute(
+            'SELECT type_id, size FROM objects WHERE address = ?',
+            (address,)).fetchone()
+        if row is None:
+            return None
+        return self._type_strs[row[0]], row[1]
+
+    def get_all(self, type_str):
+        """Return all objects that match a given type, sorted like
+        ObjManager.get_all()."""
+        type_id = self._type_ids.get(type_str)
+        if type_id is None:
+            return []
+        addresses = [address for address, in self._conn.execute(
+            'SELECT address FROM objects WHERE type_id = ?', (type_id,))]
+        all = [self[address] for address in addresses]
+        all.sort(key=lambda x:(x.size, len(x), x.num_parents),
+                 reverse=True)
+        return all
+
+    def summarize(self, obj=None, excluding=None):
+        """Summarize the objects referenced from this one.
+
+        :param obj: Given obj as the root object, aggregate the count and size
+            of the types of each referenced object (which are looked up one at
+            a time). If not supplied, every object is aggregated by SQLite.
+        :param excluding: A list of addresses to exclude from the aggregate
+        :return: An _ObjSummary() of this subset of the graph
+        """
+        summary = loader._ObjSummary()
+        if obj is None and not excluding:
+            # With a single max(), SQLite returns the address of the row with
+            # the max size. The sum of squares is only used for the std dev,
+            # so it is summed as a float rather than risking an overflow.
+            for row in self._conn.execute(
+                    'SELECT type_id, COUNT(*), SUM(size), TOTAL(size * size),'
+                    ' MAX(size), address FROM objects GROUP BY type_id'):
+                summary._add_totals(self._type_strs[row[0]], row[1], row[2],
+                                    int(row[3]), row[4], row[5])
+            return summary
+        seen = _intset.IDSet()
+        if excluding is not None:
+            for address in excluding:
+                seen.add(address)
+        if obj is None:
+            for address, type_id, size in self._conn.execute(
+                    'SELECT address, type_id, size FROM objects'):
+                if address not in seen:
+                    summary._add_totals(self._type_strs[type_id], 1, size,
+                                        size * size, size, address)
+            return summary
+        if not isinstance(obj, six.integer_types):
+            obj = obj.address
+        todo = [obj]
+        while todo:
+            address = todo.pop()
+            if address in seen:
+                continue
+            seen.add(address)
+            header = self._header(address)
+            if header is None:
+                continue
+            type_str, size = header
+            summary._add_totals(type_str, 1, size, size * size, size, address)
+            todo.extend(self.children_of(address))
+        return summary
+
+    def refs_as_dict(self, obj):
+        """Expand the ref list considering it to be a 'dict' structure.
+
+        See _MemObjectProxy.refs_as_dict.
+        """
+        return loader._refs_as_dict(self, obj)
+
+    def refs_as_list(self, obj):
+        """Expand the ref list, considering it to be a list structure."""
+        return loader._refs_as_list(self, obj)
+
+
+def main(args):
+    import optparse
+    p = optparse.OptionParser('%prog [options] DUMP DATABASE')
+    p.add_option('--quiet', '-q', action='store_true', default=False,
+                 help='Do not report progress.')
+    opts, args = p.parse_args(args)
+    if len(args) != 2:
+        sys.stderr.write('We need a dump and a database file, not %d'
+                         ' arguments\n' % (len(args),))
+        return -1
+    om = load_db(args[0], args[1], show_prog=not opts.quiet)
+    try:
+        sys.stdout.write('%r\n' % (om.summarize(),))
+    finally:
+        om.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,219 @@
+# Copyright (C) 2009 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Remove duplicated object information.
+
+To be memory efficient, 'scanner.dump_gc_objects()' does not track what objects
+have already been dumped. This means that it occasionally dumps the same object
+multiple times.
+This filters a dump into purely unique lines. The input is read in large
+blocks (or through mmap for plain files), and the addresses are parsed by
+IDSet.filter_lines, so python only touches each block, not each line.
+"""
+
+import gzip
+import mmap
+import os
+import stat
+import sys
+import time
+
+from meliae import (
+    files,
+    _intset,
+    )
+
+
+_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def _iter_mmap_blocks(infile, block_size):
+    """Yield blocks of whole lines from a plain file, through mmap.
+
+    :return: None if infile can't be mapped.
+    """
+    try:
+        fileno = infile.fileno()
+        st = os.fstat(fileno)
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+        return None
+    try:
+        mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+    # open_file may already have read (and seeked back) to sniff for gzip
+    start = infile.tell()
+    def iter_blocks():
+        pos = start
+        size = len(mapped)
+        try:
+            while pos < size:
+                end = min(pos + block_size, size)
+                if end < size:
+                    nl = mapped.rfind(b'\n', pos, end)
+                    if nl == -1:
+                        # A single line longer than a block
+                        nl = mapped.find(b'\n', end)
+                        if nl == -1:
+                            nl = size - 1
+                    end = nl + 1
+                yield mapped[pos:end]
+                pos = end
+        finally:
+            mapped.close()
+    return iter_blocks()
+
+
+def _iter_read_blocks(infile, block_size):
+    """Yield blocks of whole lines from anything with a read() method."""
+    remainder = b''
+    while True:
+        block = infile.read(block_size)
+        if not block:
+            break
+        nl = block.rfind(b'\n')
+        if nl == -1:
+            remainder += block
+            continue
+        yield remainder + block[:nl + 1]
+        remainder = block[nl + 1:]
+    if remainder:
+        yield remainder
+
+
+def _iter_line_blocks(lines, block_size):
+    """Group an iterator of lines into blocks."""
+    block = []
+    size = 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= block_size:
+            yield b''.join(block)
+            block = []
+            size = 0
+    if block:
+        yield b''.join(block)
+
+
+def iter_blocks(infile, block_size=_BLOCK_SIZE):
+    """Yield blocks of whole lines from infile.
+
+    :param infile: A file, or an iterator of lines (such as files.open_file
+        returns for gzipped dumps).
+    """
+    blocks = _iter_mmap_blocks(infile, block_size)
+    if blocks is not None:
+        return blocks
+    if getattr(infile, 'read', None) is not None:
+        return _iter_read_blocks(infile, block_size)
+    return _iter_line_blocks(infile, block_size)
+
+
+def strip_duplicate(infile, outfile, insize=None, show_progress=True):
+    """Copy the unique lines of infile to outfile.
+
+    :return: (lines_in, lines_out)
+    """
+    seen = _intset.IDSet()
+    if insize is not None:
+        in_mb = ' / %5.1f MiB' % (insize / 1024. / 1024,)
+    else:
+        in_mb = ''
+    bytes_read = 0
+    lines_in = 0
+    lines_out = 0
+    tstart = time.time()
+    tlast = tstart
+    for block in iter_blocks(infile):
+        bytes_read += len(block)
+        kept, num_lines = seen.filter_lines(block)
+        lines_in += num_lines
+        lines_out += kept.count(b'\n')
+        if kept and not kept.endswith(b'\n'):
+            lines_out += 1
+        outfile.write(kept)
+        tnow = time.time()
+        if show_progress and tnow - tlast > 0.2:
+            tlast = tnow
+            mb_read = bytes_read / 1024. / 1024
+            tdelta = tnow - tstart
+            sys.stderr.write(
+                'stripping... line %d, %d out, %5.1f%s read in %.1fs'
+                ' (%.1f MiB/s)\r'
+                % (lines_in, lines_out, mb_read, in_mb, tdelta,
+                   mb_read / tdelta))
+    if show_progress:
+        mb_read = bytes_read / 1024. / 1024
+        tdelta = max(time.time() - tstart, 1e-6)
+        sys.stderr.write(
+            'stripped %d lines to %d, %5.1f MiB read in %.1fs (%.1f MiB/s)'
+            '          \n'
+            % (lines_in, lines_out, mb_read, tdelta, mb_read / tdelta))
+    return lines_in, lines_out
+
+
+def _binary_stream(stream):
+    """The bytes interface of sys.stdin/sys.stdout."""
+    return getattr(stream, 'buffer', stream)
+
+
+def main(args=None):
+    import optparse
+    if args is None:
+        args = sys.argv[1:]
+    p = optparse.OptionParser(
+        '%prog [INFILE [OUTFILE]]',
+        description='Remove the objects that were dumped more than once.'
+                    ' INFILE may be gzipped, and OUTFILE is gzipped if it'
+                    ' ends in .gz.')
+    p.add_option('--quiet', '-q', action='store_true', default=False,
+                 help='Do not report progress.')
+
+    opts, args = p.parse_args(args)
+    if len(args) > 2:
+        sys.stderr.write('We only support 2 filenames, not %d\n' % (len(args),))
+        return -1
+
+    cleanups = []
+    try:
+        insize = None
+        if len(args) == 0:
+            infile = _binary_stream(sys.stdin)
+        else:
+            infile, cleanup = files.open_file(args[0])
+            if cleanup is not None:
+                cleanups.append(cleanup)
+            else:
+                insize = os.path.getsize(args[0]) or None
+        if len(args) < 2:
+            outfile = _binary_stream(sys.stdout)
+        elif args[1].endswith('.gz'):
+            outfile = gzip.GzipFile(args[1], 'wb')
+            cleanups.append(outfile.close)
+        else:
+            outfile = open(args[1], 'wb')
+            cleanups.append(outfile.close)
+        strip_duplicate(infile, outfile, insize,
+                        show_progress=not opts.quiet)
+    finally:
+        for cleanup in cleanups:
+            cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -35,9 +35,17 @@ def test_suite():
         'test__intset',
         'test__loader',
         'test__scanner',
+        'test_diff',
+        'test_files',
+        'test_growth',
+        'test_lazyload',
         'test_loader',
         'test_perf_counter',
+        'test_progress',
         'test_scanner',
+        'test_sortdump',
+        'test_sqlstore',
+        'test_strip_duplicates',
         ]
     full_names = [__name__ + '.' + n for n in module_names]
 
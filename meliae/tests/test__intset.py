@@ -14,6 +14,7 @@
 
 """Test the Set of Integers object."""
 
+import array
 import sys
 
 import six
@@ -162,3 +163,33 @@ class TestIDSet(TestIntSet):
         pass
         # Negative values cannot be checked in IDSet, because we cast them to
         # unsigned long first.
+
+
+class TestOffsetIndex(tests.TestCase):
+
+    def test_index_lines(self):
+        buf = (b'[\n'
+               b'{"address": 12, "type": "int"},\n'
+               b'{"address": 5, "type": "str"}\n'
+               b'{"addr\n'
+               b'{"address": 7, "type": "dict"}')
+        addresses = array.array('Q')
+        offsets = array.array('Q')
+        self.assertEqual(3, _intset.index_lines(buf, 100, addresses, offsets))
+        self.assertEqual([12, 5, 7], list(addresses))
+        self.assertEqual([102, 134, 171], list(offsets))
+        self.assertEqual(b'{"address": 7', buf[71:84])
+
+    def test_index_lines_checks_arrays(self):
+        self.assertRaises(TypeError, _intset.index_lines, b'', 0,
+                          array.array('l'), array.array('Q'))
+        self.assertRaises(ValueError, _intset.index_lines, b'', 0,
+                          array.array('Q', [1]), array.array('Q'))
+
+    def test_sort_index(self):
+        addresses = array.array('Q', [12, 5, 7, 5, 2**64 - 16])
+        offsets = array.array('Q', [0, 30, 60, 90, 120])
+        self.assertEqual(4, _intset.sort_index(addresses, offsets))
+        # The first copy of a repeated address is kept
+        self.assertEqual([5, 7, 12, 2**64 - 16], list(addresses))
+        self.assertEqual([30, 60, 0, 120], list(offsets))
@@ -14,7 +14,14 @@
 
 """Pyrex extension for tracking loaded objects"""
 
+import re
 import sys
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from meliae import (
     _loader,
@@ -28,6 +35,7 @@ from meliae import (
 # 2: refcnt
 # 3: vtable*
 # 4: _table*
+# 5: _index*
 # 3 4-byte int attributes
 # Note that on 64-bit platforms, alignment issues mean we will still
 # round to a multiple-of-8 bytes.
@@ -222,10 +230,12 @@ class TestMemObjectCollection(tests.TestCase):
         # 2: refcnt
         # 3: vtable*
         # 4: _table*
+        # 5: _index*
+        # 6: _type_index*
         # 3 4-byte int attributes
         # Note that on 64-bit platforms, alignment issues mean we will still
         # round to a multiple-of-8 bytes.
-        self.assertSizeOf(4+1024, moc, extra_size=_memobj_extra_size,
+        self.assertSizeOf(6+1024, moc, extra_size=_memobj_extra_size,
                           has_gc=False)
 
     def test__sizeof__one_item(self):
@@ -240,8 +250,9 @@ class TestMemObjectCollection(tests.TestCase):
         # 6: *parent_list
         # 7: ulong total_size
         # 8: *proxy
+        # 9: int index (padded to a full word)
         moc.add(0, 'foo', 100)
-        self.assertSizeOf(4+1024+8, moc, extra_size=_memobj_extra_size,
+        self.assertSizeOf(6+1024+9, moc, extra_size=_memobj_extra_size,
                           has_gc=False)
 
     def test__sizeof__with_reflists(self):
@@ -250,7 +261,7 @@ class TestMemObjectCollection(tests.TestCase):
         # ref-list allocates the number of entries + 1
         # Each _memobject also takes up
         moc.add(0, 'foo', 100, children=[1234], parent_list=[3456, 7890])
-        self.assertSizeOf(4+1024+8+2+3, moc, extra_size=_memobj_extra_size,
+        self.assertSizeOf(6+1024+9+2+3, moc, extra_size=_memobj_extra_size,
                           has_gc=False)
 
     def test__sizeof__with_dummy(self):
@@ -258,9 +269,520 @@ class TestMemObjectCollection(tests.TestCase):
         moc.add(0, 'foo', 100, children=[1234], parent_list=[3456, 7890])
         moc.add(1, 'foo', 100, children=[1234], parent_list=[3456, 7890])
         del moc[1]
-        self.assertSizeOf(4+1024+8+2+3, moc, extra_size=_memobj_extra_size,
+        self.assertSizeOf(6+1024+9+2+3, moc, extra_size=_memobj_extra_size,
                           has_gc=False)
 
+    def test_build_index(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100, children=[1024, 2048])
+        moc.add(1024, 'bar', 200, children=[0])
+        moc.add(512, 'baz', 300)
+        self.assertFalse(moc.has_index)
+        self.assertEqual(3, moc.build_index())
+        self.assertTrue(moc.has_index)
+        # The index is assigned in table order
+        self.assertEqual([0, 1024, 512],
+                         [moc.at_index(i).address for i in range(3)])
+        self.assertEqual(1, moc.index_of(1024))
+        self.assertEqual(1, moc.index_of(moc[1024]))
+        self.assertRaises(KeyError, moc.index_of, 2048)
+        self.assertRaises(IndexError, moc.at_index, 3)
+
+    def test_index_dropped_on_change(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100, children=[1024])
+        moc.add(1024, 'bar', 200)
+        moc.build_index()
+        moc[1024].size = 10
+        self.assertTrue(moc.has_index)
+        moc[0].children = [1024, 1024]
+        self.assertFalse(moc.has_index)
+        moc.build_index()
+        moc.add(512, 'baz', 300)
+        self.assertFalse(moc.has_index)
+        moc.build_index()
+        del moc[512]
+        self.assertFalse(moc.has_index)
+        # index_of rebuilds on demand
+        self.assertEqual(1, moc.index_of(1024))
+        self.assertTrue(moc.has_index)
+        moc.drop_index()
+        self.assertFalse(moc.has_index)
+
+    def test_build_type_index(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100)
+        moc.add(1024, 'bar', 200)
+        moc.add(512, 'foo', 300)
+        self.assertFalse(moc.has_type_index)
+        self.assertEqual(2, moc.build_type_index())
+        self.assertTrue(moc.has_type_index)
+        self.assertEqual([0, 512], sorted(moc.addresses_of_type('foo')))
+        self.assertEqual([1024], moc.addresses_of_type('bar'))
+        self.assertEqual([], moc.addresses_of_type('baz'))
+        moc.drop_type_index()
+        self.assertFalse(moc.has_type_index)
+
+    def test_addresses_of_type_without_index(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100)
+        moc.add(1024, 'bar', 200)
+        moc.add(512, 'foo', 300)
+        self.assertEqual([0, 512], sorted(moc.addresses_of_type('foo')))
+        self.assertEqual([], moc.addresses_of_type('baz'))
+
+    def test_type_index_maintained(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100)
+        moc.add(1024, 'bar', 200)
+        moc.build_type_index()
+        moc.add(512, 'foo', 300)
+        self.assertEqual([0, 512], sorted(moc.addresses_of_type('foo')))
+        # Changing the type moves the object, and changing it back doesn't
+        # list it twice
+        moc[0].type_str = 'bar'
+        self.assertEqual([512], moc.addresses_of_type('foo'))
+        self.assertEqual([0, 1024], sorted(moc.addresses_of_type('bar')))
+        moc[0].type_str = 'foo'
+        self.assertEqual([0, 512], sorted(moc.addresses_of_type('foo')))
+        del moc[512]
+        self.assertEqual([0], moc.addresses_of_type('foo'))
+        moc.add(512, 'foo', 300)
+        self.assertEqual([0, 512], sorted(moc.addresses_of_type('foo')))
+
+    def make_select_collection(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(1, 'dict', 5000, children=[2, 3], parent_list=[4])
+        moc.add(2, 'dict', 140, children=[3], parent_list=[1])
+        moc.add(3, 'str', 30, value='foobar', parent_list=[1, 2])
+        moc.add(4, 'module', 30, name='mymod', children=[1])
+        moc.add(5, 'int', 12, value=10)
+        return moc
+
+    def assertSelect(self, expected, moc, **kwargs):
+        self.assertEqual(expected,
+                         sorted([o.address for o in moc.select(**kwargs)]))
+
+    def test_select(self):
+        moc = self.make_select_collection()
+        self.assertSelect([1, 2, 3, 4, 5], moc)
+        self.assertSelect([1, 2], moc, type_str='dict')
+        self.assertSelect([1], moc, type_str='dict', size_gt=4096)
+        self.assertSelect([2, 3, 4, 5], moc, size_lt=4096)
+        self.assertSelect([3, 4], moc, size_gt=12, size_lt=140)
+        self.assertSelect([1, 2], moc, type_str='dict', num_parents=1)
+        self.assertSelect([4, 5], moc, num_parents=0)
+        self.assertSelect([3, 5], moc, num_children=0)
+        self.assertSelect([], moc, type_str='list')
+
+    def test_select_value_re(self):
+        moc = self.make_select_collection()
+        self.assertSelect([3], moc, value_re='oba')
+        # The name of a module is its value
+        self.assertSelect([3, 4], moc, value_re='^(foo|my)')
+        self.assertSelect([4], moc, value_re=re.compile('mod$'),
+                          type_str='module')
+        # Ints don't match a string pattern
+        self.assertSelect([], moc, value_re='10')
+
+    def test_select_type_index(self):
+        moc = self.make_select_collection()
+        moc.build_type_index()
+        self.assertSelect([1, 2], moc, type_str='dict')
+        self.assertSelect([1], moc, type_str='dict', size_gt=4096)
+        moc[1].type_str = 'MyClass'
+        self.assertSelect([2], moc, type_str='dict')
+        self.assertSelect([1], moc, type_str='MyClass')
+
+    def test_select_reuses_proxies(self):
+        moc = self.make_select_collection()
+        proxy = moc[1]
+        self.assertTrue(proxy is moc.select(type_str='dict', size_gt=4096)[0])
+
+    def make_instance_collection(self):
+        moc = _loader.MemObjectCollection()
+        # A new-style instance, its dict and its type
+        moc.add(1, 'MyClass', 32, children=[2, 3])
+        moc.add(2, 'dict', 140, children=[4, 5], parent_list=[1])
+        moc.add(3, 'type', 452, name='MyClass', parent_list=[1])
+        moc.add(4, 'str', 25, value='a', parent_list=[2])
+        moc.add(5, 'int', 12, value=1, parent_list=[2, 6])
+        # An old-style instance
+        moc.add(6, 'instance', 36, children=[7, 8])
+        moc.add(7, 'classobj', 48, name='OldStyle', parent_list=[6])
+        moc.add(8, 'dict', 140, children=[5], parent_list=[6])
+        # A module, and a tuple that looks like an instance but isn't one
+        moc.add(9, 'module', 28, name='mod', children=[10])
+        moc.add(10, 'dict', 140, children=[4], parent_list=[9])
+        moc.add(11, 'tuple', 28, children=[2, 3])
+        return moc
+
+    def test_collapse_instance_dicts(self):
+        moc = self.make_instance_collection()
+        self.assertEqual(3, moc.collapse_instance_dicts())
+        self.assertEqual([1, 3, 4, 5, 6, 7, 9, 11], sorted(moc.keys()))
+        self.assertEqual([4, 5, 3], moc[1].children)
+        self.assertEqual(172, moc[1].size)
+        self.assertEqual('MyClass', moc[1].type_str)
+        self.assertEqual([5, 7], moc[6].children)
+        self.assertEqual(176, moc[6].size)
+        self.assertEqual('OldStyle', moc[6].type_str)
+        self.assertEqual([4], moc[9].children)
+        self.assertEqual(168, moc[9].size)
+        self.assertEqual([2, 3], moc[11].children)
+        # Parents were not asked for
+        self.assertEqual([2, 6], moc[5].parents)
+
+    def test_collapse_instance_dicts_unnamed_classobj(self):
+        moc = self.make_instance_collection()
+        moc.add(12, 'instance', 36, children=[13, 14])
+        moc.add(13, 'classobj', 1000)
+        moc.add(14, 'dict', 140, children=[4, 5])
+        # The instance of the unnamed class is left alone, the rest are still
+        # collapsed
+        self.assertEqual(3, moc.collapse_instance_dicts())
+        self.assertEqual('instance', moc[12].type_str)
+        self.assertEqual([13, 14], moc[12].children)
+        self.assertEqual(36, moc[12].size)
+        self.assertTrue(14 in moc)
+        self.assertEqual('OldStyle', moc[6].type_str)
+        self.assertFalse(8 in moc)
+
+    def test_collapse_instance_dicts_update_parents(self):
+        moc = self.make_instance_collection()
+        moc.build_type_index()
+        moc.collapse_instance_dicts(update_parents=True)
+        self.assertEqual([1], moc[3].parents)
+        self.assertEqual([1, 9], moc[4].parents)
+        self.assertEqual([6, 1], moc[5].parents)
+        self.assertEqual([6], moc[7].parents)
+        self.assertEqual([6], moc.addresses_of_type('OldStyle'))
+        self.assertEqual([], moc.addresses_of_type('instance'))
+
+    def test_collapse_instance_dicts_max_parents(self):
+        moc = self.make_instance_collection()
+        moc.collapse_instance_dicts(update_parents=True, max_parents=1)
+        self.assertEqual([1], moc[4].parents)
+        self.assertEqual([6], moc[5].parents)
+
+    def make_expensive_collection(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(1, 'dict', 140, children=[2, 3, 4])
+        moc.add(2, 'module', 28, name='mod', children=[1])
+        moc.add(3, 'str', 25, value='a')
+        moc.add(4, 'type', 452, name='MyClass')
+        moc.add(5, 'function', 60, children=[6, 1, 2, 3])
+        moc.add(6, 'code', 100)
+        moc.add(7, '_LRUNode', 40, children=[8, 3, 9])
+        moc.add(8, '_LRUNode', 40, children=[7])
+        moc.add(9, 'frame', 80, children=[3])
+        return moc
+
+    def test_remove_expensive_references(self):
+        moc = self.make_expensive_collection()
+        self.assertEqual(4, moc.remove_expensive_references())
+        null_obj = moc[0]
+        self.assertEqual('<ex-reference>', null_obj.type_str)
+        self.assertEqual([3, 0], moc[1].children)
+        self.assertEqual([6, 3, 0], moc[5].children)
+        # Only the sideways references between nodes are removed
+        self.assertEqual([3, 9], moc[7].children)
+        self.assertEqual((), moc[8].children)
+        self.assertEqual([1], moc[2].children)
+        self.assertEqual([3], moc[9].children)
+
+    def test_remove_expensive_references_types(self):
+        moc = self.make_expensive_collection()
+        moc.remove_expensive_references(noref_types=('str',), lru_types=())
+        self.assertEqual([2, 4, 0], moc[1].children)
+        self.assertEqual([8, 9, 0], moc[7].children)
+        self.assertEqual([7], moc[8].children)
+
+    def test_remove_expensive_references_update_parents(self):
+        moc = self.make_expensive_collection()
+        moc.compute_parents()
+        self.assertEqual([1, 5], sorted(moc[2].parents))
+        moc.remove_expensive_references(update_parents=True)
+        self.assertEqual((), moc[2].parents)
+        # The module still references its dict, the function doesn't
+        self.assertEqual([2], moc[1].parents)
+        self.assertEqual((), moc[4].parents)
+        self.assertEqual([1, 5, 7, 9], sorted(moc[3].parents))
+        self.assertEqual((), moc[8].parents)
+        self.assertEqual([1, 5], sorted(moc[0].parents))
+
+    def test_summarize_types(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(1, 'foo', 100, children=[2, 3])
+        moc.add(2, 'bar', 0)
+        moc.add(3, 'foo', 300, children=[4])
+        moc.add(4, 'baz', 10)
+        moc.add(5, 'foo', 300)
+        self.assertEqual([('foo', 3, 700, 190000, 300, 3),
+                          ('bar', 1, 0, 0, 0, None),
+                          ('baz', 1, 10, 100, 10, 4),
+                         ], moc.summarize_types())
+
+    def test_summarize_types_reachable(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(1, 'foo', 100, children=[2, 3])
+        moc.add(2, 'bar', 0)
+        moc.add(3, 'foo', 300, children=[4])
+        moc.add(4, 'baz', 10)
+        moc.add(5, 'foo', 300)
+        self.assertEqual([('foo', 2, 400, 100000, 300, 3),
+                          ('baz', 1, 10, 100, 10, 4),
+                          ('bar', 1, 0, 0, 0, None),
+                         ], moc.summarize_types(1))
+        self.assertTrue(moc.has_index)
+        self.assertEqual([('foo', 1, 100, 10000, 100, 1),
+                          ('bar', 1, 0, 0, 0, None),
+                         ], moc.summarize_types(moc[1], excluding=[3]))
+        self.assertRaises(KeyError, moc.summarize_types, 6)
+
+    def test_to_arrays(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100, children=[1024, 2048], total_size=400)
+        moc.add(1024, 'bar', 200, children=[0, 512])
+        moc.add(512, 'foo', 300)
+        arrays = moc.to_arrays()
+        # In dense index order, which is table order
+        self.assertEqual([0, 1024, 512], list(arrays['addresses']))
+        self.assertEqual(['foo', 'bar'], arrays['type_table'])
+        self.assertEqual([0, 1, 0], list(arrays['type_ids']))
+        self.assertEqual([100, 200, 300], list(arrays['sizes']))
+        self.assertEqual([400, 0, 0], list(arrays['total_sizes']))
+        # 2048 isn't in the collection
+        self.assertEqual([0, 1, 3, 3], list(arrays['child_offsets']))
+        self.assertEqual([1, 0, 2], list(arrays['child_indices']))
+        self.assertEqual([0, 1, 2, 3], list(arrays['parent_offsets']))
+        self.assertEqual([1, 0, 1], list(arrays['parent_indices']))
+        for name in ('addresses', 'sizes', 'total_sizes', 'child_offsets',
+                     'parent_offsets'):
+            self.assertEqual(8, memoryview(arrays[name]).itemsize)
+        for name in ('type_ids', 'child_indices', 'parent_indices'):
+            self.assertEqual(4, memoryview(arrays[name]).itemsize)
+
+    def test_to_arrays_survives_changes(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100, children=[1024])
+        moc.add(1024, 'bar', 200)
+        arrays = moc.to_arrays()
+        moc.add(512, 'baz', 300)
+        self.assertFalse(moc.has_index)
+        self.assertEqual([0, 1, 1], list(arrays['child_offsets']))
+        self.assertEqual([1], list(arrays['child_indices']))
+
+    def test_to_arrays_empty(self):
+        arrays = _loader.MemObjectCollection().to_arrays()
+        self.assertEqual([], list(arrays['addresses']))
+        self.assertEqual([0], list(arrays['child_offsets']))
+        self.assertEqual([], list(arrays['child_indices']))
+
+    @unittest.skipUnless(numpy is not None, 'numpy is not available')
+    def test_to_arrays_numpy(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100, children=[1024])
+        moc.add(1024, 'bar', 200, children=[0, 512])
+        moc.add(512, 'foo', 300)
+        arrays = moc.to_arrays()
+        sizes = numpy.frombuffer(arrays['sizes'], dtype=numpy.int64)
+        self.assertEqual(600, sizes.sum())
+        offsets = numpy.frombuffer(arrays['child_offsets'], dtype=numpy.int64)
+        self.assertEqual([1, 2, 0], list(numpy.diff(offsets)))
+
+    def test__sizeof__with_type_index(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100)
+        moc.build_type_index()
+        # The dict and lists are python objects, found through tp_traverse
+        self.assertSizeOf(6+1024+9, moc, extra_size=_memobj_extra_size,
+                          has_gc=False)
+
+    def test_compute_parents(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100, children=[1024, 512, 1024, 999],
+                parent_list=[7])
+        moc.add(1024, 'bar', 200, children=[0, 512])
+        moc.add(512, 'baz', 300, children=[512])
+        moc.compute_parents()
+        self.assertEqual([1024], moc[0].parents)
+        # Repeated references only show up once
+        self.assertEqual([0], moc[1024].parents)
+        self.assertEqual([0, 1024, 512], moc[512].parents)
+        # We don't leave the temporary index behind
+        self.assertFalse(moc.has_index)
+        moc.build_index()
+        moc.compute_parents(max_parents=2)
+        self.assertEqual([0, 1024], moc[512].parents)
+        self.assertTrue(moc.has_index)
+        moc.compute_parents(max_parents=0)
+        self.assertEqual((), moc[512].parents)
+
+    def make_dominator_collection(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(1, 'root', 10, children=[2, 3])
+        moc.add(2, 'left', 20, children=[4])
+        moc.add(3, 'right', 30, children=[4])
+        moc.add(4, 'shared', 40, children=[5])
+        moc.add(5, 'leaf', 50, children=[4])
+        # An unreferenced cycle
+        moc.add(6, 'cycle', 60, children=[7])
+        moc.add(7, 'cycle', 70, children=[6])
+        return moc
+
+    def test_compute_dominators(self):
+        moc = self.make_dominator_collection()
+        self.assertEqual(None, moc[1].retained_size)
+        self.assertEqual(7, moc.compute_dominators())
+        self.assertTrue(moc.has_index)
+        self.assertEqual(None, moc[1].immediate_dominator)
+        self.assertEqual(1, moc[2].immediate_dominator.address)
+        self.assertEqual(1, moc[3].immediate_dominator.address)
+        self.assertEqual(1, moc[4].immediate_dominator.address)
+        self.assertEqual(4, moc[5].immediate_dominator.address)
+        self.assertEqual(150, moc[1].retained_size)
+        self.assertEqual(20, moc[2].retained_size)
+        self.assertEqual(30, moc[3].retained_size)
+        self.assertEqual(90, moc[4].retained_size)
+        self.assertEqual(50, moc[5].retained_size)
+        # One member of the cycle is picked as its root, and retains the other
+        self.assertEqual(130, max(moc[6].retained_size, moc[7].retained_size))
+        # Changing the collection throws away the results
+        moc.add(8, 'new', 80)
+        self.assertEqual(None, moc[1].retained_size)
+        self.assertEqual(None, moc[2].immediate_dominator)
+
+    def test_compute_dominators_removed(self):
+        moc = self.make_dominator_collection()
+        moc.compute_dominators()
+        removed = moc[4]
+        del moc[4]
+        del moc[5]
+        self.assertEqual(5, moc.compute_dominators())
+        # The removed object is not part of the new index
+        self.assertEqual(None, removed.retained_size)
+        self.assertEqual(None, removed.immediate_dominator)
+        self.assertEqual(60, moc[1].retained_size)
+
+    def test_dominators_standalone(self):
+        # A standalone proxy has no collection, so no dominators
+        obj = _loader._MemObjectProxy_from_args(1, 'int', 4)
+        self.assertEqual(None, obj.retained_size)
+        self.assertEqual(None, obj.immediate_dominator)
+
+    def test_compute_dominators_roots(self):
+        moc = self.make_dominator_collection()
+        self.assertEqual(3, moc.compute_dominators(roots=[2]))
+        self.assertEqual(None, moc[1].retained_size)
+        self.assertEqual(None, moc[6].retained_size)
+        self.assertEqual(110, moc[2].retained_size)
+        self.assertEqual(2, moc[4].immediate_dominator.address)
+        # Reachable from 2 roots, so nothing but the virtual root dominates it
+        self.assertEqual(4, moc.compute_dominators(roots=[moc[2], 3]))
+        self.assertEqual(None, moc[4].immediate_dominator)
+        self.assertEqual(20, moc[2].retained_size)
+        self.assertEqual(90, moc[4].retained_size)
+        # A root that can be reached from another root is still a root
+        self.assertEqual(5, moc.compute_dominators(roots=[1, 4]))
+        self.assertEqual(None, moc[4].immediate_dominator)
+        self.assertEqual(60, moc[1].retained_size)
+        self.assertRaises(KeyError, moc.compute_dominators, roots=[99])
+
+    def test_summarize_retained(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(1, 'dict', 10, children=[2, 4])
+        moc.add(2, 'dict', 20, children=[3])
+        moc.add(3, 'str', 30)
+        moc.add(4, 'str', 40)
+        self.assertFalse(moc.has_dominators)
+        self.assertRaises(ValueError, moc.summarize_retained)
+        moc.compute_dominators()
+        self.assertTrue(moc.has_dominators)
+        types, top, total_size = moc.summarize_retained(top=2)
+        # The inner dict is owned by the outer one, so it isn't counted again
+        self.assertEqual([('dict', 1, 100, 100, 1), ('str', 2, 70, 40, 4)],
+                         sorted(types))
+        self.assertEqual([(100, 1), (40, 4)], top)
+        self.assertEqual(100, total_size)
+        types, top, total_size = moc.summarize_retained(top=0)
+        self.assertEqual([], top)
+
+    def test_strongly_connected_components(self):
+        moc = self.make_dominator_collection()
+        moc.add(8, 'self', 80, children=[8, 1])
+        self.assertEqual(None, moc[1].component_id)
+        cycles = moc.strongly_connected_components()
+        # 8 objects, but 2 of the components have 2 objects each
+        self.assertEqual(6, len(set([moc[i].component_id
+                                     for i in range(1, 9)])))
+        self.assertEqual(moc[4].component_id, moc[5].component_id)
+        self.assertEqual(moc[6].component_id, moc[7].component_id)
+        self.assertEqual(sorted([(moc[4].component_id, 2, 90),
+                                 (moc[6].component_id, 2, 130),
+                                 (moc[8].component_id, 1, 80)]),
+                         sorted(cycles))
+        self.assertEqual([4, 5], sorted(moc.component_members(
+            moc[4].component_id)))
+        self.assertEqual([8], moc.component_members(moc[8].component_id))
+        self.assertRaises(KeyError, moc.component_members, 6)
+        # Referenced components are completed (and numbered) first
+        self.assertTrue(moc[4].component_id < moc[2].component_id
+                        < moc[1].component_id < moc[8].component_id)
+        # A removed object is not part of the new components
+        removed = moc[2]
+        del moc[2]
+        moc.strongly_connected_components()
+        self.assertEqual(None, removed.component_id)
+        self.assertEqual([4, 5], sorted(moc.component_members(
+            moc[4].component_id)))
+        moc.add(9, 'new', 90)
+        self.assertEqual(None, moc[4].component_id)
+        self.assertRaises(ValueError, moc.component_members, 0)
+
+    def test_component_id_standalone(self):
+        obj = _loader._MemObjectProxy_from_args(1, 'int', 4)
+        self.assertEqual(None, obj.component_id)
+
+    def test_path_to_root(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(1, 'module', 10, children=[2, 3])
+        moc.add(2, 'dict', 20, children=[4])
+        moc.add(3, 'dict', 30, children=[5])
+        moc.add(4, 'list', 40, children=[5, 6])
+        moc.add(5, 'tuple', 50, children=[6])
+        moc.add(6, 'str', 60)
+        moc.add(7, 'frame', 70, children=[5])
+        moc.add(8, 'cell', 80, children=[7])
+        # 7 is a frame, so it's a root even though 8 refers to it
+        self.assertEqual([[7, 5, 6]], moc.path_to_root(6))
+        # We don't look past a root, so there is no path from 8
+        self.assertEqual([[7, 5, 6], [1, 2, 4, 6]],
+                         moc.path_to_root(6, k=3))
+        self.assertEqual([[1, 2, 4, 6]],
+                         moc.path_to_root(6, excluding=[7]))
+        self.assertEqual([[8, 7, 5, 6]],
+                         moc.path_to_root(6, roots=[8]))
+        self.assertEqual([[2, 4, 6]], moc.path_to_root(6, roots=[8, 2]))
+        self.assertEqual([[1, 2, 4, 5], [8, 7, 5]],
+                         sorted(moc.path_to_root(5, roots=[8, 1], k=2,
+                                                 excluding=[3])))
+        self.assertEqual([[6]], moc.path_to_root(moc[6], roots=[6]))
+        self.assertEqual([], moc.path_to_root(1, roots=[6]))
+        self.assertRaises(KeyError, moc.path_to_root, 99)
+
+    def test__sizeof__with_index(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(0, 'foo', 100, children=[1234], parent_list=[3456, 7890])
+        moc.build_index()
+        # The index itself holds num_objs, objs*, child_offsets*,
+        # child_indices*, parent_offsets*, parent_indices*, dominators*,
+        # retained_sizes*, components*, num_components, component_offsets*,
+        # component_members*, then one object pointer, 2 offsets and no
+        # child indices, since 1234 isn't in the collection
+        self.assertSizeOf(6+1024+9+2+3+12+1+2, moc,
+                          extra_size=_memobj_extra_size, has_gc=False)
+
     def test_traverse_empty(self):
         # With nothing present, we return no referents
         moc = _loader.MemObjectCollection()
@@ -279,6 +801,86 @@ class TestMemObjectCollection(tests.TestCase):
         self.assertEqual([1, 'foo', None, 2, 'bar', 'test val', 8, 9, 10, 11],
                          _scanner.get_referents(moc))
 
+    def test_traverse_type_index(self):
+        moc = _loader.MemObjectCollection()
+        moc.add(1234, 'foo', 100)
+        moc.build_type_index()
+        self.assertEqual([1234, 'foo', None, {'foo': [1234]}],
+                         _scanner.get_referents(moc))
+
+
+class Test_MemObjectCursor(tests.TestCase):
+
+    def setUp(self):
+        super(Test_MemObjectCursor, self).setUp()
+        self.moc = _loader.MemObjectCollection()
+        self.moc.add(1024, 'bar', 200, children=[0, 255], parent_list=[0])
+        self.moc.add(0, 'foo', 100, children=[1024], parent_list=[1024],
+                     value='a value')
+        self.moc.add(255, 'baz', 300, parent_list=[1024])
+
+    def test_walk(self):
+        seen = []
+        for cursor in self.moc.cursor():
+            seen.append((cursor.address, cursor.type_str, cursor.size,
+                         len(cursor), cursor.num_parents, cursor.value))
+        # In table order
+        self.assertEqual([(1024, 'bar', 200, 2, 1, None),
+                          (0, 'foo', 100, 1, 1, 'a value'),
+                          (255, 'baz', 300, 0, 1, None),
+                         ], seen)
+
+    def test_advance(self):
+        cursor = self.moc.cursor()
+        self.assertRaises(ValueError, getattr, cursor, 'address')
+        self.assertTrue(cursor.advance())
+        self.assertEqual(1024, cursor.address)
+        self.assertTrue(cursor.advance())
+        self.assertTrue(cursor.advance())
+        self.assertEqual(255, cursor.address)
+        self.assertFalse(cursor.advance())
+        self.assertRaises(ValueError, len, cursor)
+        self.assertFalse(cursor.advance())
+
+    def test_children_and_parents(self):
+        cursor = self.moc.cursor()
+        cursor.advance()
+        self.assertEqual(1024, cursor.address)
+        self.assertEqual([0, 255], cursor.children)
+        self.assertEqual(0, cursor.child(0))
+        self.assertEqual(255, cursor.child(1))
+        self.assertRaises(IndexError, cursor.child, 2)
+        self.assertRaises(IndexError, cursor.child, -1)
+        self.assertEqual([0], cursor.parents)
+        self.assertEqual(0, cursor.parent(0))
+        self.assertRaises(IndexError, cursor.parent, 1)
+
+    def test_flyweight(self):
+        # Every step yields the same object
+        cursor = self.moc.cursor()
+        self.assertEqual([cursor] * 3, [c for c in cursor])
+
+    def test_proxy(self):
+        proxy = self.moc[1024]
+        cursor = self.moc.cursor()
+        cursor.advance()
+        self.assertTrue(proxy is cursor.proxy())
+        cursor.advance()
+        self.assertEqual(0, cursor.proxy().address)
+
+    def test_sees_changes(self):
+        cursor = self.moc.cursor()
+        cursor.advance()
+        self.moc[1024].size = 10
+        self.assertEqual(10, cursor.size)
+
+    def test_changed_size(self):
+        cursor = self.moc.cursor()
+        cursor.advance()
+        self.moc.add(512, 'qux', 10)
+        self.assertRaises(RuntimeError, getattr, cursor, 'address')
+        self.assertRaises(RuntimeError, cursor.advance)
+
 
 class Test_MemObjectProxy(tests.TestCase):
 
@@ -615,7 +1217,8 @@ class Test_MemObjectProxy(tests.TestCase):
         # 6: RefList *parent_list
         # 7: unsigned long total_size
         # 8: PyObject *proxy
-        self.assertSizeOf(5+8, mop, has_gc=True)
+        # 9: int index (padded to a full word)
+        self.assertSizeOf(5+9, mop, has_gc=True)
 
     def test_traverse(self):
         # When a Proxied object is removed from its Collection, it becomes
@@ -645,6 +1248,14 @@ class Test_MemObjectProxy(tests.TestCase):
         self.assertEqual(1234+4567+100, obj.compute_total_size())
         self.assertEqual(1234+4567, obj.compute_total_size(excluding=[0]))
 
+    def test_compute_total_size_indexed(self):
+        self.moc.add(1, 'test', 1234, children=[0, 999])
+        obj = self.moc.add(2, 'other', 4567, children=[1])
+        self.moc.build_index()
+        self.assertEqual(1234+4567+100, obj.compute_total_size())
+        self.assertEqual(1234+4567+100, obj.total_size)
+        self.assertEqual(1234+4567, obj.compute_total_size(excluding=[0]))
+
     def test_all(self):
         self.moc.add(1, 'foo', 1234, children=[0])
         obj = self.moc.add(2, 'other', 4567, children=[1])
@@ -655,6 +1266,20 @@ class Test_MemObjectProxy(tests.TestCase):
         self.assertEqual([],
                          [o.address for o in obj.all('foo', excluding=[1])])
 
+    def test_all_indexed(self):
+        self.moc.add(1, 'foo', 1234, children=[0, 999])
+        obj = self.moc.add(2, 'other', 4567, children=[1])
+        self.moc.add(3, 'foo', 10)
+        self.moc.build_index()
+        self.assertEqual([1, 0], [o.address for o in obj.all('foo')])
+        self.assertEqual([1],
+                         [o.address for o in obj.all('foo', excluding=[0])])
+        self.moc.build_type_index()
+        self.assertEqual([1, 0], [o.address for o in obj.all('foo')])
+        self.assertEqual([1],
+                         [o.address for o in obj.all('foo', excluding=[0])])
+        self.assertEqual([], [o.address for o in obj.all('bar')])
+
 
 class Test_MemObjectProxyIterRecursiveRefs(tests.TestCase):
 
@@ -713,3 +1338,22 @@ class Test_MemObjectProxyIterRecursiveRefs(tests.TestCase):
         self.assertIterRecursiveRefs([], self.moc[1024], excluding=[1024])
         obj = self.moc.add(1, '1', 1234, children=[1024])
         self.assertIterRecursiveRefs([], obj, excluding=[1])
+
+
+class Test_MemObjectProxyIterRecursiveRefsIndexed(
+        Test_MemObjectProxyIterRecursiveRefs):
+    """The same walks, but over the dense index rather than the table."""
+
+    def assertIterRecursiveRefs(self, addresses, obj, excluding=None):
+        self.moc.build_index()
+        super(Test_MemObjectProxyIterRecursiveRefsIndexed,
+              self).assertIterRecursiveRefs(addresses, obj,
+                                            excluding=excluding)
+
+    def test_changed_during_iteration(self):
+        obj = self.moc.add(1, 'test', 1234, children=[1024, 0])
+        self.moc.build_index()
+        iterator = obj.iter_recursive_refs()
+        self.assertEqual(1, next(iterator).address)
+        self.moc.add(2, 'test', 1234)
+        self.assertRaises(RuntimeError, next, iterator)
@@ -0,0 +1,139 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare two dump files."""
+
+import os
+import tempfile
+
+from meliae import (
+    diff,
+    tests,
+    )
+
+
+_old_dump = [
+b'[\n',
+b'{"address": 1, "type": "tuple", "size": 20, "len": 2, "refs": [2, 3]},\n',
+b'{"address": 2, "type": "dict", "size": 124, "len": 1, "refs": [4, 5]},\n',
+b'{"address": 3, "type": "list", "size": 44, "len": 1, "refs": [4]},\n',
+b'{"address": 4, "type": "int", "size": 12, "value": 1, "refs": []},\n',
+b'{"address": 4, "type": "int", "size": 12, "value": 1, "refs": []},\n',
+b'{"address": 5, "type": "str", "size": 25, "value": "a", "refs": []}\n',
+b']\n',
+]
+
+# 3 grew, 5 was freed, 6 and 7 are new, and 4 was reused by a str
+_new_dump = [
+b'{"address": 1, "type": "tuple", "size": 20, "len": 2, "refs": [2, 3]}\n',
+b'{"address": 2, "type": "dict", "size": 124, "len": 1, "refs": [4, 7]}\n',
+b'{"address": 3, "type": "list", "size": 76, "len": 3, "refs": [4, 6]}\n',
+b'{"address": 4, "type": "str", "size": 26, "value": "b", "refs": []}\n',
+b'{"address": 6, "type": "int", "size": 12, "value": 2, "refs": []}\n',
+b'{"address": 7, "type": "str", "size": 27, "value": "cd", "refs": []}\n',
+]
+
+
+class TestIterHeaders(tests.TestCase):
+
+    def test_iter_headers(self):
+        self.assertEqual([(1, 'tuple', 20), (2, 'dict', 124), (3, 'list', 44),
+                          (4, 'int', 12), (4, 'int', 12), (5, 'str', 25)],
+                         list(diff.iter_headers(_old_dump)))
+
+    def test_iter_headers_with_length(self):
+        self.assertEqual([(1, 'tuple', 20, 2), (3, 'list', 76, 3),
+                          (4, 'str', 26, None)],
+                         list(diff.iter_headers([_new_dump[0], _new_dump[2],
+                                                 _new_dump[3]],
+                                                with_length=True)))
+
+
+class TestDiffDumps(tests.TestCase):
+
+    def assertDeltas(self, expected, result):
+        self.assertEqual(expected,
+            sorted((d.type_str, d.old_count, d.old_size, d.new_count,
+                    d.new_size) for d in result.type_deltas.values()))
+
+    def assertDiff(self, result):
+        self.assertDeltas([('dict', 1, 124, 1, 124),
+                           ('int', 1, 12, 1, 12),
+                           ('list', 1, 44, 1, 76),
+                           ('str', 1, 25, 2, 53),
+                           ('tuple', 1, 20, 1, 20),
+                          ], result)
+        # The int at 4 was freed, and a new str took its address
+        self.assertEqual(3, result.num_new)
+        self.assertEqual(2, result.num_freed)
+        self.assertEqual([(4, 'str', 26), (6, 'int', 12), (7, 'str', 27)],
+                         sorted(result.new_objects))
+        self.assertEqual([(4, 'int', 12), (5, 'str', 25)],
+                         result.freed_objects)
+        self.assertEqual(['list', 'str'],
+                         [d.type_str for d in result.by_size()][:2])
+        self.assertEqual('str', result.by_count()[0].type_str)
+
+    def test_sorted(self):
+        self.assertDiff(diff.diff_dumps(_old_dump, _new_dump,
+                                        assume_sorted=True))
+
+    def test_unsorted(self):
+        self.assertDiff(diff.diff_dumps(_old_dump, list(reversed(_new_dump))))
+
+    def test_sorted_detects_unsorted(self):
+        self.assertRaises(ValueError, diff.diff_dumps, _old_dump,
+                          list(reversed(_new_dump)), assume_sorted=True)
+
+    def test_one_shot_old_source(self):
+        self.assertRaises(TypeError, diff.diff_dumps, iter(_old_dump),
+                          _new_dump)
+        # A single pass is enough for sorted dumps
+        self.assertDiff(diff.diff_dumps(iter(_old_dump), iter(_new_dump),
+                                        assume_sorted=True))
+
+    def test_max_listed(self):
+        result = diff.diff_dumps(_old_dump, _new_dump, max_listed=1)
+        self.assertEqual(3, result.num_new)
+        self.assertEqual(1, len(result.new_objects))
+        self.assertEqual(1, len(result.freed_objects))
+
+    def test_files(self):
+        fd, old_name = tempfile.mkstemp(prefix='meliae-')
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.writelines(_old_dump)
+            f.close()
+            fd, new_name = tempfile.mkstemp(prefix='meliae-')
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.writelines(_new_dump)
+                f.close()
+                self.assertDiff(diff.diff_dumps(old_name, new_name))
+                self.assertDiff(diff.diff_dumps(old_name, new_name,
+                                                assume_sorted=True))
+            finally:
+                os.remove(new_name)
+        finally:
+            f.close()
+            os.remove(old_name)
+
+    def test_repr(self):
+        result = diff.diff_dumps(_old_dump, _new_dump)
+        self.assertEqual(
+            '3 new objects, 2 freed objects, +60 bytes (225 => 285)\n'
+            ' Index     Count        Size Kind\n'
+            '     0        +0         +32 list\n'
+            '     1        +1         +28 str',
+            repr(result))
@@ -0,0 +1,165 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Open plain and compressed files."""
+
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from meliae import (
+    files,
+    tests,
+    )
+
+
+_lines = [b'{"address": %d, "type": "int", "size": 12, "refs": []}\n' % (i,)
+          for i in range(20000)]
+_content = b''.join(_lines)
+
+
+def _gzip(content):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+
+class _NoEOFDecompressor(object):
+    """A gzip decompressor without .eof, like python 2.7's."""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        return self._decompressor.flush()
+
+    @property
+    def unused_data(self):
+        return self._decompressor.unused_data
+
+
+class TestOpenFile(tests.TestCase):
+
+    def setUp(self):
+        super(TestOpenFile, self).setUp()
+        self.tempdir = tempfile.mkdtemp(prefix='meliae-')
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def write_file(self, content):
+        name = os.path.join(self.tempdir, 'dump')
+        f = open(name, 'wb')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+        return name
+
+    def open_file(self, content):
+        source, cleanup = files.open_file(self.write_file(content))
+        if cleanup is None:
+            cleanup = source.close
+        self.addCleanup(cleanup)
+        return source
+
+    def assertLines(self, content):
+        self.assertEqual(_lines, list(self.open_file(content)))
+
+    def test_plain(self):
+        source, cleanup = files.open_file(self.write_file(_content))
+        self.assertEqual(None, cleanup)
+        try:
+            self.assertEqual(_lines, list(source))
+        finally:
+            source.close()
+
+    def test_gzip(self):
+        self.assertLines(_gzip(_content))
+
+    def test_gzip_module(self):
+        name = os.path.join(self.tempdir, 'dump.gz')
+        f = gzip.GzipFile(name, 'wb')
+        f.write(_content)
+        f.close()
+        source, cleanup = files.open_file(name)
+        try:
+            self.assertEqual(_lines, list(source))
+        finally:
+            cleanup()
+
+    def test_gzip_members(self):
+        half = len(_content) // 2
+        self.assertLines(_gzip(_content[:half]) + _gzip(_content[half:]))
+
+    def test_bz2(self):
+        self.assertLines(bz2.compress(_content))
+
+    def test_xz(self):
+        if files.lzma is None:
+            raise unittest.SkipTest('lzma is not available')
+        self.assertLines(files.lzma.compress(_content))
+
+    def test_without_eof(self):
+        half = len(_content) // 2
+        name = self.write_file(_gzip(_content[:half]) + _gzip(_content[half:]))
+        source = files._DecompressedStream(open(name, 'rb'),
+                                           _NoEOFDecompressor)
+        self.addCleanup(source.close)
+        self.assertEqual(_lines, list(source))
+
+    def test_read(self):
+        source = self.open_file(_gzip(_content))
+        self.assertEqual(_content[:10], source.read(10))
+        self.assertEqual(_content[10:100000], source.read(99990))
+        self.assertEqual(_content[100000:], source.read())
+        self.assertEqual(b'', source.read(10))
+
+    def test_no_trailing_newline(self):
+        self.assertEqual([b'a\n', b'b'],
+                         list(self.open_file(_gzip(b'a\nb'))))
+
+    def test_truncated(self):
+        source = self.open_file(_gzip(_content)[:-100])
+        self.assertRaises(EOFError, list, source)
+
+    def test_corrupt(self):
+        data = _gzip(_content)
+        source = self.open_file(data[:100] + b'\xff' * 100 + data[200:])
+        self.assertRaises(zlib.error, list, source)
+
+    def test_close_early(self):
+        source, cleanup = files.open_file(self.write_file(_gzip(_content * 10)))
+        self.assertEqual(_lines[0], next(iter(source)))
+        # The reader thread is blocked on the full queue, and must stop
+        cleanup()
+        self.assertFalse(source._thread.is_alive())
+
+    def test_detect_format(self):
+        self.assertEqual('gzip', files.detect_format(b'\x1f\x8b\x08')[0])
+        self.assertEqual('bz2', files.detect_format(b'BZh91')[0])
+        self.assertEqual('xz', files.detect_format(b'\xfd7zXZ\x00')[0])
+        self.assertEqual('zstd', files.detect_format(b'\x28\xb5\x2f\xfd')[0])
+        self.assertEqual('lz4', files.detect_format(b'\x04\x22\x4d\x18')[0])
+        self.assertEqual((None, None), files.detect_format(b'[\n{"addr'))
+
+    def test_missing_module(self):
+        if files.zstandard is not None:
+            raise unittest.SkipTest('zstandard is installed')
+        name = self.write_file(b'\x28\xb5\x2f\xfd' + b'\x00' * 10)
+        self.assertRaises(ValueError, files.open_file, name)
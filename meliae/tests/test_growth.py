@@ -0,0 +1,92 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Follow memory growth over several dumps."""
+
+from meliae import (
+    growth,
+    tests,
+    )
+
+
+def _dump(list_len, dict_len, num_strs):
+    lines = [
+        b'{"address": 1, "type": "list", "size": %d, "len": %d, "refs": []}'
+        % (36 + 4 * list_len, list_len),
+        b'{"address": 2, "type": "dict", "size": %d, "len": %d, "refs": []}'
+        % (100 * dict_len, dict_len),
+        ]
+    for i in range(num_strs):
+        lines.append(b'{"address": %d, "type": "str", "size": 30'
+                     b', "value": "x", "refs": []}' % (100 + i,))
+    # Duplicates are ignored
+    lines.append(lines[0])
+    return lines
+
+
+class TestGrowthSeries(tests.TestCase):
+
+    def make_series(self):
+        series = growth.GrowthSeries(min_length=2)
+        series.add_dump(_dump(2, 5, 1))
+        series.add_dump(_dump(4, 3, 3))
+        series.add_dump(_dump(4, 6, 5))
+        series.add_dump(_dump(10, 8, 7))
+        return series
+
+    def test_type_series(self):
+        series = self.make_series()
+        self.assertEqual([0, 1, 2, 3], series.times)
+        self.assertEqual([1, 3, 5, 7], list(series.types['str'].counts))
+        self.assertEqual([30, 90, 150, 210], list(series.types['str'].sizes))
+        self.assertEqual([1, 1, 1, 1], list(series.types['list'].counts))
+        self.assertEqual([44, 52, 52, 76], list(series.types['list'].sizes))
+
+    def test_rank_growth(self):
+        series = self.make_series()
+        self.assertEqual([(120.0, 'dict'), (60.0, 'str'), (9.6, 'list')],
+                         [(round(slope, 3), s.type_str)
+                          for slope, s in series.rank_growth()])
+        # The dict shrank at one point
+        self.assertEqual(['str', 'list'],
+                         [s.type_str for slope, s
+                          in series.rank_growth(monotonic=True)])
+        self.assertEqual(['str'], [s.type_str for slope, s
+                                   in series.rank_growth(by='count')])
+        self.assertTrue(series.types['list'].is_monotonic())
+        self.assertFalse(series.types['dict'].is_monotonic())
+
+    def test_growing_containers(self):
+        series = self.make_series()
+        # The dict shrank in the 2nd snapshot, so it is only followed from
+        # there on.
+        containers = series.growing_containers(min_snapshots=3)
+        self.assertEqual([(1, 'list', 0, 2, 10), (2, 'dict', 1, 3, 8)],
+                         [(c.address, c.type_str, c.first_snapshot,
+                           c.first_length, c.length) for c in containers])
+        self.assertEqual([1], [c.address for c
+                               in series.growing_containers(min_snapshots=4)])
+
+    def test_add_histogram(self):
+        series = growth.GrowthSeries()
+        series.add_histogram({'str': (1, 30)}, when=10)
+        series.add_dump(_dump(2, 5, 2), when=20)
+        series.add_histogram({'str': (5, 150), 'int': (1, 12)}, when=40)
+        self.assertEqual([10, 20, 40], series.times)
+        self.assertEqual([1, 2, 5], list(series.types['str'].counts))
+        self.assertEqual([0, 0, 12], list(series.types['int'].sizes))
+        self.assertEqual([], series.growing_containers(min_snapshots=1))
+        slope, str_series = series.rank_growth()[0]
+        self.assertEqual('str', str_series.type_str)
+        self.assertAlmostEqual(1900 / 466.667, slope, 3)
@@ -0,0 +1,154 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Look up the objects of a dump on demand."""
+
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+
+from meliae import (
+    lazyload,
+    tests,
+    )
+from meliae.tests import (
+    test_loader,
+    test_progress,
+    )
+
+
+class TestLazyLoad(tests.TestCase):
+
+    def setUp(self):
+        super(TestLazyLoad, self).setUp()
+        self.tempdir = tempfile.mkdtemp(prefix='meliae-')
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.dump_name = os.path.join(self.tempdir, 'dump.json')
+        # A json list, with one object dumped twice
+        lines = ([b'[\n'] + [line + b',\n'
+                             for line in test_loader._example_dump]
+                 + [test_loader._example_dump[2] + b'\n', b']\n'])
+        f = open(self.dump_name, 'wb')
+        try:
+            f.writelines(lines)
+        finally:
+            f.close()
+
+    def open_dump(self, **kwargs):
+        om = lazyload.open_dump(self.dump_name, **kwargs)
+        self.addCleanup(om.close)
+        return om
+
+    def test_lookup(self):
+        om = self.open_dump()
+        self.assertEqual(9, len(om))
+        self.assertEqual(list(range(1, 10)), list(om.addresses))
+        self.assertTrue(7 in om)
+        self.assertFalse(10 in om)
+        obj = om[7]
+        self.assertEqual(7, obj.address)
+        self.assertEqual('tuple', obj.type_str)
+        self.assertEqual(20, obj.size)
+        self.assertEqual([4, 5, 8], obj.children)
+        self.assertEqual(1, om[5].value)
+        self.assertEqual([3, 4, 5, 8], om[3].children)
+        self.assertRaises(KeyError, om.__getitem__, 10)
+        self.assertRaises(KeyError, om.__getitem__, 0)
+
+    def test_regex(self):
+        om = self.open_dump(using_json=False)
+        self.assertEqual([4, 5, 8], om[7].children)
+        self.assertEqual(b'mymod', om[9].value)
+
+    def test_cache(self):
+        om = self.open_dump(cache_size=2)
+        obj = om[1]
+        self.assertTrue(obj is om[1])
+        om[2]
+        om[1]
+        om[3]
+        # 2 was the least recently used
+        self.assertEqual([1, 3], list(om._cache))
+        self.assertTrue(obj is om[1])
+
+    def test_no_cache(self):
+        om = self.open_dump(cache_size=0)
+        self.assertEqual([4, 5, 8], om[7].children)
+        self.assertFalse(om[7] is om[7])
+        self.assertEqual(0, len(om._cache))
+
+    def test_reporter(self):
+        reporter = test_progress.RecordingReporter()
+        self.open_dump(reporter=reporter)
+        self.assertEqual(('start', 'indexing'), reporter.events[0])
+        self.assertEqual(('finish', 'indexing', 9), reporter.events[-1])
+        # The saved index is used, so there is nothing to report
+        reporter = test_progress.RecordingReporter()
+        self.open_dump(reporter=reporter)
+        self.assertEqual([], reporter.events)
+
+    def test_saved_index_same_second(self):
+        self.open_dump()
+        st = os.stat(self.dump_name)
+        index_name = self.dump_name + '.offsets'
+        second = int(st.st_mtime)
+        os.utime(self.dump_name, (second + 0.25, second + 0.25))
+        self.open_dump()
+        st = os.stat(self.dump_name)
+        self.assertNotEqual(None, lazyload._read_index(index_name, st))
+        # Rewritten within the same second, at the same size
+        os.utime(self.dump_name, (second + 0.75, second + 0.75))
+        st = os.stat(self.dump_name)
+        self.assertEqual(None, lazyload._read_index(index_name, st))
+
+    def test_saved_index(self):
+        self.open_dump()
+        index_name = self.dump_name + '.offsets'
+        self.assertTrue(os.path.exists(index_name))
+        om = self.open_dump()
+        self.assertEqual([4, 5, 8], om[7].children)
+        # A stale index is rebuilt
+        f = open(self.dump_name, 'ab')
+        f.write(b'{"address": 10, "type": "int", "size": 12, "value": 3,'
+                b' "refs": []}\n')
+        f.close()
+        om = self.open_dump()
+        self.assertEqual(3, om[10].value)
+
+    def test_no_saved_index(self):
+        self.open_dump(save_index=False)
+        self.assertFalse(os.path.exists(self.dump_name + '.offsets'))
+
+    def test_refs_as_dict(self):
+        om = self.open_dump()
+        as_dict = om.refs_as_dict(om[2])
+        self.assertEqual(1, as_dict[2])
+        self.assertEqual([2, 1, u'a unicode'], om.refs_as_list(om[7]))
+
+    def test_compressed(self):
+        gz_name = os.path.join(self.tempdir, 'dump.json.gz')
+        f = gzip.GzipFile(gz_name, 'wb')
+        f.write(test_loader._example_dump[0] + b'\n')
+        f.close()
+        self.assertRaises(ValueError, lazyload.open_dump, gz_name)
+        bz2_name = os.path.join(self.tempdir, 'dump.json.bz2')
+        f = open(bz2_name, 'wb')
+        try:
+            f.write(bz2.compress(test_loader._example_dump[0] + b'\n'))
+        finally:
+            f.close()
+        self.assertRaises(ValueError, lazyload.open_dump, bz2_name)
+        self.assertFalse(os.path.exists(bz2_name + '.offsets'))
@@ -203,12 +203,65 @@ class TestLoad(tests.TestCase):
         self.assertEqual(2, len(the_ints))
         self.assertEqual([4, 5], sorted([i.address for i in the_ints]))
 
+    def test_select(self):
+        om = loader.load(_example_dump, show_prog=False)
+        self.assertEqual([4, 5], sorted([o.address
+                                         for o in om.select('int')]))
+        self.assertEqual([9, 8, 3], [o.address for o in om.select(size_gt=40)])
+
+    def test_get_all_type_index(self):
+        om = loader.load(_example_dump, show_prog=False, type_index=True)
+        self.assertTrue(om.objs.has_type_index)
+        the_ints = om.get_all('int')
+        self.assertEqual([4, 5], sorted([i.address for i in the_ints]))
+
+    def test_load_dense_index(self):
+        om = loader.load(_example_dump, show_prog=False, dense_index=True)
+        self.assertTrue(om.objs.has_index)
+        om.compute_total_size(om[9])
+        self.assertEqual(345, om[9].total_size)
+
     def test_one(self):
         om = loader.load(_example_dump, show_prog=False)
         an_int = om[5]
         self.assertEqual(5, an_int.address)
         self.assertEqual('int', an_int.type_str)
 
+    def assertSummaryEqual(self, expected, summary):
+        # max_address is left out, ties depend on the order objects are seen
+        self.assertEqual(expected.total_count, summary.total_count)
+        self.assertEqual(expected.total_size, summary.total_size)
+        self.assertEqual(
+            sorted((s.type_str, s.count, s.total_size, s.sq_sum, s.max_size)
+                   for s in expected.type_summaries.values()),
+            sorted((s.type_str, s.count, s.total_size, s.sq_sum, s.max_size)
+                   for s in summary.type_summaries.values()))
+
+    def test_summarize_file(self):
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        # Objects dumped twice are only counted once
+        lines = ([b'[\n'] + [line + b',\n' for line in _example_dump]
+                 + [_example_dump[2] + b'\n', b']\n'])
+        summary = loader.summarize_file(lines, show_prog=False)
+        self.assertSummaryEqual(manager.summarize(), summary)
+        self.assertEqual(repr(manager.summarize()), repr(summary))
+
+    def test_summarize_file_compressed(self):
+        fd, name = tempfile.mkstemp(prefix='meliae-')
+        f = os.fdopen(fd, 'wb')
+        try:
+            content = gzip.GzipFile(mode='wb', compresslevel=6, fileobj=f)
+            for line in _example_dump:
+                content.write(line + b'\n')
+            content.close()
+            f.close()
+            summary = loader.summarize_file(name, show_prog=False)
+        finally:
+            f.close()
+            os.remove(name)
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        self.assertSummaryEqual(manager.summarize(), summary)
+
 
 class TestRemoveExpensiveReferences(tests.TestCase):
 
@@ -368,6 +421,36 @@ class TestObjManager(tests.TestCase):
         self.assertEqual('<ex-reference>', null_obj.type_str)
         self.assertEqual([12, 0], mymod_dict.children)
 
+    def test_remove_expensive_references_updates_parents(self):
+        lines = list(_example_dump)
+        lines.pop(-1) # Remove the old module
+        lines.append(b'{"address": 9, "type": "module", "size": 12'
+                     b', "name": "mymod", "refs": [10]}')
+        lines.append(b'{"address": 10, "type": "dict", "size": 124'
+                     b', "refs": [11, 12]}')
+        lines.append(b'{"address": 11, "type": "module", "size": 12'
+                     b', "name": "mod2", "refs": [13]}')
+        lines.append(b'{"address": 12, "type": "str", "size": 27'
+                     b', "value": "boo", "refs": []}')
+        lines.append(b'{"address": 13, "type": "dict", "size": 124'
+                     b', "refs": []}')
+        manager = loader.load(lines, show_prog=False, collapse=False)
+        manager.compute_parents()
+        self.assertEqual([10], manager[11].parents)
+        manager.remove_expensive_references()
+        self.assertEqual((), manager[11].parents)
+        self.assertEqual([10], manager[0].parents)
+        self.assertEqual([10], manager[12].parents)
+
+    def test_remove_expensive_references_types(self):
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        self.assertEqual(3, manager.remove_expensive_references(
+            noref_types=('int',)))
+        self.assertEqual([3, 8, 0], manager[3].children)
+        self.assertEqual([8, 0], manager[7].children)
+        self.assertEqual([6, 7, 0], manager[2].children)
+        self.assertEqual([2], manager[9].children)
+
     def test_collapse_instance_dicts(self):
         manager = loader.load(_instance_dump, show_prog=False, collapse=False)
         # This should collapse all of the references from the instance's dict
@@ -396,6 +479,75 @@ class TestObjManager(tests.TestCase):
         self.assertEqual([5, 6, 9, 6], mod.children)
         self.assertFalse(15 in manager.objs)
 
+    def test_collapse_instance_dicts_updates_parents(self):
+        manager = loader.load(_instance_dump, show_prog=False, collapse=False)
+        manager.compute_parents()
+        self.assertEqual([2, 7, 15], sorted(manager[6].parents))
+        def compute_parents():
+            self.fail('collapse_instance_dicts should only patch parents')
+        manager.compute_parents = compute_parents
+        manager.collapse_instance_dicts()
+        self.assertEqual([1, 7, 14], sorted(manager[6].parents))
+        self.assertEqual([1, 14], sorted(manager[5].parents))
+        self.assertEqual([1], manager[3].parents)
+        self.assertEqual([1], manager[7].parents)
+
+    def test_compute_dominators(self):
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        objs = manager.objs
+        # 1 and 9 are the roots, and both of them refer to 2
+        self.assertEqual(9, manager.compute_dominators())
+        self.assertEqual(64, objs[1].retained_size)
+        self.assertEqual(60, objs[9].retained_size)
+        self.assertEqual(None, objs[2].immediate_dominator)
+        self.assertEqual(173, objs[2].retained_size)
+        self.assertEqual(2, objs[7].immediate_dominator.address)
+        self.assertEqual(7, manager.compute_dominators(roots=[9]))
+        self.assertEqual(345, objs[9].retained_size)
+        self.assertEqual(None, objs[1].retained_size)
+
+    def test_summarize_retained(self):
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        summary = manager.summarize_retained(top=3)
+        self.assertEqual(409, summary.total_size)
+        self.assertEqual(('dict', 1, 173, 173, 2), summary.type_summaries[0])
+        self.assertEqual([(173, 2, 'dict'), (88, 8, six.text_type.__name__),
+                          (64, 1, 'tuple')], summary.top_retainers)
+        self.assertTrue(repr(summary).startswith(
+            'Total 7 types, Retained size = 0.0MiB (409 bytes)\n'))
+
+    def test_strongly_connected_components(self):
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        # 3 refers to itself, but nothing else is in a cycle
+        cycles = manager.strongly_connected_components()
+        self.assertEqual(1, len(cycles))
+        self.assertEqual([(manager[3].component_id, 1, 44)], cycles.by_size)
+        self.assertEqual(cycles.by_size, cycles.by_count)
+        self.assertNotEqual(manager[1].component_id, manager[2].component_id)
+
+    def test_path_to_root(self):
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        paths = manager.path_to_root(manager[8])
+        self.assertEqual([[1, 3, 8]],
+                         [[obj.address for obj in path] for path in paths])
+        paths = manager.path_to_root(8, roots=[9])
+        self.assertEqual([[9, 2, 7, 8]],
+                         [[obj.address for obj in path] for path in paths])
+
+    def test_load_computes_parents_once(self):
+        calls = []
+        orig_compute_parents = loader.ObjManager.compute_parents
+        def compute_parents(manager):
+            calls.append(manager)
+            return orig_compute_parents(manager)
+        loader.ObjManager.compute_parents = compute_parents
+        try:
+            manager = loader.load(_instance_dump, show_prog=False)
+        finally:
+            loader.ObjManager.compute_parents = orig_compute_parents
+        self.assertEqual([manager], calls)
+        self.assertEqual([1, 7, 14], sorted(manager[6].parents))
+
     def test_collapse_old_instance_dicts(self):
         manager = loader.load(_old_instance_dump, show_prog=False,
                               collapse=False)
@@ -416,6 +568,17 @@ class TestObjManager(tests.TestCase):
         self.assertEqual([4, 5, 6, 7, 2], instance.children)
         self.assertEqual('OldStyle', instance.type_str)
 
+    def test_collapse_updates_type_index(self):
+        manager = loader.load(_old_instance_dump, show_prog=False,
+                              collapse=False)
+        manager.build_type_index()
+        self.assertEqual([3], [o.address for o in manager.get_all('dict')])
+        manager.compute_parents()
+        manager.collapse_instance_dicts()
+        self.assertEqual([], manager.get_all('dict'))
+        self.assertEqual([], manager.get_all('instance'))
+        self.assertEqual([1], [o.address for o in manager.get_all('OldStyle')])
+
     def test_expand_refs_as_dict(self):
         # TODO: This test fails if simplejson is not installed, because the
         #       regex extractor does not cast to integers (they stay as
@@ -441,6 +604,37 @@ class TestObjManager(tests.TestCase):
         obj = manager.guess_intern_dict()
         self.assertEqual(8, obj.address)
 
+    def test_summarize(self):
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        summary = manager.summarize()
+        self.assertEqual(9, summary.total_count)
+        self.assertEqual(409, summary.total_size)
+        int_summary = summary.type_summaries['int']
+        self.assertEqual(2, int_summary.count)
+        self.assertEqual(24, int_summary.total_size)
+        tuple_summary = summary.type_summaries['tuple']
+        self.assertEqual(2, tuple_summary.count)
+        self.assertEqual(20, tuple_summary.max_size)
+        self.assertEqual(1, tuple_summary.max_address)
+
+    def test_summarize_repr(self):
+        manager = loader.load(_example_dump, show_prog=False, collapse=False)
+        summary = manager.summarize()
+        self.assertEqual(
+            'Total 9 objects, 7 types, Total size = 0.0MiB (409 bytes)\n'
+            ' Index   Count   %%      Size   %% Cum     Max Kind\n'
+            '     0       1  11       124  30  30     124 dict\n'
+            '     1       1  11        88  21  51      88 %s\n'
+            '     2       1  11        60  14  66      60 module\n'
+            '     3       1  11        44  10  77      44 list\n'
+            '     4       2  22        40   9  87      20 tuple\n'
+            '     5       1  11        29   7  94      29 %s\n'
+            '     6       2  22        24   5 100      12 int'
+            % (six.text_type.__name__, bytes.__name__), repr(summary))
+        summary.by_count()
+        self.assertEqual(['tuple', 'int'],
+                         [s.type_str for s in summary.summaries[:2]])
+
     def test_summarize_refs(self):
         manager = loader.load(_example_dump, show_prog=False)
         summary = manager.summarize(manager[9])
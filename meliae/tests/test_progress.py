@@ -0,0 +1,219 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Report the progress of long running work."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import six
+
+import meliae
+from meliae import (
+    loader,
+    progress,
+    tests,
+    )
+from meliae.tests import test_loader
+
+
+class RecordingReporter(progress.ProgressReporter):
+    """Remember every event, and report progress on every update."""
+
+    interval = 0
+
+    def __init__(self):
+        self.events = []
+
+    def phase_started(self, phase):
+        self.events.append(('start', phase.name))
+
+    def phase_progress(self, phase):
+        self.events.append(('progress', phase.name, phase.items))
+
+    def phase_finished(self, phase):
+        self.events.append(('finish', phase.name, phase.items))
+
+
+class TestPhase(tests.TestCase):
+
+    def test_update_and_finish(self):
+        reporter = RecordingReporter()
+        phase = reporter.start_phase('loading', total_bytes=100)
+        phase.update(items=10, bytes_read=50)
+        phase.update(items=20, bytes_read=100, types=3)
+        self.assertFalse(phase.finished)
+        phase.finish(items=25)
+        self.assertTrue(phase.finished)
+        self.assertEqual([('start', 'loading'), ('progress', 'loading', 10),
+                          ('progress', 'loading', 20),
+                          ('finish', 'loading', 25)], reporter.events)
+        self.assertEqual(100, phase.bytes_read)
+        self.assertEqual({'types': 3}, phase.extra)
+        self.assertTrue(phase.elapsed >= 0)
+        if progress.get_rss() is not None:
+            self.assertTrue(phase.peak_rss > 0)
+
+    def test_exact_peak(self):
+        outer = progress.ProgressReporter().start_phase('outer')
+        if not outer.exact_peak:
+            raise unittest.SkipTest('the peak RSS cannot be reset')
+        start = progress.get_rss()
+        # Allocate and free 64MiB without updating the phase
+        data = b'x' * (64 * 1024 * 1024)
+        del data
+        # A nested phase resets the high water mark, but the outer one keeps
+        # the peak it had
+        inner = progress.ProgressReporter().start_phase('inner')
+        inner.finish()
+        outer.finish()
+        self.assertTrue(outer.peak_rss >= start + 60 * 1024 * 1024,
+                        (outer.peak_rss, start))
+        self.assertTrue(inner.peak_rss < outer.peak_rss)
+
+    def test_throttled(self):
+        reporter = RecordingReporter()
+        reporter.interval = 3600
+        phase = reporter.start_phase('loading')
+        phase.update(items=10)
+        phase.finish(items=20)
+        self.assertEqual([('start', 'loading'), ('finish', 'loading', 20)],
+                         reporter.events)
+
+    def test_as_dict(self):
+        phase = progress.ProgressReporter().start_phase('collapsing',
+                                                        total_items=10)
+        phase.finish(items=10, collapsed=2)
+        record = phase.as_dict()
+        self.assertEqual('collapsing', record['phase'])
+        self.assertEqual(10, record['items'])
+        self.assertEqual(10, record['total_items'])
+        self.assertEqual(2, record['collapsed'])
+        self.assertEqual(None, record['bytes_read'])
+
+
+class TestReporters(tests.TestCase):
+
+    def test_stderr(self):
+        out = six.StringIO()
+        reporter = progress.StderrReporter(out)
+        reporter.interval = 0
+        phase = reporter.start_phase('loading', total_bytes=2 * 1024 * 1024)
+        phase.update(items=10, bytes_read=1024 * 1024)
+        phase.finish(items=20, collapsed=1)
+        lines = out.getvalue().split('\r')
+        self.assertEqual('loading...', lines[0])
+        self.assertTrue(lines[1].startswith(
+            'loading... 10 objs,   1.0 /   2.0 MiB read in '), lines[1])
+        self.assertTrue(lines[2].startswith(
+            'loading: 20 objs, collapsed 1,   1.0 /   2.0 MiB read in '),
+            lines[2])
+        self.assertTrue(lines[2].endswith('\n'))
+
+    def test_json_lines(self):
+        out = six.StringIO()
+        reporter = progress.JSONLinesReporter(out)
+        phase = reporter.start_phase('set parents', total_items=5)
+        phase.update(items=3)
+        phase.finish(items=5)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(['start', 'finish'],
+                         [r['event'] for r in records])
+        self.assertEqual('set parents', records[1]['phase'])
+        self.assertEqual(5, records[1]['items'])
+        self.assertEqual(meliae.__version__, records[1]['meliae_version'])
+        for key in ('elapsed', 'peak_rss', 'time', 'python_version'):
+            self.assertTrue(key in records[1], key)
+
+    def test_json_lines_progress(self):
+        out = six.StringIO()
+        reporter = progress.JSONLinesReporter(out, progress_events=True)
+        reporter.interval = 0
+        phase = reporter.start_phase('loading')
+        phase.update(items=3)
+        phase.finish(items=5)
+        self.assertEqual(['start', 'progress', 'finish'],
+                         [json.loads(line)['event']
+                          for line in out.getvalue().splitlines()])
+
+    def test_json_lines_file(self):
+        tempdir = tempfile.mkdtemp(prefix='meliae-')
+        self.addCleanup(shutil.rmtree, tempdir)
+        name = os.path.join(tempdir, 'progress.jsonl')
+        for i in range(2):
+            reporter = progress.JSONLinesReporter(name)
+            reporter.start_phase('loading').finish(items=i)
+            reporter.close()
+        f = open(name)
+        try:
+            records = [json.loads(line) for line in f]
+        finally:
+            f.close()
+        # The file is appended to
+        self.assertEqual([0, 0, 0, 1], [r['items'] for r in records])
+
+    def test_multi(self):
+        first = RecordingReporter()
+        second = RecordingReporter()
+        second.interval = None
+        reporter = progress.MultiReporter([first, second])
+        self.assertEqual(0, reporter.interval)
+        phase = reporter.start_phase('loading')
+        phase.update(items=1)
+        phase.finish(items=2)
+        self.assertEqual(3, len(first.events))
+        self.assertEqual([('start', 'loading'), ('finish', 'loading', 2)],
+                         second.events)
+
+    def test_get_reporter(self):
+        reporter = RecordingReporter()
+        self.assertTrue(progress.get_reporter(True, reporter) is reporter)
+        self.assertTrue(isinstance(progress.get_reporter(True),
+                                   progress.StderrReporter))
+        self.assertEqual(progress.ProgressReporter,
+                         type(progress.get_reporter(False)))
+
+
+class TestLoaderPhases(tests.TestCase):
+
+    def finished(self, reporter):
+        return [event[1:] for event in reporter.events
+                if event[0] == 'finish']
+
+    def test_load(self):
+        reporter = RecordingReporter()
+        manager = loader.load(test_loader._example_dump, reporter=reporter)
+        # The module's dict is collapsed into it
+        self.assertEqual([('loading', 9), ('collapsing', 9),
+                          ('set parents', 8)], self.finished(reporter))
+        self.assertTrue(manager.reporter is reporter)
+        manager.remove_expensive_references()
+        self.assertEqual(('removing expensive refs', 8),
+                         self.finished(reporter)[-1])
+
+    def test_summarize_file(self):
+        reporter = RecordingReporter()
+        loader.summarize_file(test_loader._example_dump, reporter=reporter)
+        self.assertEqual([('summarizing', 9)], self.finished(reporter))
+
+    def test_stream_remove_expensive_references(self):
+        reporter = RecordingReporter()
+        source = lambda: loader.iter_objs(test_loader._example_dump)
+        list(loader.remove_expensive_references(source, reporter=reporter))
+        self.assertEqual([('finding expensive refs', 9),
+                          ('removing expensive refs', 9)],
+                         self.finished(reporter))
@@ -0,0 +1,75 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Sort dump files by address."""
+
+import os
+import random
+import shutil
+import tempfile
+
+import six
+
+from meliae import (
+    sortdump,
+    tests,
+    )
+
+
+def _line(address):
+    return (b'{"address": %d, "type": "int", "size": 12, "value": %d'
+            b', "refs": []}\n' % (address, address))
+
+
+class TestSortDump(tests.TestCase):
+
+    def setUp(self):
+        super(TestSortDump, self).setUp()
+        self.tmpdir = tempfile.mkdtemp(prefix='meliae-')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def sort(self, lines, **kwargs):
+        out = six.BytesIO()
+        count = sortdump.sort_dump(lines, out, tmpdir=self.tmpdir, **kwargs)
+        return count, out.getvalue().splitlines(True)
+
+    def test_in_memory(self):
+        lines = [b'[\n', _line(3).replace(b'}\n', b'},\n'), _line(10),
+                 _line(2), _line(3), b']\n']
+        self.assertEqual((3, [_line(2), _line(3), _line(10)]),
+                         self.sort(lines))
+
+    def test_external(self):
+        addresses = list(range(1000)) * 2
+        random.Random(42).shuffle(addresses)
+        lines = [_line(a) for a in addresses]
+        # Each run holds about 10 lines, and there are too many runs to merge
+        # in one go
+        orig_fan_in = sortdump._MAX_FAN_IN
+        sortdump._MAX_FAN_IN = 8
+        try:
+            count, result = self.sort(lines, memory=2000)
+        finally:
+            sortdump._MAX_FAN_IN = orig_fan_in
+        self.assertEqual(1000, count)
+        self.assertEqual([_line(a) for a in range(1000)], result)
+        # The runs have been cleaned up
+        self.assertEqual([], os.listdir(self.tmpdir))
+
+    def test_keeps_different_lines_for_one_address(self):
+        other = _line(5).replace(b'"size": 12', b'"size": 16')
+        count, result = self.sort([other, _line(5), _line(4)], memory=1)
+        self.assertEqual(3, count)
+        self.assertEqual([_line(4)], result[:1])
+        self.assertEqual(sorted([other, _line(5)]), sorted(result[1:]))
@@ -0,0 +1,124 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keep a dump in a SQLite database."""
+
+import os
+import shutil
+import tempfile
+
+from meliae import (
+    loader,
+    sqlstore,
+    tests,
+    )
+from meliae.tests import test_loader
+
+
+class TestDBObjManager(tests.TestCase):
+
+    def setUp(self):
+        super(TestDBObjManager, self).setUp()
+        self.tempdir = tempfile.mkdtemp(prefix='meliae-')
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.db_name = os.path.join(self.tempdir, 'dump.db')
+        # Repeated objects are only stored once
+        lines = list(test_loader._example_dump) + [test_loader._example_dump[2]]
+        self.om = sqlstore.load_db(lines, self.db_name, show_prog=False)
+        self.addCleanup(self.om.close)
+        self.manager = loader.load(test_loader._example_dump, show_prog=False,
+                                   collapse=False)
+
+    def assertSummaryEqual(self, expected, summary):
+        # max_address is left out, ties depend on the order objects are seen
+        self.assertEqual(expected.total_count, summary.total_count)
+        self.assertEqual(expected.total_size, summary.total_size)
+        self.assertEqual(
+            sorted((s.type_str, s.count, s.total_size, s.sq_sum, s.max_size)
+                   for s in expected.type_summaries.values()),
+            sorted((s.type_str, s.count, s.total_size, s.sq_sum, s.max_size)
+                   for s in summary.type_summaries.values()))
+
+    def test_getitem(self):
+        self.assertEqual(9, len(self.om))
+        self.assertTrue(7 in self.om)
+        self.assertFalse(10 in self.om)
+        obj = self.om[7]
+        self.assertEqual(7, obj.address)
+        self.assertEqual('tuple', obj.type_str)
+        self.assertEqual(20, obj.size)
+        self.assertEqual([4, 5, 8], obj.children)
+        self.assertEqual([2], obj.parents)
+        self.assertEqual(1, self.om[5].value)
+        self.assertEqual(b'mymod', self.om[9].value)
+        self.assertRaises(KeyError, self.om.__getitem__, 10)
+
+    def test_parents(self):
+        # The list references itself, it is only listed once
+        self.assertEqual([1, 3], self.om[3].parents)
+        self.assertEqual([2, 3, 7], self.om.parents_of(4))
+        self.om.max_parents = 2
+        self.assertEqual([2, 3], self.om[4].parents)
+
+    def test_open_db(self):
+        om = sqlstore.open_db(self.db_name)
+        self.addCleanup(om.close)
+        self.assertEqual(9, len(om))
+        self.assertEqual([3, 4, 5, 8], om[3].children)
+
+    def test_get_all(self):
+        self.assertEqual([4, 5], sorted(o.address
+                                        for o in self.om.get_all('int')))
+        self.assertEqual([], self.om.get_all('float'))
+
+    def test_summarize(self):
+        summary = self.om.summarize()
+        self.assertSummaryEqual(self.manager.summarize(), summary)
+        self.assertEqual(1, summary.type_summaries['tuple'].max_address)
+
+    def test_summarize_refs(self):
+        self.assertSummaryEqual(self.manager.summarize(self.manager[9]),
+                                self.om.summarize(self.om[9]))
+        self.assertSummaryEqual(
+            self.manager.summarize(self.manager[9], excluding=[4, 5]),
+            self.om.summarize(9, excluding=[4, 5]))
+
+    def test_summarize_excluding(self):
+        summary = self.om.summarize(excluding=[4, 5])
+        self.assertEqual(7, summary.total_count)
+        self.assertFalse('int' in summary.type_summaries)
+
+    def test_refs_as_dict(self):
+        as_dict = self.om.refs_as_dict(self.om[2])
+        self.assertEqual(2, len(as_dict))
+        self.assertEqual(1, as_dict[2])
+        self.assertEqual(7, as_dict[b'a str'].address)
+
+    def test_refs_as_list(self):
+        as_list = self.om.refs_as_list(self.om[7])
+        self.assertEqual([2, 1, u'a unicode'], as_list)
+
+    def test_big_int(self):
+        big = 123456789012345678901234567890
+        lines = [b'{"address": 1, "type": "int", "size": 40, "value": %d,'
+                 b' "refs": []}' % (big,),
+                 b'{"address": 2, "type": "int", "size": 40, "value": %d,'
+                 b' "refs": []}' % (-big,),
+                 b'{"address": 3, "type": "list", "size": 80, "len": 2,'
+                 b' "refs": [1, 2]}']
+        om = sqlstore.load_db(lines, os.path.join(self.tempdir, 'big.db'),
+                              show_prog=False)
+        self.addCleanup(om.close)
+        self.assertEqual(big, om[1].value)
+        self.assertEqual([big, -big], om.refs_as_list(om[3]))
@@ -0,0 +1,101 @@
+# Copyright (C) 2009, 2010 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Remove objects that were dumped more than once."""
+
+import gzip
+import os
+import shutil
+import tempfile
+
+import six
+
+from meliae import (
+    _intset,
+    strip_duplicates,
+    tests,
+    )
+
+
+def _line(address):
+    return b'{"address": %d, "type": "int", "size": 12, "refs": []}\n' % (
+        address,)
+
+
+_dump = [b'[\n', _line(1), _line(2), _line(1), _line(3), _line(2),
+         b']\n']
+
+
+class TestFilterLines(tests.TestCase):
+
+    def test_filter_lines(self):
+        seen = _intset.IDSet()
+        self.assertEqual((_line(1) + _line(2) + _line(3), 7),
+                         seen.filter_lines(b''.join(_dump)))
+        self.assertEqual(3, len(seen))
+        # Already seen, and the last line doesn't need a newline
+        self.assertEqual((_line(4)[:-1], 2),
+                         seen.filter_lines(_line(2) + _line(4)[:-1]))
+        self.assertTrue(4 in seen)
+
+    def test_filter_lines_not_bytes(self):
+        seen = _intset.IDSet()
+        self.assertRaises(TypeError, seen.filter_lines, u'foo')
+
+
+class TestStripDuplicates(tests.TestCase):
+
+    def setUp(self):
+        super(TestStripDuplicates, self).setUp()
+        self.tmpdir = tempfile.mkdtemp(prefix='meliae-')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_iter_blocks_splits_on_lines(self):
+        content = b''.join(_line(i) for i in range(100))
+        for infile in [six.BytesIO(content), iter(content.splitlines(True))]:
+            blocks = list(strip_duplicates.iter_blocks(infile, block_size=100))
+            self.assertEqual(content, b''.join(blocks))
+            for block in blocks:
+                self.assertTrue(block.endswith(b'\n'))
+
+    def test_iter_blocks_mmap(self):
+        content = b''.join(_line(i) for i in range(100))
+        path = os.path.join(self.tmpdir, 'dump')
+        with open(path, 'wb') as f:
+            f.write(content)
+        with open(path, 'rb') as f:
+            f.read(10)
+            f.seek(0)
+            blocks = list(strip_duplicates.iter_blocks(f, block_size=100))
+        self.assertEqual(content, b''.join(blocks))
+        self.assertTrue(len(blocks) > 10)
+
+    def test_strip_duplicate(self):
+        out = six.BytesIO()
+        self.assertEqual((7, 3), strip_duplicates.strip_duplicate(
+            six.BytesIO(b''.join(_dump)), out, show_progress=False))
+        self.assertEqual(_line(1) + _line(2) + _line(3), out.getvalue())
+
+    def test_main_gzip(self):
+        in_path = os.path.join(self.tmpdir, 'in.json.gz')
+        out_path = os.path.join(self.tmpdir, 'out.json.gz')
+        f = gzip.GzipFile(in_path, 'wb')
+        f.write(b''.join(_dump))
+        f.close()
+        self.assertEqual(0, strip_duplicates.main(['-q', in_path, out_path]))
+        f = gzip.GzipFile(out_path, 'rb')
+        try:
+            self.assertEqual(_line(1) + _line(2) + _line(3), f.read())
+        finally:
+            f.close()
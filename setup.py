@@ -38,7 +38,11 @@ def config():
         "license": "GNU GPL v3",
         "download_url": "https://launchpad.net/meliae/+download",
         "packages": ["meliae"],
-        "scripts": ["strip_duplicates.py"],
+        "entry_points": {
+            "console_scripts": [
+                "meliae-strip-duplicates = meliae.strip_duplicates:main",
+            ],
+        },
         "ext_modules": ext,
         "classifiers": [
             'Development Status :: 4 - Beta',